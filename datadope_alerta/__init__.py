@@ -1,8 +1,8 @@
 import builtins
+import contextvars
 import json
 import logging
 import os
-import threading
 from collections.abc import MutableMapping
 from dataclasses import dataclass
 from datetime import datetime, date
@@ -23,7 +23,41 @@ import pytz
 from alerta.models.alert import Alert
 from alerta.utils.format import CustomJSONEncoder as AlertaCustomJSONEncoder
 
-thread_local = threading.local()
+
+
+class ContextLocal:
+    """
+    Storage of attributes local to the execution context, like `threading.local`.
+
+    Each thread has its own values. Functions executed with a copy of the context of another thread
+    (see `datadope_alerta.plugins.delivery.DeliveryPool`) see the values of that thread, and their changes are not
+    visible outside the copied context.
+    """
+
+    def __init__(self):
+        object.__setattr__(self, '_values', contextvars.ContextVar(f"context_local_{id(self)}"))
+
+    def __getattr__(self, name):
+        try:
+            return self._values.get()[name]
+        except (LookupError, KeyError):
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        # Copy on write, so values are never shared by different contexts
+        values = dict(self._values.get({}))
+        values[name] = value
+        self._values.set(values)
+
+    def __delattr__(self, name):
+        values = dict(self._values.get({}))
+        if name not in values:
+            raise AttributeError(name)
+        del values[name]
+        self._values.set(values)
+
+
+thread_local = ContextLocal()
 
 db_alerters = None
 
@@ -64,6 +98,327 @@ Default: 60 sec.
 
 DEFAULT_AUTO_RESOLVE_TASK_INTERVAL = 60.0
 
+CONFIG_REDIS_URL = 'REDIS_URL'
+"""
+Configuration var with the url of the redis server used by caches and other shared state of the alerters.
+
+Default: value of CELERY_BROKER_URL configuration var.
+"""
+
+CONFIG_ALERTER_STATUS_CACHE = 'ALERTER_STATUS_CACHE'
+"""
+Configuration var to enable a read-through cache in redis of the alerters status.
+Cached statuses of an alert are invalidated every time one of them changes. Database is always the source of truth.
+
+Default: False
+"""
+
+DEFAULT_ALERTER_STATUS_CACHE = False
+
+CONFIG_ALERTER_STATUS_CACHE_TTL = 'ALERTER_STATUS_CACHE_TTL'
+"""
+Configuration var for the time to live of the cached alerters status of an alert.
+Statuses are cached again the next time they are read after a change.
+
+Default: 86400 sec.
+"""
+
+DEFAULT_ALERTER_STATUS_CACHE_TTL = 86400
+
+CONFIG_ALERTER_DATA_RETENTION = 'ALERTER_DATA_RETENTION'
+"""
+Configuration var with the number of alerter data records to keep for each alert, alerter and operation
+(repeat or action name). Older records are removed and added to a summary of the operation.
+Key '*' applies to operations not included in the dict. Operations 'new' and 'recovery' are not affected.
+
+Periodic task to compact alerter data is only scheduled if this var is provided.
+
+Default: {} (all records are kept)
+"""
+
+DEFAULT_ALERTER_DATA_RETENTION = {}
+
+CONFIG_ALERTER_DATA_RETENTION_TASK_INTERVAL = 'ALERTER_DATA_RETENTION_TASK_INTERVAL'
+"""
+Configuration var for the interval of the periodic task to compact alerter data.
+
+Default: 3600 sec.
+"""
+
+DEFAULT_ALERTER_DATA_RETENTION_TASK_INTERVAL = 3600.0
+
+CONFIG_ALERTER_DATA_RETENTION_CHUNK_SIZE = 'ALERTER_DATA_RETENTION_CHUNK_SIZE'
+"""
+Configuration var for the number of alert, alerter and operation groups compacted in each database transaction
+by the periodic task to compact alerter data.
+
+Default: 500
+"""
+
+DEFAULT_ALERTER_DATA_RETENTION_CHUNK_SIZE = 500
+
+CONFIG_RESPONSE_MAX_VALUE_LENGTH = 'RESPONSE_MAX_VALUE_LENGTH'
+"""
+Configuration var for the maximum length of string values in the responses of alerters and recovery actions
+stored in database. Longer values are truncated including a truncation marker. 0 for no limit.
+
+Default: 32768
+"""
+
+DEFAULT_RESPONSE_MAX_VALUE_LENGTH = 32768
+
+CONFIG_RESPONSE_COMPRESSION_THRESHOLD = 'RESPONSE_COMPRESSION_THRESHOLD'
+"""
+Configuration var for the size of the serialized response of alerters and recovery actions over which
+the response is stored compressed. 0 for no compression.
+
+Default: 16384
+"""
+
+DEFAULT_RESPONSE_COMPRESSION_THRESHOLD = 16384
+
+CONFIG_RESPONSE_TRACEBACK_DEDUPLICATION = 'RESPONSE_TRACEBACK_DEDUPLICATION'
+"""
+Configuration var to store the tracebacks included in responses only once in a separate table,
+referenced by hash from the responses.
+
+Default: True
+"""
+
+DEFAULT_RESPONSE_TRACEBACK_DEDUPLICATION = True
+
+CONFIG_ALERTERS_TASK_FAN_OUT = 'ALERTERS_TASK_FAN_OUT'
+"""
+Configuration var to execute in only one background task the alerters of an alert that share operation,
+task definition (queue, priority...) and delay, instead of scheduling a task for each alerter.
+Status and retries are still managed for each alerter. Retries are scheduled as independent tasks.
+
+Default: False
+"""
+
+DEFAULT_ALERTERS_TASK_FAN_OUT = False
+
+CONFIG_ALERTERS_TASK_FAN_OUT_THREADS = 'ALERTERS_TASK_FAN_OUT_THREADS'
+"""
+Configuration var with the number of threads used by a fan-out task to execute its alerters.
+With 1 thread, alerters are executed in sequence.
+
+Default: 1
+"""
+
+DEFAULT_ALERTERS_TASK_FAN_OUT_THREADS = 1
+
+CONFIG_ALERT_SNAPSHOT_IN_TASKS = 'ALERT_SNAPSHOT_IN_TASKS'
+"""
+Configuration var to include a copy of the alert (without history) in the payload of alerters and recovery actions
+background tasks. Workers use the copy instead of reading the alert if the alert update time, status and last receive
+id have not changed since the task was scheduled.
+
+Default: False
+"""
+
+DEFAULT_ALERT_SNAPSHOT_IN_TASKS = False
+
+CONFIG_WORKER_WARM_UP = 'WORKER_WARM_UP'
+"""
+Configuration var to warm up each celery worker process when it starts: alerters of configured plugins are
+instantiated (importing their modules and reading their configuration), recovery actions providers are imported,
+alerters templates are compiled and a database connection is opened (only if DATABASE_POOL_SIZE > 0).
+
+Default: True
+"""
+
+DEFAULT_WORKER_WARM_UP = True
+
+CONFIG_METRICS_FLUSH_INTERVAL = 'METRICS_FLUSH_INTERVAL'
+"""
+Configuration var for the interval between flushes of the metrics aggregated in memory by each process.
+Count and total time of timers are added to the metrics table and latency histograms are stored in redis.
+
+Default: 10.0 sec.
+"""
+
+DEFAULT_METRICS_FLUSH_INTERVAL = 10.0
+
+CONFIG_METRICS_HISTOGRAM_BUCKETS = 'METRICS_HISTOGRAM_BUCKETS'
+"""
+Configuration var with the upper bounds (in seconds) of the buckets of latency histograms.
+
+Default: [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+"""
+
+DEFAULT_METRICS_HISTOGRAM_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+CONFIG_DELIVERY_POOL_THREADS = 'DELIVERY_POOL_THREADS'
+"""
+Configuration var with the number of threads of the pool used by each process to deliver notifications of an
+alerter to several destinations concurrently (see datadope_alerta.plugins.DeliveryPool). The concurrency of
+each alerter is limited by the 'delivery_concurrency' entry of its configuration (4 by default).
+
+Default: 20
+"""
+
+DEFAULT_DELIVERY_POOL_THREADS = 20
+
+CONFIG_ALERTERS_MAX_DEFERRALS = 'ALERTERS_MAX_DEFERRALS'
+"""
+Configuration var with the max number of times an alerter task or a digest is rescheduled because its destination
+is rate limited or its circuit is open (deferrals). Once reached, these errors are handled as retryable errors,
+following the retry policy, so the task finally fails if the destination doesn't accept the request.
+
+Default: 50
+"""
+
+DEFAULT_ALERTERS_MAX_DEFERRALS = 50
+
+CONFIG_DELAYED_SCHEDULER = 'DELAYED_SCHEDULER'
+"""
+Configuration var to store delayed background tasks (alerter tasks, their retries and the wait for recovery
+after recovery actions) in redis until they are due, instead of sending them to the broker with an eta.
+A periodic task moves the due tasks to their queues (see datadope_alerta.bgtasks.delayed.DelayedScheduler).
+
+Default: False
+"""
+
+DEFAULT_DELAYED_SCHEDULER = False
+
+CONFIG_DELAYED_SCHEDULER_MIN_DELAY = 'DELAYED_SCHEDULER_MIN_DELAY'
+"""
+Configuration var with the min delay in seconds of the tasks stored by the delayed scheduler. Tasks with a
+lower delay are sent directly to the broker.
+
+Default: 10 sec.
+"""
+
+DEFAULT_DELAYED_SCHEDULER_MIN_DELAY = 10.0
+
+CONFIG_DELAYED_SCHEDULER_INTERVAL = 'DELAYED_SCHEDULER_INTERVAL'
+"""
+Configuration var for the interval of the periodic task that moves due tasks of the delayed scheduler to
+their queues.
+
+Default: 1 sec.
+"""
+
+DEFAULT_DELAYED_SCHEDULER_INTERVAL = 1.0
+
+CONFIG_DELAYED_SCHEDULER_BATCH_SIZE = 'DELAYED_SCHEDULER_BATCH_SIZE'
+"""
+Configuration var with the max number of due tasks taken from redis at once by the delayed scheduler.
+
+Default: 500
+"""
+
+DEFAULT_DELAYED_SCHEDULER_BATCH_SIZE = 500
+
+CONFIG_CANCELLED_TASKS_TTL = 'CANCELLED_TASKS_TTL'
+"""
+Configuration var with the seconds a cancelled background task is kept in the cancellation registry
+(see datadope_alerta.bgtasks.cancellation.CancellationRegistry). Must be greater than the max delay of the tasks.
+
+Default: 86400 sec.
+"""
+
+DEFAULT_CANCELLED_TASKS_TTL = 86400
+
+CONFIG_REVOKE_BROADCAST_FALLBACK = 'REVOKE_BROADCAST_FALLBACK'
+"""
+Configuration var to revoke a background task with a broadcast to all the workers if it cannot be registered
+in the cancellation registry.
+
+Default: False
+"""
+
+DEFAULT_REVOKE_BROADCAST_FALLBACK = False
+
+CONFIG_PRIORITY_LANES = 'PRIORITY_LANES'
+"""
+Configuration var with the list of priority lanes of alerters tasks, selected from the severity and attributes of
+the alert (see datadope_alerta.plugins.priority_lanes.PriorityLanes).
+
+Default: [] (no lanes)
+"""
+
+DEFAULT_PRIORITY_LANES = []
+
+CONFIG_PRIORITY_LANES_DEFAULT_WEIGHT = 'PRIORITY_LANES_DEFAULT_WEIGHT'
+"""
+Configuration var with the consumption weight of the queues not belonging to a priority lane
+(see datadope_alerta.plugins.priority_lanes.WeightedLaneCycle).
+
+Default: 1
+"""
+
+DEFAULT_PRIORITY_LANES_DEFAULT_WEIGHT = 1.0
+
+CONFIG_ASYNC_ALERT_HIGH_WATERMARK = 'ASYNC_ALERT_HIGH_WATERMARK'
+"""
+Configuration var with the depth of the async alert queue from which `/async/alert` rejects alerts with a
+429 response (see datadope_alerta.bgtasks.admission.AdmissionControl). 0 disables admission control.
+
+Default: 0
+"""
+
+DEFAULT_ASYNC_ALERT_HIGH_WATERMARK = 0
+
+CONFIG_ASYNC_ALERT_LOW_WATERMARK = 'ASYNC_ALERT_LOW_WATERMARK'
+"""
+Configuration var with the depth of the async alert queue from which `/async/alert` rejects alerts with a
+severity in ASYNC_ALERT_LOW_SEVERITIES. 0 disables it.
+
+Default: 0
+"""
+
+DEFAULT_ASYNC_ALERT_LOW_WATERMARK = 0
+
+CONFIG_ASYNC_ALERT_LOW_SEVERITIES = 'ASYNC_ALERT_LOW_SEVERITIES'
+"""
+Configuration var with the severities rejected by `/async/alert` when the async alert queue is over
+ASYNC_ALERT_LOW_WATERMARK.
+
+Default: ['informational', 'debug', 'trace']
+"""
+
+DEFAULT_ASYNC_ALERT_LOW_SEVERITIES = ['informational', 'debug', 'trace']
+
+CONFIG_ASYNC_ALERT_DEPTH_CACHE_TIME = 'ASYNC_ALERT_DEPTH_CACHE_TIME'
+"""
+Configuration var with the seconds each process caches the depth and consumption rate of the async alert queue.
+
+Default: 1 sec.
+"""
+
+DEFAULT_ASYNC_ALERT_DEPTH_CACHE_TIME = 1.0
+
+CONFIG_ASYNC_ALERT_MAX_RETRY_AFTER = 'ASYNC_ALERT_MAX_RETRY_AFTER'
+"""
+Configuration var with the max value in seconds of `Retry-After` header of the alerts rejected by `/async/alert`.
+
+Default: 300 sec.
+"""
+
+DEFAULT_ASYNC_ALERT_MAX_RETRY_AFTER = 300
+
+CONFIG_ASYNC_ALERT_STATUS_STORE = 'ASYNC_ALERT_STATUS_STORE'
+"""
+Configuration var with the store of the status of the alerts received by `/async/alert`: 'postgres' (async_alert
+table) or 'redis' (see datadope_alerta.backend.flexiblededup.async_alert.RedisAsyncAlert).
+
+Default: 'postgres'
+"""
+
+DEFAULT_ASYNC_ALERT_STATUS_STORE = 'postgres'
+
+CONFIG_ASYNC_ALERT_STATUS_TTL = 'ASYNC_ALERT_STATUS_TTL'
+"""
+Configuration var with the seconds the status of an async alert is kept in redis store after it is created
+or updated.
+
+Default: 86400 sec.
+"""
+
+DEFAULT_ASYNC_ALERT_STATUS_TTL = 86400
+
 
 ALERTER_DEFAULT_CONFIG_VALUE_PREFIX = 'ALERTERS_DEFAULT_'
 """
@@ -358,6 +713,26 @@ def get_config(key, default=None, type=None, config: dict = None):
     return merge(rv or {}, rve or {})
 
 
+_redis_clients = {}
+
+
+def get_redis_client(config: dict = None):
+    """
+    Returns a redis client for the server configured in REDIS_URL configuration var
+    (or in CELERY_BROKER_URL if not provided). Clients are shared by url.
+
+    Responses are decoded as strings.
+    """
+    # noinspection PyPackageRequirements
+    import redis
+    url = get_config(CONFIG_REDIS_URL, config=config) or get_config('CELERY_BROKER_URL', config=config)
+    client = _redis_clients.get(url)
+    if client is None:
+        client = redis.Redis.from_url(url, decode_responses=True)
+        _redis_clients[url] = client
+    return client
+
+
 class NormalizedDictView(MutableMapping):
     def __init__(self, original: dict):
         self.__store = original
@@ -2,4 +2,4 @@ from flask import Blueprint
 
 iom_api = Blueprint('iom_api', __name__)
 
-from . import alerters, contextualizer, async_alert, alert_dependency # noqa isort:skip
+from . import alerters, contextualizer, async_alert, alert_dependency, metrics # noqa isort:skip
@@ -1,13 +1,21 @@
-from flask import jsonify
+from flask import jsonify, request, Response
 from flask_cors import cross_origin
+# noinspection PyPackageRequirements
+from redis import RedisError
 
 from alerta.auth.decorators import permission
+from alerta.exceptions import ApiError
 from alerta.models.enums import Scope
 from alerta.utils.response import jsonp
 from alerta.app import db
 
+from datadope_alerta import get_redis_client
+from datadope_alerta.plugins.circuit_breaker import CircuitBreaker
+
 from . import iom_api
-from ..backend.flexiblededup.models.alerters import AlerterOperationData
+
+# Maximum number of alerter data records returned for an alert
+ALERTER_DATA_MAX_RECORDS = 100
 
 
 @iom_api.route('/alert/<alert_id>/alerters', methods=['OPTIONS', 'GET'])
@@ -15,23 +23,64 @@ from ..backend.flexiblededup.models.alerters import AlerterOperationData
 @permission(Scope.read_alerts)
 @jsonp
 def get_alerter_data(alert_id):
-    # TODO: Mover las queries a métodos del backend
-    query = """
-        SELECT * FROM alerter_data WHERE alert_id=%(alert_id)s
-    """
-    resp = db._fetchall(query=query, vars={'alert_id': alert_id}, limit=100)
-    operation_data = {}
-    for record in resp:
-        operation_data.setdefault(record.alerter, []).append(AlerterOperationData.from_record(record).__dict__)
-    query_status = """
-        SELECT alerter, status FROM alerter_status WHERE alert_id=%(alert_id)s
-    """
-    resp = db._fetchall(query=query_status, vars={'alert_id': alert_id}, limit=100)
-    status_data = {x.alerter: x.status for x in resp}
-    data = {}
-    for alerter, status in status_data.items():
-        data[alerter] = {
-            "status": status,
-            "data": operation_data.get(alerter)
-        }
+    operations = [operation.strip()
+                  for value in request.args.getlist('operations')
+                  for operation in value.split(',') if operation.strip()]
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ApiError(f"'limit' must be an integer: '{limit}'", 400)
+        if limit < 1:
+            raise ApiError("'limit' must be greater than 0", 400)
+    etag = db.backend_alerters.get_alerters_info_etag(alert_id, operations=operations or None,
+                                                     limit_by_operation=limit, limit=ALERTER_DATA_MAX_RECORDS)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(db.backend_alerters.get_alerters_info(alert_id, operations=operations or None,
+                                                                 limit_by_operation=limit,
+                                                                 limit=ALERTER_DATA_MAX_RECORDS))
+    response.set_etag(etag)
+    return response
+
+
+def _get_str_list(form, key):
+    value = form.get(key)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(x, str) for x in value):
+        raise ApiError(f"'{key}' must be a list of strings", 400)
+    return value
+
+
+@iom_api.route('/alerters/query', methods=['OPTIONS', 'POST'])
+@cross_origin()
+@permission(Scope.read_alerts)
+@jsonp
+def query_alerters():
+    form = request.json
+    if not isinstance(form, dict):
+        raise ApiError("a json object is expected", 400)
+    alert_ids = _get_str_list(form, 'alert_ids')
+    if not alert_ids:
+        raise ApiError("'alert_ids' must be provided", 400)
+    data = db.backend_alerters.get_alerters_summary(alert_ids,
+                                                    alerters=_get_str_list(form, 'alerters'),
+                                                    operations=_get_str_list(form, 'operations'))
     return jsonify(data)
+
+
+@iom_api.route('/alerters/circuits', methods=['OPTIONS', 'GET'])
+@cross_origin()
+@permission(Scope.read_alerts)
+@jsonp
+def get_alerters_circuits():
+    try:
+        circuits = CircuitBreaker.get_circuits(get_redis_client(), alerter_name=request.args.get('alerter'))
+    except RedisError as e:
+        raise ApiError(f"Error reading circuits state: {e}", 503)
+    return jsonify(circuits)
@@ -1,25 +1,30 @@
 import logging
+import uuid
 
 from flask import request, current_app, g, jsonify, url_for
 from flask_cors import cross_origin
+# noinspection PyPackageRequirements
+from redis import RedisError
 
 from alerta.auth.decorators import permission
 from alerta.exceptions import ApiError
 from alerta.models.alert import Alert
 from alerta.models.enums import Scope
-from alerta.models.metrics import Timer, timer
+from alerta.models.metrics import timer
 from alerta.utils.api import assign_customer
 from alerta.utils.audit import write_audit_trail
 from alerta.utils.response import jsonp
 from alerta.app import db
+from datadope_alerta.backend.flexiblededup.metrics import BufferedTimer
 
 from . import iom_api
 
 logger = logging.getLogger(__name__)
 
 
-receive_timer = Timer('alerts', 'received_async', 'Received async alerts',
-                      'Total time and number of async received alerts')
+receive_timer = BufferedTimer('alerts', 'received_async', 'Received async alerts',
+                              'Total time and number of async received alerts',
+                              histogram='async_alert_receive_seconds')
 
 
 
@@ -36,6 +41,15 @@ def receive():
     except ValueError as e:
         raise ApiError(str(e), 400)
 
+    from datadope_alerta.bgtasks.admission import AdmissionControl
+    retry_after = AdmissionControl.check(alert.severity)
+    if retry_after is not None:
+        logger.info("Async alert rejected by admission control. Retry after %d secs", retry_after)
+        response = jsonify(status='error', message='Too many alerts waiting to be processed', code=429)
+        response.status = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
     alert.customer = assign_customer(wanted=alert.customer)
 
     # To support remote_ip plugin
@@ -43,15 +57,26 @@ def receive():
     environ = {'REMOTE_ADDR': remote_addr}
 
     from datadope_alerta.bgtasks.async_alert_task import async_receive
-    # bg_task_id = async_receive.apply_async(kwargs=dict(alert=alert.serialize, user=g.login))
-    task = async_receive.apply_async(kwargs=dict(alert_dict=alert.serialize,
-                                                 user=g.login,
-                                                 customers=g.get('customers'),
-                                                 scopes=g.scopes,
-                                                 request_environ=environ),
-                                     queue=current_app.config.get('ASYNC_ALERT_TASK_QUEUE'))
+    # Status is created before publishing the task, so it is available when the task finishes. If it cannot be
+    # created, the task is not published, as its result could not be requested.
+    task_id = str(uuid.uuid4())
+    if not db.backend_async_alert.create(task_id):
+        logger.warning("Status of async alert cannot be stored. Alert rejected")
+        raise ApiError("Async alerts status store not available", code=503)
+    try:
+        task = async_receive.apply_async(kwargs=dict(alert_dict=alert.serialize,
+                                                     user=g.login,
+                                                     customers=g.get('customers'),
+                                                     scopes=g.scopes,
+                                                     request_environ=environ),
+                                         queue=current_app.config.get('ASYNC_ALERT_TASK_QUEUE'),
+                                         task_id=task_id)
+    except Exception as e:
+        logger.warning("Error scheduling background task to process a new alert: %s", e)
+        db.backend_async_alert.update(task_id, alert_id=None,
+                                      errors={'status': 'error', 'message': 'Alert not scheduled', 'code': 503})
+        raise ApiError("Async alerts task queue not available", code=503)
     logger.info("Scheduled background task to process a new alert: %s", task.id)
-    db.backend_async_alert.create(task.id)
     write_audit_trail.send(current_app._get_current_object(),  # noqa
                            event='alert-received-async', message=alert.text, user=g.login,
                            customers=g.customers, scopes=g.scopes, resource_id=task.id,
@@ -73,6 +98,9 @@ def get_alert_status(bg_task_id):
     except KeyError:
         logger.warning("Requested status of a non-existing async task '%s'", bg_task_id)
         raise ApiError(f"'{bg_task_id}' task not found", code=404)
+    except RedisError as e:
+        logger.warning("Error reading status of async task '%s': %s", bg_task_id, e)
+        raise ApiError("Async alerts status store not available", code=503)
     if not info:
         return jsonify(task_id=bg_task_id, status="waiting"), 200
     alert_id = None
@@ -0,0 +1,34 @@
+import logging
+
+from flask import Response
+from flask_cors import cross_origin
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+from alerta.auth.decorators import permission
+from alerta.models.enums import Scope
+
+from datadope_alerta import get_redis_client
+from datadope_alerta.backend.flexiblededup.metrics import MetricsBuffer
+
+from . import iom_api
+
+logger = logging.getLogger(__name__)
+
+
+@iom_api.route('/alerters/metrics', methods=['OPTIONS', 'GET'])
+@cross_origin()
+@permission(Scope.read_management)
+def prometheus_histograms():
+    try:
+        output = MetricsBuffer.get_instance().render_prometheus(get_redis_client())
+    except RedisError as e:
+        logger.warning("Error reading latency histograms: %s", e)
+        output = ''
+    from datadope_alerta.bgtasks.admission import AdmissionControl
+    if AdmissionControl.is_enabled():
+        try:
+            output += AdmissionControl.render_prometheus()
+        except RedisError as e:
+            logger.warning("Error reading async alert queue metrics: %s", e)
+    return Response(output, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,6 +1,16 @@
+import json
+import logging
 from typing import Optional
 from alerta.database.backends.postgres.base import Backend
 
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+ASYNC_ALERT_STORE_POSTGRES = 'postgres'
+ASYNC_ALERT_STORE_REDIS = 'redis'
+
 
 class AsyncAlert:
     instance: 'AsyncAlert' = None
@@ -13,6 +23,22 @@ class AsyncAlert:
     def __init__(self, db_backend: Backend):
         self.backend = db_backend
 
+    @classmethod
+    def create_store(cls, db_backend: Backend, config) -> 'AsyncAlert':
+        """
+        Creates the async alert status store configured in ASYNC_ALERT_STATUS_STORE.
+        """
+        from datadope_alerta import CONFIG_ASYNC_ALERT_STATUS_STORE, DEFAULT_ASYNC_ALERT_STATUS_STORE, \
+            CONFIG_ASYNC_ALERT_STATUS_TTL, DEFAULT_ASYNC_ALERT_STATUS_TTL
+        store = str(config.get(CONFIG_ASYNC_ALERT_STATUS_STORE) or DEFAULT_ASYNC_ALERT_STATUS_STORE).lower()
+        if store == ASYNC_ALERT_STORE_REDIS:
+            ttl = int(config.get(CONFIG_ASYNC_ALERT_STATUS_TTL) or DEFAULT_ASYNC_ALERT_STATUS_TTL)
+            logger.info("Using redis to store async alerts status with ttl %d secs", ttl)
+            return RedisAsyncAlert(db_backend, ttl)
+        if store != ASYNC_ALERT_STORE_POSTGRES:
+            logger.warning("Unknown async alert status store '%s'. Using '%s'", store, ASYNC_ALERT_STORE_POSTGRES)
+        return AsyncAlert(db_backend)
+
     def get_alert_id(self, bg_task_id) -> Optional[str | dict]:
         query = """
             SELECT alert_id, errors
@@ -44,3 +70,82 @@ class AsyncAlert:
                                          dict(bg_task_id=bg_task_id, alert_id=alert_id, errors=errors),
                                          returning=True)
         return record.bg_task_id if record else None
+
+
+class RedisAsyncAlert(AsyncAlert):
+    """
+    Stores the status of async alerts in redis instead of in async_alert table.
+
+    Each task has a hash with its status ('waiting' or 'done') and the id of the created alert or the errors
+    creating it. Hashes expire after `ttl` seconds, renewed when the task finishes. Each write is one pipelined
+    round trip and reading a status is one HGETALL, so polling the status doesn't access the database.
+
+    The status is created before the task is published, and creating it never overwrites a finished status,
+    so a status created late (i.e. the task finished first) keeps the result of the task.
+    """
+    KEY_PREFIX = 'alerta:async_alert:'
+    STATUS_WAITING = 'waiting'
+    STATUS_DONE = 'done'
+
+    def __init__(self, db_backend: Backend, ttl: int):
+        super().__init__(db_backend)
+        self.ttl = ttl
+        self._client = None
+
+    @property
+    def client(self):
+        # Created on first use, as the backend is created before the application is ready
+        if self._client is None:
+            from datadope_alerta import get_redis_client
+            self._client = get_redis_client()
+        return self._client
+
+    @classmethod
+    def _key(cls, bg_task_id):
+        return f"{cls.KEY_PREFIX}{bg_task_id}"
+
+    def get_alert_id(self, bg_task_id) -> Optional[str | dict]:
+        status = self.client.hgetall(self._key(bg_task_id))
+        if not status:
+            raise KeyError(bg_task_id)
+        if status.get('alert_id'):
+            return status['alert_id']
+        if status.get('errors'):
+            return json.loads(status['errors'])
+        return None
+
+    def create(self, bg_task_id: str, alert_id: str = None) -> Optional[str]:
+        """
+        :return: the task id or None if the status cannot be stored
+        """
+        key = self._key(bg_task_id)
+        try:
+            pipeline = self.client.pipeline()
+            if alert_id:
+                pipeline.hset(key, mapping={'status': self.STATUS_DONE, 'alert_id': alert_id})
+            else:
+                pipeline.hsetnx(key, 'status', self.STATUS_WAITING)
+            pipeline.expire(key, self.ttl)
+            pipeline.execute()
+        except RedisError as e:
+            logger.warning("Error storing status of async alert task '%s': %s", bg_task_id, e)
+            return None
+        return bg_task_id
+
+    def update(self, bg_task_id: str, alert_id: str, errors: dict = None) -> Optional[str]:
+        from datadope_alerta import dumps_with_dates
+        status = {'status': self.STATUS_DONE}
+        if alert_id:
+            status['alert_id'] = alert_id
+        if errors:
+            status['errors'] = dumps_with_dates(errors)
+        key = self._key(bg_task_id)
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.hset(key, mapping=status)
+            pipeline.expire(key, self.ttl)
+            pipeline.execute()
+        except RedisError as e:
+            logger.warning("Error storing status of async alert task '%s': %s", bg_task_id, e)
+            return None
+        return bg_task_id
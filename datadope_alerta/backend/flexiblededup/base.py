@@ -1,14 +1,16 @@
 import json
 import logging
 import os
+import queue
 import threading
 from datetime import datetime, date
 from enum import Enum
 
+import psycopg2
 import pytz
 
 from flask import current_app, render_template_string  # noqa
-from psycopg2.extras import register_composite
+from psycopg2.extras import register_composite, execute_values
 
 from alerta.app import alarm_model
 from alerta.database.backends.postgres import Backend as PGBackend, Record, register_adapter, Json, HistoryAdapter
@@ -27,6 +29,8 @@ ATTRIBUTE_INFERRED_CORRELATION = 'inferredCorrelation'
 
 CONFIG_DEFAULT_DEDUPLICATION_TYPE = 'DEFAULT_DEDUPLICATION_TYPE'
 CONFIG_DEFAULT_DEDUPLICATION_TEMPLATE = 'DEFAULT_DEDUPLICATION_TEMPLATE'
+CONFIG_DATABASE_POOL_SIZE = 'DATABASE_POOL_SIZE'  # Idle connections kept by each process. 0 => no pool
+DEFAULT_DATABASE_POOL_SIZE = 0
 
 
 class DeduplicationType(str, Enum):
@@ -86,6 +90,11 @@ class Backend(PGBackend):
         self.backend_alerters = None
         self.backend_async_alert = None
         self.backend_external_references = None
+        self.pool_size = 0
+        self._idle_connections = None
+        self._idle_connections_pid = None
+        self._inherited_connections = None
+        self._pool_lock = threading.Lock()
         super().__init__(app=app)
 
     @classmethod
@@ -123,6 +132,7 @@ class Backend(PGBackend):
     def create_engine(self, app, uri, dbname=None, raise_on_error=True):
         self.uri = f"postgresql://{uri.split('://')[1]}"
         self.dbname = dbname
+        self.pool_size = int(app.config.get(CONFIG_DATABASE_POOL_SIZE, DEFAULT_DATABASE_POOL_SIZE) or 0)
 
         lock = threading.Lock()
         with lock:
@@ -148,9 +158,63 @@ class Backend(PGBackend):
         register_adapter(History, HistoryAdapter)
         register_adapter(dict, JsonWithDatetime)
         self.backend_alerters = SpecificBackend(self)
-        self.backend_async_alert = AsyncAlert(self)
+        self.backend_async_alert = AsyncAlert.create_store(self, app.config)
         self.backend_external_references = ExternalReferencesBackend(self)
 
+    def _get_idle_connections(self):
+        if self.pool_size <= 0:
+            return None
+        pid = os.getpid()
+        if self._idle_connections_pid != pid:
+            with self._pool_lock:
+                if self._idle_connections_pid != pid:
+                    # Connections of the parent process are kept referenced but never used or closed from this one
+                    self._inherited_connections = self._idle_connections
+                    self._idle_connections = queue.LifoQueue(maxsize=self.pool_size)
+                    self._idle_connections_pid = pid
+        return self._idle_connections
+
+    def connect(self):
+        idle_connections = self._get_idle_connections()
+        while idle_connections is not None:
+            try:
+                conn = idle_connections.get_nowait()
+            except queue.Empty:
+                break
+            if not conn.closed:
+                return conn
+        return super().connect()
+
+    def close(self, db):
+        idle_connections = self._get_idle_connections()
+        if idle_connections is not None and not db.closed:
+            try:
+                db.rollback()
+                idle_connections.put_nowait(db)
+                return
+            except (psycopg2.Error, queue.Full):
+                pass
+        super().close(db)
+
+    def update_timers(self, timers):
+        """
+        Adds count and total time of several timers in only one statement.
+        Rows are updated always in the same order to avoid deadlocks between processes.
+        """
+        upsert = """
+            INSERT INTO metrics ("group", name, title, description, count, total_time, type)
+            VALUES %s
+            ON CONFLICT ("group", name, type) DO UPDATE
+                SET count=metrics.count + EXCLUDED.count, total_time=metrics.total_time + EXCLUDED.total_time
+        """
+        values = sorted((x.group, x.name, x.title, x.description, x.count, x.total_time, x.type) for x in timers)
+        if not values:
+            return
+        conn = self.get_db()
+        cursor = conn.cursor()
+        execute_values(cursor, upsert, values)
+        conn.commit()
+
     def create_alert(self, alert):
         deduplication = alert.attributes.get(ATTRIBUTE_DEDUPLICATION)
         inferred_correlation = alert.attributes.get(ATTRIBUTE_INFERRED_CORRELATION)
@@ -0,0 +1,257 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+from flask import current_app
+
+from alerta.models.metrics import Timer
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsBuffer:
+    """
+    Aggregates in memory the timers measured by the process and flushes them periodically.
+
+    Measures are flushed when they are added if the flush interval has elapsed and by a daemon thread of the
+    process, started with the first measure, so they are not kept in memory while no more measures are added.
+    Pending measures are also flushed when the process exits.
+
+    Count and total time of all the timers are added to the metrics table in only one statement. Measures with
+    a histogram are also counted in latency histograms that are added to a redis hash, so histograms of all the
+    processes (api and workers) are exported together.
+    """
+    HISTOGRAMS_KEY = 'alerta:metrics:histograms'
+    HISTOGRAMS = {
+        'alerter_operation_seconds': 'Duration of alerters operations',
+        'async_alert_receive_seconds': 'Duration of async alerts reception',
+        'alerter_task_phase_seconds': 'Duration of the phases of alerters background tasks',
+        'alerter_lane_queue_wait_seconds': 'Queue wait of alerters background tasks by priority lane'
+    }
+    SUM_FIELD = 'sum'
+    INF = '+Inf'
+
+    _instance = None
+
+    def __init__(self, flush_interval: float, buckets):
+        self.flush_interval = flush_interval
+        self.buckets = sorted(float(x) for x in buckets)
+        self._lock = threading.Lock()
+        self._timers: Dict[tuple, Timer] = {}
+        self._histograms: Dict[tuple, list] = {}
+        self._last_flush = time.monotonic()
+        self._pid = os.getpid()
+        self._app = None
+        self._flusher: Optional[threading.Thread] = None
+        self._exit_flush_registered = False
+
+    @classmethod
+    def get_instance(cls) -> 'MetricsBuffer':
+        if cls._instance is None:
+            from datadope_alerta import get_config, CONFIG_METRICS_FLUSH_INTERVAL, DEFAULT_METRICS_FLUSH_INTERVAL, \
+                CONFIG_METRICS_HISTOGRAM_BUCKETS, DEFAULT_METRICS_HISTOGRAM_BUCKETS
+            cls._instance = cls(get_config(CONFIG_METRICS_FLUSH_INTERVAL, DEFAULT_METRICS_FLUSH_INTERVAL, type=float),
+                                get_config(CONFIG_METRICS_HISTOGRAM_BUCKETS, DEFAULT_METRICS_HISTOGRAM_BUCKETS,
+                                           type=list))
+        return cls._instance
+
+    def _check_process(self):
+        # Measures buffered by the parent process must not be flushed again by forked processes
+        if self._pid != os.getpid():
+            self._timers = {}
+            self._histograms = {}
+            self._last_flush = time.monotonic()
+            self._pid = os.getpid()
+
+    def _start_flusher(self):
+        # Threads are not inherited by forked processes, so it is started again in them
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        if self._app is None:
+            try:
+                self._app = current_app._get_current_object()  # noqa
+            except RuntimeError:
+                # Without application context measures cannot be written. They are flushed by the next add.
+                return
+        self._flusher = threading.Thread(target=self._run_flusher, name='metrics-buffer-flusher', daemon=True)
+        self._flusher.start()
+        if not self._exit_flush_registered:
+            atexit.register(self._flush_at_exit)
+            self._exit_flush_registered = True
+
+    def _pending_flush(self) -> bool:
+        with self._lock:
+            return bool(self._timers or self._histograms) and \
+                time.monotonic() - self._last_flush >= self.flush_interval
+
+    def _run_flusher(self):
+        interval = threading.Event()
+        while True:
+            interval.wait(self.flush_interval)
+            try:
+                if self._pending_flush():
+                    with self._app.app_context():
+                        self.flush()
+            except Exception as e:  # noqa
+                logger.warning("Error flushing buffered metrics: %s", e)
+
+    def _flush_at_exit(self):
+        if self._app is not None:
+            try:
+                with self._app.app_context():
+                    self.flush()
+            except Exception as e:  # noqa
+                logger.warning("Error flushing buffered metrics at exit: %s", e)
+
+    def add(self, timer: Timer, total_time: int, count: int = 1,
+            histogram: Optional[str] = None, labels: Optional[Dict[str, str]] = None):
+        """
+        Adds a measure to the buffer. It is flushed if flush interval has elapsed since the last flush.
+
+        :param timer: timer measured
+        :param total_time: measured time in milliseconds
+        :param count: number of operations measured
+        :param histogram: name of the latency histogram to update, if any
+        :param labels: labels of the histogram
+        """
+        with self._lock:
+            self._check_process()
+            key = (timer.group, timer.name)
+            buffered = self._timers.get(key)
+            if buffered is None:
+                buffered = Timer(timer.group, timer.name, timer.title, timer.description)
+                self._timers[key] = buffered
+            buffered.count += count
+            buffered.total_time += total_time
+            if histogram:
+                self._observe(histogram, total_time / 1000.0 / max(count, 1), count, labels)
+            self._start_flusher()
+            must_flush = time.monotonic() - self._last_flush >= self.flush_interval
+        if must_flush:
+            self.flush()
+
+    def observe(self, histogram: str, seconds: float, count: int = 1, labels: Optional[Dict[str, str]] = None):
+        """
+        Adds a measure only to a latency histogram. It is flushed if flush interval has elapsed since the last flush.
+        """
+        with self._lock:
+            self._check_process()
+            self._observe(histogram, seconds, count, labels)
+            self._start_flusher()
+            must_flush = time.monotonic() - self._last_flush >= self.flush_interval
+        if must_flush:
+            self.flush()
+
+    def _observe(self, histogram, seconds, count, labels):
+        key = (histogram, tuple(sorted((labels or {}).items())))
+        values = self._histograms.get(key)
+        if values is None:
+            values = [0] * (len(self.buckets) + 1) + [0.0]
+            self._histograms[key] = values
+        index = next((i for i, x in enumerate(self.buckets) if seconds <= x), len(self.buckets))
+        values[index] += count
+        values[-1] += seconds * count
+
+    def flush(self):
+        """
+        Writes buffered measures. Measures that cannot be written are discarded.
+        """
+        with self._lock:
+            self._check_process()
+            timers, self._timers = self._timers, {}
+            histograms, self._histograms = self._histograms, {}
+            self._last_flush = time.monotonic()
+        if timers:
+            try:
+                from alerta.app import db
+                db.update_timers(list(timers.values()))
+            except Exception as e:
+                logger.warning("Error storing %d buffered timers: %s", len(timers), e)
+        if histograms:
+            try:
+                from datadope_alerta import get_redis_client
+                pipeline = get_redis_client().pipeline(transaction=False)
+                for (histogram, labels), values in histograms.items():
+                    les = [self.format_bound(x) for x in self.buckets] + [self.INF]
+                    for le, value in zip(les, values):
+                        if value:
+                            pipeline.hincrby(self.HISTOGRAMS_KEY, self._field(histogram, labels, le), value)
+                    pipeline.hincrbyfloat(self.HISTOGRAMS_KEY, self._field(histogram, labels, self.SUM_FIELD),
+                                          values[-1])
+                pipeline.execute()
+            except RedisError as e:
+                logger.warning("Error storing %d buffered histograms: %s", len(histograms), e)
+
+    @staticmethod
+    def format_bound(bound: float) -> str:
+        return repr(float(bound))
+
+    @staticmethod
+    def _field(histogram, labels, le):
+        return json.dumps([histogram, [list(x) for x in labels], le])
+
+    @staticmethod
+    def _escape(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @classmethod
+    def _format_labels(cls, labels, le=None) -> str:
+        labels = list(labels) + ([('le', le)] if le is not None else [])
+        return '{' + ','.join(f'{name}="{cls._escape(value)}"' for name, value in labels) + '}' if labels else ''
+
+    def render_prometheus(self, client) -> str:
+        """
+        Renders the latency histograms stored in redis using prometheus text format.
+
+        All the series include the buckets configured in this process and any other bucket found in redis.
+        """
+        histograms = {}
+        for field, value in client.hgetall(self.HISTOGRAMS_KEY).items():
+            histogram, labels, le = json.loads(field)
+            series = histograms.setdefault(histogram, {}).setdefault(tuple(tuple(x) for x in labels), {})
+            series[le] = float(value) if le == self.SUM_FIELD else int(value)
+        output = []
+        for histogram in sorted(histograms):
+            name = f"alerta_{histogram}"
+            output.append(f"# HELP {name} {self.HISTOGRAMS.get(histogram, histogram)}\n")
+            output.append(f"# TYPE {name} histogram\n")
+            for labels in sorted(histograms[histogram]):
+                series = histograms[histogram][labels]
+                total_sum = series.pop(self.SUM_FIELD, 0.0)
+                bounds = sorted({x for x in series if x != self.INF} | {self.format_bound(x) for x in self.buckets},
+                                key=float)
+                cumulative = 0
+                for le in bounds + [self.INF]:
+                    cumulative += series.get(le, 0)
+                    output.append(f"{name}_bucket{self._format_labels(labels, le)} {cumulative}\n")
+                output.append(f"{name}_sum{self._format_labels(labels)} {total_sum}\n")
+                output.append(f"{name}_count{self._format_labels(labels)} {cumulative}\n")
+        return ''.join(output)
+
+
+class BufferedTimer(Timer):
+    """
+    Timer whose measures are aggregated in the metrics buffer of the process instead of being written to
+    the database each time the timer is stopped.
+
+    If a histogram is provided, measures are also counted in that latency histogram with the provided labels.
+    """
+
+    def __init__(self, group, name, title=None, description=None,
+                 histogram: Optional[str] = None, labels: Optional[Dict[str, str]] = None):
+        super().__init__(group, name, title, description)
+        self.histogram = histogram
+        self.labels = labels
+
+    def stop_timer(self, start, count=1):
+        total_time = self._time_in_millis() - start
+        self.count += count
+        self.total_time += total_time
+        MetricsBuffer.get_instance().add(self, total_time, count, histogram=self.histogram, labels=self.labels)
@@ -0,0 +1,97 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+from alerta.models.alert import Alert
+from alerta.utils.format import DateTime
+
+from datadope_alerta import get_config, CONFIG_ALERT_SNAPSHOT_IN_TASKS, DEFAULT_ALERT_SNAPSHOT_IN_TASKS
+
+
+logger = logging.getLogger(__name__)
+
+
+class AlertSnapshot:
+    """
+    Compact copy of an alert (without history) included in the payload of background tasks.
+
+    Workers use the copy if the alert has not changed in database since the task was scheduled,
+    checking only some columns of the alert instead of reading the full alert.
+    """
+    __db = None
+
+    FIELD_VERSION = '_version'
+    DATE_FIELDS = ('createTime', 'receiveTime', 'lastReceiveTime', 'updateTime')
+
+    @classmethod
+    def get_db(cls):
+        if cls.__db is None:
+            from ..specific import SpecificBackend
+            cls.__db = SpecificBackend.instance
+        return cls.__db
+
+    @staticmethod
+    def is_enabled(config=None) -> bool:
+        return get_config(CONFIG_ALERT_SNAPSHOT_IN_TASKS, DEFAULT_ALERT_SNAPSHOT_IN_TASKS, type=bool, config=config)
+
+    @classmethod
+    def from_alert(cls, alert: Alert) -> Optional[dict]:
+        if alert is None or alert.update_time is None:
+            return None
+        snapshot = alert.get_body(history=False)
+        snapshot.pop('history', None)
+        snapshot.pop('href', None)
+        snapshot[cls.FIELD_VERSION] = {
+            'updateTime': alert.update_time.isoformat(),
+            'status': alert.status,
+            'lastReceiveId': alert.last_receive_id
+        }
+        return snapshot
+
+    @classmethod
+    def for_task(cls, alert: Alert, config=None) -> Optional[dict]:
+        """
+        Returns the snapshot of the alert to include in the payload of a task if it is enabled by configuration.
+        """
+        return cls.from_alert(alert) if cls.is_enabled(config) else None
+
+    @classmethod
+    def to_alert(cls, snapshot: dict) -> Alert:
+        doc = {x: y for x, y in snapshot.items() if x != cls.FIELD_VERSION}
+        for field in cls.DATE_FIELDS:
+            if isinstance(doc.get(field), str):
+                doc[field] = DateTime.parse(doc[field])
+        doc['updateTime'] = datetime.fromisoformat(snapshot[cls.FIELD_VERSION]['updateTime'])
+        return Alert.from_document(doc)
+
+    @classmethod
+    def is_current(cls, snapshot: dict, version) -> bool:
+        snapshot_version = snapshot.get(cls.FIELD_VERSION) or {}
+        try:
+            update_time = datetime.fromisoformat(snapshot_version.get('updateTime'))
+        except (TypeError, ValueError):
+            return False
+        return update_time == version.update_time \
+            and snapshot_version.get('status') == version.status \
+            and snapshot_version.get('lastReceiveId') == version.last_receive_id
+
+    @classmethod
+    def get_alert(cls, alert_id: str, snapshot: Optional[dict] = None) -> Optional[Alert]:
+        """
+        Returns the alert from the snapshot if it is up-to-date. If not, the alert is read from database.
+
+        :param alert_id:
+        :param snapshot: snapshot included in the task payload, if any
+        :return: the alert or None if the alert doesn't exist
+        """
+        if snapshot:
+            version = cls.get_db().get_alert_version(alert_id)
+            if version is None:
+                return None
+            if cls.is_current(snapshot, version):
+                alert = cls.to_alert(snapshot)
+                alert.tags = version.tags
+                alert.attributes = version.attributes
+                return alert
+            logger.debug("Alert '%s' modified after scheduling the task. Reading it from database", alert_id)
+        return Alert.find_by_id(alert_id)
@@ -1,6 +1,8 @@
 from datetime import datetime
 from typing import Optional
 
+from ..response_storage import expand_response
+
 
 class AlerterOperationData:
     __db = None
@@ -31,6 +33,7 @@ class AlerterOperationData:
         self.reason: Optional[str] = kwargs.get('reason')
         self.bg_task_id: Optional[str] = kwargs.get('bg_task_id')
         self.task_chain_info: Optional[dict] = kwargs.get('task_chain_info')
+        self.timing: Optional[dict] = kwargs.get('timing')
 
     @classmethod
     def from_db(cls, alert_id, alerter, operation, create_default=True) -> Optional['AlerterOperationData']:
@@ -52,10 +55,11 @@ class AlerterOperationData:
             success=rec.success,
             skipped=rec.skipped,
             retries=rec.retries,
-            response=rec.response,
+            response=expand_response(rec.response),
             reason=rec.reason,
             bg_task_id=rec.bg_task_id,
-            task_chain_info=rec.task_chain_info
+            task_chain_info=rec.task_chain_info,
+            timing=rec.timing
         )
 
     @classmethod
@@ -2,6 +2,8 @@ from datetime import datetime
 from enum import Enum
 from typing import Optional, List
 
+from ..response_storage import expand_response
+
 
 class RecoveryActionsStatus(str, Enum):
     InProgress = 'in_progress'
@@ -53,7 +55,7 @@ class RecoveryActionData:
             alerting_time=rec.alerting_time,
             success=rec.success,
             retries=rec.retries,
-            response=rec.response,
+            response=expand_response(rec.response),
             job_id=rec.job_id,
             bg_task_id=rec.bg_task_id
         )
@@ -0,0 +1,146 @@
+import base64
+import hashlib
+import json
+import logging
+import zlib
+from typing import Optional, Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_KEY = '_compressed_'
+COMPRESSED_DATA_KEY = 'data'
+COMPRESSION_ZLIB = 'zlib'
+TRACEBACK_KEY = 'traceback'
+TRACEBACK_REF_KEY = 'tracebackRef'
+TRACEBACK_REFS_KEY = 'tracebackRefs'
+TRUNCATED_MARKER = '...[TRUNCATED {} CHARS]'
+
+
+def expand_response(response: Any) -> Any:
+    """
+    Returns the response as it was before being compressed to store it. Truncated values and deduplicated
+    tracebacks are not restored.
+    """
+    if isinstance(response, dict) and response.get(COMPRESSED_KEY) == COMPRESSION_ZLIB:
+        try:
+            return json.loads(zlib.decompress(base64.b64decode(response[COMPRESSED_DATA_KEY])))
+        except Exception as e:  # noqa
+            logger.warning("Error decompressing stored response: %s", e)
+    return response
+
+
+class ResponseCompactor:
+    """
+    Prepares alerters and recovery actions responses to be stored:
+
+      * String values longer than max_value_length are truncated including a truncation marker.
+      * Tracebacks are replaced by their hash (as 'tracebackRef' key), so they can be stored only once.
+      * If the serialized response is longer than compression_threshold, it is stored compressed. Hashes of the
+        tracebacks referenced in it are kept uncompressed (as 'tracebackRefs' key), so the references can be
+        tracked without decompressing it.
+    """
+
+    def __init__(self, max_value_length: int = 0, compression_threshold: int = 0, deduplicate_tracebacks=False):
+        self.max_value_length = max_value_length
+        self.compression_threshold = compression_threshold
+        self.deduplicate_tracebacks = deduplicate_tracebacks
+
+    @classmethod
+    def create(cls) -> 'ResponseCompactor':
+        from datadope_alerta import get_config, \
+            CONFIG_RESPONSE_MAX_VALUE_LENGTH, DEFAULT_RESPONSE_MAX_VALUE_LENGTH, \
+            CONFIG_RESPONSE_COMPRESSION_THRESHOLD, DEFAULT_RESPONSE_COMPRESSION_THRESHOLD, \
+            CONFIG_RESPONSE_TRACEBACK_DEDUPLICATION, DEFAULT_RESPONSE_TRACEBACK_DEDUPLICATION
+        return cls(
+            max_value_length=get_config(CONFIG_RESPONSE_MAX_VALUE_LENGTH, DEFAULT_RESPONSE_MAX_VALUE_LENGTH,
+                                        type=int),
+            compression_threshold=get_config(CONFIG_RESPONSE_COMPRESSION_THRESHOLD,
+                                             DEFAULT_RESPONSE_COMPRESSION_THRESHOLD, type=int),
+            deduplicate_tracebacks=get_config(CONFIG_RESPONSE_TRACEBACK_DEDUPLICATION,
+                                              DEFAULT_RESPONSE_TRACEBACK_DEDUPLICATION, type=bool))
+
+    @staticmethod
+    def traceback_hash(traceback: str) -> str:
+        return hashlib.sha256(traceback.encode('utf-8')).hexdigest()
+
+    def compact(self, response: Any, tracebacks: Dict[str, str]) -> Any:
+        """
+        :param response: response to store
+        :param tracebacks: dict where the deduplicated tracebacks are added by hash
+        :return: response to store
+        """
+        if response is None or (isinstance(response, dict) and COMPRESSED_KEY in response):
+            return response
+        response = self._compact_value(response, tracebacks)
+        if self.compression_threshold > 0:
+            from datadope_alerta import json_serial
+            serialized = json.dumps(response, default=json_serial)
+            if len(serialized) > self.compression_threshold:
+                refs = find_traceback_refs(response)
+                response = {
+                    COMPRESSED_KEY: COMPRESSION_ZLIB,
+                    COMPRESSED_DATA_KEY: base64.b64encode(zlib.compress(serialized.encode('utf-8'))).decode('ascii')
+                }
+                if refs:
+                    response[TRACEBACK_REFS_KEY] = sorted(refs)
+        return response
+
+    def _compact_value(self, value, tracebacks):
+        if isinstance(value, dict):
+            result = {}
+            for k, v in value.items():
+                if k == TRACEBACK_KEY and self.deduplicate_tracebacks and isinstance(v, str):
+                    traceback_hash = self.traceback_hash(v)
+                    tracebacks[traceback_hash] = v
+                    result[TRACEBACK_REF_KEY] = traceback_hash
+                else:
+                    result[k] = self._compact_value(v, tracebacks)
+            return result
+        if isinstance(value, list):
+            return [self._compact_value(x, tracebacks) for x in value]
+        if isinstance(value, str) and 0 < self.max_value_length < len(value):
+            return value[:self.max_value_length] + TRUNCATED_MARKER.format(len(value) - self.max_value_length)
+        return value
+
+
+def find_traceback_refs(response: Any, refs: Optional[set] = None) -> set:
+    """
+    Returns the hashes of the deduplicated tracebacks referenced in a response.
+    """
+    refs = set() if refs is None else refs
+    if isinstance(response, dict):
+        for k, v in response.items():
+            if k == TRACEBACK_REF_KEY and isinstance(v, str):
+                refs.add(v)
+            else:
+                find_traceback_refs(v, refs)
+    elif isinstance(response, list):
+        for v in response:
+            find_traceback_refs(v, refs)
+    return refs
+
+
+def stored_traceback_refs(response: Any) -> List[str]:
+    """
+    Returns the hashes of the deduplicated tracebacks referenced in a response prepared to be stored.
+    """
+    if isinstance(response, dict) and response.get(COMPRESSED_KEY) == COMPRESSION_ZLIB:
+        return sorted(response.get(TRACEBACK_REFS_KEY) or [])
+    return sorted(find_traceback_refs(response))
+
+
+def resolve_traceback_refs(response: Any, tracebacks: Dict[str, str]) -> Any:
+    """
+    Returns the response replacing references to deduplicated tracebacks with the tracebacks.
+    """
+    if isinstance(response, dict):
+        result = {}
+        for k, v in response.items():
+            if k == TRACEBACK_REF_KEY and v in tracebacks:
+                result[TRACEBACK_KEY] = tracebacks[v]
+            else:
+                result[k] = resolve_traceback_refs(v, tracebacks)
+        return result
+    if isinstance(response, list):
+        return [resolve_traceback_refs(x, tracebacks) for x in response]
+    return response
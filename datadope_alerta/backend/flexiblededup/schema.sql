@@ -224,6 +224,16 @@ CREATE TABLE IF NOT EXISTS alerter_data (
     CONSTRAINT alerter_data_fkey_alert_id FOREIGN KEY(alert_id) REFERENCES alerts(id) ON DELETE CASCADE
 );
 
+ALTER TABLE alerter_data ADD COLUMN IF NOT EXISTS timing jsonb;
+ALTER TABLE alerter_data ADD COLUMN IF NOT EXISTS traceback_refs text[];
+
+CREATE TABLE IF NOT EXISTS alerter_traceback (
+    hash text PRIMARY KEY,
+    traceback text NOT NULL,
+    create_time timestamp without time zone NOT NULL DEFAULT (now() at time zone 'utc'),
+    stored_time timestamp without time zone NOT NULL DEFAULT (now() at time zone 'utc')
+);
+
 CREATE TABLE IF NOT EXISTS recovery_action_data (
     alert_id text NOT NULL PRIMARY KEY,
     provider text NOT NULL,
@@ -242,6 +252,8 @@ CREATE TABLE IF NOT EXISTS recovery_action_data (
     CONSTRAINT recovery_action_data_fkey_alert_id FOREIGN KEY(alert_id) REFERENCES alerts(id) ON DELETE CASCADE
 );
 
+ALTER TABLE recovery_action_data ADD COLUMN IF NOT EXISTS traceback_refs text[];
+
 CREATE UNIQUE INDEX IF NOT EXISTS alerter_data_oper_key_unique ON alerter_data
 USING btree (alert_id, alerter, operation) WHERE operation in ('new', 'recovery');
 
@@ -251,6 +263,28 @@ USING btree (alert_id, alerter, operation) WHERE operation not in ('new', 'recov
 CREATE INDEX IF NOT EXISTS alerter_data_key ON alerter_data
 USING btree (alert_id, alerter);
 
+CREATE INDEX IF NOT EXISTS alerter_data_traceback_refs ON alerter_data
+USING gin (traceback_refs) WHERE traceback_refs IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS recovery_action_data_traceback_refs ON recovery_action_data
+USING gin (traceback_refs) WHERE traceback_refs IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS alerter_traceback_stored_time ON alerter_traceback
+USING btree (stored_time);
+
+CREATE TABLE IF NOT EXISTS alerter_data_summary (
+    alert_id text NOT NULL,
+    alerter text NOT NULL,
+    operation text NOT NULL,
+    count integer NOT NULL,
+    success_count integer NOT NULL,
+    skipped_count integer NOT NULL,
+    first_received_time timestamp without time zone,
+    last_received_time timestamp without time zone,
+    CONSTRAINT alerter_data_summary_pkey PRIMARY KEY (alert_id, alerter, operation),
+    CONSTRAINT alerter_data_summary_fkey_alert_id FOREIGN KEY(alert_id) REFERENCES alerts(id) ON DELETE CASCADE
+);
+
 CREATE TABLE IF NOT EXISTS key_value_store (
     key VARCHAR(50) NOT NULL PRIMARY KEY,
     value text
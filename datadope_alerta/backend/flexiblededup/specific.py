@@ -1,5 +1,7 @@
+import hashlib
 import json
-from typing import Optional
+import time
+from typing import Optional, List, Tuple, Dict
 
 from alerta.database.backends.postgres.base import Backend
 from .models.alert_dependency import AlertDependency
@@ -7,12 +9,22 @@ from .models.alerters import AlerterOperationData
 from .models.key_value_store import KeyValueParameter
 from .models.recovery_actions import RecoveryActionData
 from .models.rules import ContextualRule
+from .response_storage import ResponseCompactor, expand_response, find_traceback_refs, resolve_traceback_refs, \
+    stored_traceback_refs
+from .status_cache import AlerterStatusCache
 
 
 # noinspection PyProtectedMember
 class SpecificBackend:
     instance: 'SpecificBackend' = None
 
+    # Tracebacks stored by this process are not stored again during this time. Unreferenced tracebacks
+    # are only removed if they have not been stored for a longer time, so they cannot be removed while
+    # a response referencing them is being stored.
+    TRACEBACK_STORED_CACHE_TIME = 3600
+    TRACEBACK_MIN_AGE = 86400
+    COMPACTION_WATERMARK_KEY_PREFIX = 'alerter_data_compaction:'
+
     def __new__(cls, *args, **kwargs):
         instance = super().__new__(cls)
         cls.instance = instance  # noqa
@@ -20,12 +32,51 @@ class SpecificBackend:
 
     def __init__(self, db_backend: Backend):
         self.backend = db_backend
+        self._status_cache = None
+        self._status_cache_created = False
+        self._response_compactor = None
+        self._stored_tracebacks = {}
+
+    @property
+    def status_cache(self) -> Optional[AlerterStatusCache]:
+        if not self._status_cache_created:
+            self._status_cache = AlerterStatusCache.create()
+            self._status_cache_created = True
+        return self._status_cache
+
+    @property
+    def response_compactor(self) -> ResponseCompactor:
+        if self._response_compactor is None:
+            self._response_compactor = ResponseCompactor.create()
+        return self._response_compactor
+
+    def _storable(self, data) -> dict:
+        """
+        Returns the parameters to store an alerter or recovery action data object with its response compacted
+        and the hashes of the tracebacks it references. Deduplicated tracebacks are stored before returning.
+        """
+        tracebacks = {}
+        response = self.response_compactor.compact(data.response, tracebacks)
+        params = dict(vars(data), response=response, traceback_refs=stored_traceback_refs(response) or None)
+        if tracebacks:
+            self.store_tracebacks(tracebacks)
+        return params
+
+    def _invalidate_status_cache(self, alert_id: str):
+        if self.status_cache:
+            self.status_cache.invalidate(alert_id)
 
     # ---------------------
     # Alerters Status
     # ---------------------
 
     def get_status(self, alert_id: str, alerter: str) -> Optional[str]:
+        version = None
+        if self.status_cache:
+            found, status = self.status_cache.get(alert_id, alerter)
+            if found:
+                return status
+            version = self.status_cache.get_version(alert_id)
         query = """
             SELECT status 
               FROM alerter_status 
@@ -33,7 +84,34 @@ class SpecificBackend:
                AND alerter=%(alerter)s
         """
         record = self.backend._fetchone(query, dict(alert_id=alert_id, alerter=alerter))
-        return record.status if record else None
+        status = record.status if record else None
+        if status is not None and self.status_cache:
+            self.status_cache.populate(alert_id, version, {alerter: status})
+        return status
+
+    def get_statuses(self, alert_id: str) -> Dict[str, str]:
+        """
+        Reads the status of all the alerters of an alert.
+
+        :param alert_id:
+        :return: dict with the status of each alerter that has status stored for the alert
+        """
+        version = None
+        if self.status_cache:
+            statuses = self.status_cache.get_all(alert_id)
+            if statuses is not None:
+                return statuses
+            version = self.status_cache.get_version(alert_id)
+        query = """
+            SELECT alerter, status
+              FROM alerter_status
+             WHERE alert_id=%(alert_id)s
+        """
+        records = self.backend._fetchall(query, dict(alert_id=alert_id))
+        statuses = {record.alerter: record.status for record in records}
+        if self.status_cache:
+            self.status_cache.populate(alert_id, version, statuses, complete=True)
+        return statuses
 
     def create_status(self, alert_id: str, alerter: str, status: str) -> Optional[str]:
         insert = """
@@ -42,7 +120,10 @@ class SpecificBackend:
             RETURNING *
         """
         record = self.backend._insert(insert, dict(alert_id=alert_id, alerter=alerter, status=status))
-        return record.status if record else None
+        status = record.status if record else None
+        if status is not None:
+            self._invalidate_status_cache(alert_id)
+        return status
 
     def update_status(self, alert_id: str, alerter: str, status: str) -> Optional[str]:
         update = """
@@ -54,7 +135,10 @@ class SpecificBackend:
         """
         record = self.backend._updateone(update, dict(alert_id=alert_id, alerter=alerter, status=status),
                                          returning=True)
-        return record.status if record else None
+        status = record.status if record else None
+        if status is not None:
+            self._invalidate_status_cache(alert_id)
+        return status
 
     def clear_status(self, alert_id: str):
         delete = """
@@ -62,6 +146,111 @@ class SpecificBackend:
              WHERE alert_id=%(alert_id)s
         """
         self.backend._deleteall(delete, dict(alert_id=alert_id))
+        self._invalidate_status_cache(alert_id)
+
+    def transition(self, alert_id: str, alerter: str, new_status: str,
+                   operation_data: Optional[AlerterOperationData] = None,
+                   expected_statuses: Optional[List[str]] = None,
+                   chain_operation_data: Optional[AlerterOperationData] = None) -> Tuple[Optional[str], bool]:
+        """
+        Stores the new alerter status and the operation data in one statement.
+
+        If expected_statuses is provided, the transition is a compare and set: nothing is written unless the
+        current status (or 'new' if there is no status stored yet) is one of them.
+
+        If operation data is written, its id is updated with the stored record id.
+
+        :param alert_id:
+        :param alerter:
+        :param new_status:
+        :param operation_data: alerter operation data to store with the status. May be None.
+        :param expected_statuses: list of valid current statuses for the transition. None for any status.
+        :param chain_operation_data: operation data of the running task whose task chain info is stored with the
+            status, so the task finds it as soon as it sees the new status. May be None.
+        :return: tuple with the status previous to the transition (None if there was no status stored)
+            and a boolean indicating if the transition has been applied.
+        """
+        if operation_data is None:
+            data_statement = "SELECT NULL::bigint AS id"
+        elif operation_data.id is None:
+            data_statement = """
+                INSERT INTO alerter_data (alert_id, alerter, operation, received_time, start_time, end_time,
+                    success, skipped, retries, response, reason, bg_task_id, task_chain_info, timing, traceback_refs)
+                SELECT %(alert_id)s, %(alerter)s, %(operation)s, %(received_time)s, %(start_time)s, %(end_time)s,
+                    %(success)s, %(skipped)s, %(retries)s, %(response)s, %(reason)s, %(bg_task_id)s,
+                    %(task_chain_info)s, %(timing)s, %(traceback_refs)s
+                  FROM new_status
+                ON CONFLICT (alert_id, alerter, operation) WHERE operation in ('new', 'recovery') DO UPDATE
+                   SET received_time=EXCLUDED.received_time, start_time=EXCLUDED.start_time,
+                       end_time=EXCLUDED.end_time, success=EXCLUDED.success, skipped=EXCLUDED.skipped,
+                       retries=EXCLUDED.retries, response=EXCLUDED.response, reason=EXCLUDED.reason,
+                       bg_task_id=EXCLUDED.bg_task_id, task_chain_info=EXCLUDED.task_chain_info,
+                       timing=EXCLUDED.timing, traceback_refs=EXCLUDED.traceback_refs
+                RETURNING id
+            """
+        else:
+            data_statement = """
+                UPDATE alerter_data
+                   SET alert_id=%(alert_id)s, alerter=%(alerter)s, operation=%(operation)s,
+                       received_time=%(received_time)s, start_time=%(start_time)s, end_time=%(end_time)s,
+                       success=%(success)s, skipped=%(skipped)s, retries=%(retries)s, response=%(response)s,
+                       reason=%(reason)s, bg_task_id=%(bg_task_id)s, task_chain_info=%(task_chain_info)s,
+                       timing=%(timing)s, traceback_refs=%(traceback_refs)s
+                 WHERE id=%(id)s
+                   AND EXISTS (SELECT 1 FROM new_status)
+                RETURNING id
+            """
+        query = """
+            WITH previous AS (
+                SELECT status
+                  FROM alerter_status
+                 WHERE alert_id=%(alert_id)s
+                   AND alerter=%(alerter)s
+                   FOR UPDATE
+            ), allowed AS (
+                SELECT 1
+                 WHERE %(expected_statuses)s::text[] IS NULL
+                    OR COALESCE((SELECT status FROM previous), 'new') = ANY(%(expected_statuses)s::text[])
+            ), new_status AS (
+                INSERT INTO alerter_status (alert_id, alerter, status)
+                SELECT %(alert_id)s, %(alerter)s, %(new_status)s
+                  FROM allowed
+                ON CONFLICT (alert_id, alerter) DO UPDATE
+                   SET status=EXCLUDED.status
+                 WHERE %(expected_statuses)s::text[] IS NULL
+                    OR alerter_status.status = ANY(%(expected_statuses)s::text[])
+                RETURNING status
+            ), data AS ({data_statement}){chain_statement}
+            SELECT (SELECT status FROM previous) AS previous_status,
+                   EXISTS (SELECT 1 FROM new_status) AS applied,
+                   (SELECT id FROM data) AS data_id
+        """
+        chain_statement = ""
+        if chain_operation_data is not None:
+            chain_statement = """, chain AS (
+                UPDATE alerter_data
+                   SET task_chain_info=%(chain_task_chain_info)s
+                 WHERE (id=%(chain_id)s::bigint
+                        OR (%(chain_id)s::bigint IS NULL AND alert_id=%(alert_id)s AND alerter=%(alerter)s
+                            AND operation=%(chain_operation)s))
+                   AND EXISTS (SELECT 1 FROM new_status)
+                RETURNING id
+            )"""
+        query = query.format(data_statement=data_statement, chain_statement=chain_statement)
+        params = self._storable(operation_data) if operation_data is not None else {}
+        params.update(alert_id=alert_id, alerter=alerter, new_status=new_status,
+                      expected_statuses=list(expected_statuses) if expected_statuses is not None else None)
+        if chain_operation_data is not None:
+            params.update(chain_id=chain_operation_data.id, chain_operation=chain_operation_data.operation,
+                          chain_task_chain_info=chain_operation_data.task_chain_info)
+        record = self.backend._upsert(query, params)
+        if record is None:
+            return None, False
+        if operation_data is not None and record.data_id is not None:
+            operation_data.id = record.data_id
+        if record.applied:
+            self._invalidate_status_cache(alert_id)
+        return record.previous_status, record.applied
 
     # -----------------------
     # Alerters Data
@@ -80,21 +269,49 @@ class SpecificBackend:
         record = self.backend._fetchone(query, dict(alert_id=alert_id, alerter=alerter, operation=operation))
         return AlerterOperationData.from_record(record) if record else None
 
+    def get_alerter_state(self, alert_id: str, alerter: str) -> Tuple[Optional[str], Dict[str, AlerterOperationData]]:
+        """
+        Reads in one query the alerter status and the last alerter data of every operation for an alert and alerter.
+
+        :param alert_id:
+        :param alerter:
+        :return: tuple with the alerter status (None if not stored) and a dict with the last alerter data
+            by operation
+        """
+        query = """
+            SELECT s.status AS alerter_status, d.*
+              FROM (SELECT %(alert_id)s::text AS alert_id, %(alerter)s::text AS alerter) k
+              LEFT JOIN alerter_status s ON s.alert_id=k.alert_id AND s.alerter=k.alerter
+              LEFT JOIN LATERAL (
+                  SELECT DISTINCT ON (operation) *
+                    FROM alerter_data
+                   WHERE alert_id=k.alert_id
+                     AND alerter=k.alerter
+                   ORDER BY operation, received_time DESC
+              ) d ON true
+        """
+        records = self.backend._fetchall(query, dict(alert_id=alert_id, alerter=alerter))
+        status = records[0].alerter_status if records else None
+        operations_data = {record.operation: AlerterOperationData.from_record(record)
+                           for record in records if record.id is not None}
+        return status, operations_data
+
     def create_alerter_data(self, alerter_data: AlerterOperationData) -> Optional[AlerterOperationData]:
         insert = """
             INSERT INTO alerter_data (alert_id, alerter, operation, received_time, start_time, end_time, 
-                success, skipped, retries, response, reason, bg_task_id, task_chain_info)
+                success, skipped, retries, response, reason, bg_task_id, task_chain_info, timing, traceback_refs)
             VALUES (%(alert_id)s, %(alerter)s, %(operation)s, %(received_time)s, %(start_time)s, %(end_time)s, 
                 %(success)s, %(skipped)s, %(retries)s, %(response)s, %(reason)s, %(bg_task_id)s,
-                %(task_chain_info)s)
+                %(task_chain_info)s, %(timing)s, %(traceback_refs)s)
             ON CONFLICT (alert_id, alerter, operation) WHERE operation in ('new', 'recovery') DO UPDATE
                SET alert_id=%(alert_id)s, alerter=%(alerter)s, operation=%(operation)s, 
                    received_time=%(received_time)s, start_time=%(start_time)s, end_time=%(end_time)s, 
                    success=%(success)s, skipped=%(skipped)s, retries=%(retries)s, response=%(response)s, 
-                   reason=%(reason)s, bg_task_id=%(bg_task_id)s, task_chain_info=%(task_chain_info)s
+                   reason=%(reason)s, bg_task_id=%(bg_task_id)s, task_chain_info=%(task_chain_info)s,
+                   timing=%(timing)s, traceback_refs=%(traceback_refs)s
             RETURNING *
         """
-        record = self.backend._insert(insert, vars(alerter_data))
+        record = self.backend._insert(insert, self._storable(alerter_data))
         return AlerterOperationData.from_record(record) if record else None
 
     def update_alerter_data(self, alerter_data: AlerterOperationData) -> Optional[AlerterOperationData]:
@@ -103,13 +320,180 @@ class SpecificBackend:
                SET alert_id=%(alert_id)s, alerter=%(alerter)s, operation=%(operation)s, 
                    received_time=%(received_time)s, start_time=%(start_time)s, end_time=%(end_time)s, 
                    success=%(success)s, skipped=%(skipped)s, retries=%(retries)s, response=%(response)s, 
-                   reason=%(reason)s, bg_task_id=%(bg_task_id)s, task_chain_info=%(task_chain_info)s
+                   reason=%(reason)s, bg_task_id=%(bg_task_id)s, task_chain_info=%(task_chain_info)s,
+                   timing=%(timing)s, traceback_refs=%(traceback_refs)s
              WHERE id=%(id)s
          RETURNING *
         """
-        record = self.backend._updateone(update, vars(alerter_data), returning=True)
+        record = self.backend._updateone(update, self._storable(alerter_data), returning=True)
         return AlerterOperationData.from_record(record) if record else None
 
+    def get_alerters_info(self, alert_id: str, operations: Optional[List[str]] = None,
+                          limit_by_operation: Optional[int] = None,
+                          limit: Optional[int] = 100) -> Dict[str, dict]:
+        """
+        Reads the status, the operations data and the operations data summary of every alerter of an alert,
+        aggregated in database.
+
+        :param alert_id:
+        :param operations: if provided, only data of these operations is returned
+        :param limit_by_operation: if provided, only this number of the newest records of each operation is returned
+        :param limit: maximum number of records to return (the newest ones). None for no limit.
+        :return: dict by alerter name
+        """
+        query = """
+            WITH filtered AS (
+                SELECT d.*,
+                       row_number() OVER (PARTITION BY d.alerter, d.operation
+                                          ORDER BY d.received_time DESC, d.id DESC) AS rn
+                  FROM alerter_data d
+                 WHERE d.alert_id=%(alert_id)s
+                   AND (%(operations)s::text[] IS NULL OR d.operation = ANY(%(operations)s::text[]))
+            ), data AS (
+                SELECT *
+                  FROM filtered
+                 WHERE %(limit)s::integer IS NULL OR rn <= %(limit)s::integer
+                 ORDER BY received_time DESC NULLS LAST, id DESC
+                 LIMIT %(max_records)s::integer
+            ), alerters AS (
+                SELECT s.alerter, s.status,
+                       json_agg(json_build_object(
+                           'id', d.id, 'alert_id', d.alert_id, 'alerter', d.alerter, 'operation', d.operation,
+                           'received_time', to_char(d.received_time, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"'),
+                           'start_time', to_char(d.start_time, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"'),
+                           'end_time', to_char(d.end_time, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"'),
+                           'success', d.success, 'skipped', d.skipped, 'retries', d.retries,
+                           'response', d.response, 'reason', d.reason, 'bg_task_id', d.bg_task_id,
+                           'task_chain_info', d.task_chain_info, 'timing', d.timing
+                       ) ORDER BY d.id) FILTER (WHERE d.id IS NOT NULL) AS data,
+                       (SELECT json_agg(json_build_object(
+                                   'operation', sm.operation, 'count', sm.count,
+                                   'success_count', sm.success_count, 'skipped_count', sm.skipped_count,
+                                   'success_rate', sm.success_count::float / NULLIF(sm.count, 0),
+                                   'first_received_time',
+                                   to_char(sm.first_received_time, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"'),
+                                   'last_received_time',
+                                   to_char(sm.last_received_time, 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"')
+                               ) ORDER BY sm.operation)
+                          FROM alerter_data_summary sm
+                         WHERE sm.alert_id=s.alert_id
+                           AND sm.alerter=s.alerter
+                           AND (%(operations)s::text[] IS NULL OR sm.operation = ANY(%(operations)s::text[]))
+                       ) AS summary
+                  FROM alerter_status s
+                  LEFT JOIN data d
+                    ON d.alerter=s.alerter
+                 WHERE s.alert_id=%(alert_id)s
+                 GROUP BY s.alert_id, s.alerter, s.status
+            ), result AS (
+                SELECT COALESCE(jsonb_object_agg(
+                           alerter,
+                           jsonb_build_object('status', status, 'data', data)
+                           || CASE WHEN summary IS NULL THEN '{}'::jsonb
+                                   ELSE jsonb_build_object('summary', summary) END
+                       ), '{}'::jsonb) AS alerters
+                  FROM alerters
+            )
+            SELECT alerters
+              FROM result
+        """
+        record = self.backend._fetchone(query, dict(alert_id=alert_id,
+                                                    operations=list(operations) if operations else None,
+                                                    limit=limit_by_operation, max_records=limit))
+        alerters = record.alerters
+        traceback_refs = set()
+        for alerter_info in alerters.values():
+            for operation_data in alerter_info['data'] or []:
+                operation_data['response'] = expand_response(operation_data['response'])
+                find_traceback_refs(operation_data['response'], traceback_refs)
+        if traceback_refs:
+            tracebacks = self.get_tracebacks(traceback_refs)
+            for alerter_info in alerters.values():
+                for operation_data in alerter_info['data'] or []:
+                    operation_data['response'] = resolve_traceback_refs(operation_data['response'], tracebacks)
+        return alerters
+
+    def get_alerters_info_etag(self, alert_id: str, operations: Optional[List[str]] = None,
+                               limit_by_operation: Optional[int] = None, limit: Optional[int] = 100) -> str:
+        """
+        Returns a value to use as ETag of the alerters information of an alert (see get_alerters_info).
+
+        It is calculated from the alerters status, the number of records, the last id and the last time of the
+        operations data and the summary counts, read through the alert indexes without aggregating the records,
+        so the alerters information is only read when it has changed.
+        """
+        query = """
+            SELECT (SELECT string_agg(alerter || ':' || status, ',' ORDER BY alerter)
+                      FROM alerter_status
+                     WHERE alert_id=%(alert_id)s) AS statuses,
+                   d.count, d.max_id, d.max_time,
+                   (SELECT sum(count)
+                      FROM alerter_data_summary
+                     WHERE alert_id=%(alert_id)s
+                       AND (%(operations)s::text[] IS NULL OR operation = ANY(%(operations)s::text[]))
+                   ) AS summary_count
+              FROM (SELECT count(*) AS count, max(id) AS max_id,
+                           max(GREATEST(received_time, start_time, end_time)) AS max_time
+                      FROM alerter_data
+                     WHERE alert_id=%(alert_id)s
+                       AND (%(operations)s::text[] IS NULL OR operation = ANY(%(operations)s::text[]))
+                   ) d
+        """
+        operations = list(operations) if operations else None
+        record = self.backend._fetchone(query, dict(alert_id=alert_id, operations=operations))
+        version = (record.statuses, record.count, record.max_id,
+                   record.max_time.isoformat() if record.max_time else None, record.summary_count,
+                   operations, limit_by_operation, limit)
+        return hashlib.md5(json.dumps(version, default=str).encode('utf-8')).hexdigest()
+
+    def get_alerters_summary(self, alert_ids: List[str], alerters: Optional[List[str]] = None,
+                             operations: Optional[List[str]] = None) -> Dict[str, Dict[str, dict]]:
+        """
+        Reads a compact view of the alerters of several alerts: the status of each alerter and the last time an
+        operation of the alerter finished and finished successfully.
+
+        :param alert_ids:
+        :param alerters: if provided, only these alerters are returned
+        :param operations: if provided, only data of these operations is considered to get the times
+        :return: dict by alert id with a dict by alerter name
+        """
+        query = """
+            SELECT s.alert_id, s.alerter, s.status,
+                   to_char(max(d.end_time) FILTER (WHERE d.success),
+                           'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS last_success_time,
+                   to_char(max(d.end_time), 'YYYY-MM-DD"T"HH24:MI:SS.MS"Z"') AS last_end_time
+              FROM alerter_status s
+              LEFT JOIN alerter_data d
+                ON d.alert_id=s.alert_id
+               AND d.alerter=s.alerter
+               AND (%(operations)s::text[] IS NULL OR d.operation = ANY(%(operations)s::text[]))
+             WHERE s.alert_id = ANY(%(ids)s::text[])
+               AND (%(alerters)s::text[] IS NULL OR s.alerter = ANY(%(alerters)s::text[]))
+             GROUP BY s.alert_id, s.alerter, s.status
+        """
+        result = {}
+        for record in self.backend._fetchall(query, dict(ids=list(alert_ids),
+                                                         alerters=list(alerters) if alerters else None,
+                                                         operations=list(operations) if operations else None)):
+            result.setdefault(record.alert_id, {})[record.alerter] = {
+                'status': record.status,
+                'last_success_time': record.last_success_time,
+                'last_end_time': record.last_end_time
+            }
+        return result
+
+    def get_alert_version(self, alert_id: str):
+        """
+        Reads the columns of an alert used to check if a copy of the alert is up-to-date, and the columns that may
+        be modified without changing them (tags and attributes).
+        """
+        query = """
+            SELECT update_time, status, last_receive_id, tags, attributes
+              FROM alerts
+             WHERE id=%(alert_id)s
+        """
+        return self.backend._fetchone(query, dict(alert_id=alert_id))
+
     def get_last_executing_operation(self, alert_id: str, alerter: str) -> Optional[AlerterOperationData]:
         query = """
             SELECT *
@@ -125,12 +509,161 @@ class SpecificBackend:
         record = self.backend._fetchone(query, dict(alert_id=alert_id, alerter=alerter))
         return AlerterOperationData.from_record(record) if record else None
 
+    def store_tracebacks(self, tracebacks: Dict[str, str]):
+        """
+        Stores deduplicated tracebacks by hash. Tracebacks recently stored by this process are ignored.
+        Stored time of tracebacks already in the database is updated.
+        """
+        now = time.monotonic()
+        new_tracebacks = {k: v for k, v in tracebacks.items()
+                          if now - self._stored_tracebacks.get(k, -self.TRACEBACK_STORED_CACHE_TIME)
+                          >= self.TRACEBACK_STORED_CACHE_TIME}
+        if not new_tracebacks:
+            return
+        insert = """
+            INSERT INTO alerter_traceback (hash, traceback)
+            SELECT * FROM unnest(%(hashes)s::text[], %(tracebacks)s::text[])
+            ON CONFLICT (hash) DO UPDATE
+               SET stored_time=EXCLUDED.stored_time
+            RETURNING hash
+        """
+        self.backend._insert(insert, dict(hashes=list(new_tracebacks.keys()),
+                                          tracebacks=list(new_tracebacks.values())))
+        if len(self._stored_tracebacks) > 1000:
+            self._stored_tracebacks.clear()
+        self._stored_tracebacks.update((k, now) for k in new_tracebacks)
+
+    def get_tracebacks(self, hashes) -> Dict[str, str]:
+        query = """
+            SELECT hash, traceback
+              FROM alerter_traceback
+             WHERE hash = ANY(%(hashes)s)
+        """
+        return {record.hash: record.traceback
+                for record in self.backend._fetchall(query, dict(hashes=list(hashes)))}
+
+    def compact_alerters_data(self, retention: Dict[str, int], default_retention: Optional[int] = None,
+                              limit: int = 500) -> Tuple[int, int]:
+        """
+        Removes the oldest alerter data records of operations with more records than the configured
+        retention, adding them to the summary of the operation (counts of executions, successes and skipped).
+
+        An operation can only exceed its retention when a record is added, so only (alert, alerter, operation)
+        groups with records created after the last group checked are candidates. They are found through the
+        primary key from a watermark stored in key_value_store for the current retention configuration, and
+        the watermark is advanced in the same statement. Changing the retention starts from the first record.
+
+        Only processes up to 'limit' groups. Operations 'new' and 'recovery' are never compacted and the last
+        record of an operation is always kept, as it may be in use by a running task.
+
+        :param retention: dict with the number of records to keep by operation
+        :param default_retention: number of records to keep for operations not included in retention.
+            If None, those operations are not compacted.
+        :param limit: maximum number of (alert, alerter, operation) groups to check
+        :return: tuple with the number of groups checked and the number of records removed
+        """
+        query = """
+            WITH candidates AS (
+                SELECT alert_id, alerter, operation, max(id) AS max_id
+                  FROM alerter_data
+                 WHERE id > COALESCE((SELECT value::bigint FROM key_value_store WHERE key=%(watermark_key)s), 0)
+                   AND operation not in ('new', 'recovery')
+                 GROUP BY alert_id, alerter, operation
+                 ORDER BY max(id)
+                 LIMIT %(limit)s
+            ), groups AS (
+                SELECT alert_id, alerter, operation,
+                       COALESCE((%(retention)s::jsonb ->> operation)::integer, %(default_retention)s) AS keep
+                  FROM candidates
+                 WHERE COALESCE((%(retention)s::jsonb ->> operation)::integer, %(default_retention)s) IS NOT NULL
+            ), expired AS (
+                SELECT d.id
+                  FROM groups g
+                 CROSS JOIN LATERAL (
+                    SELECT id
+                      FROM alerter_data
+                     WHERE alert_id=g.alert_id
+                       AND alerter=g.alerter
+                       AND operation=g.operation
+                     ORDER BY received_time DESC, id DESC
+                    OFFSET g.keep
+                 ) d
+            ), deleted AS (
+                DELETE FROM alerter_data
+                 WHERE id IN (SELECT id FROM expired)
+                RETURNING alert_id, alerter, operation, success, skipped, received_time
+            ), summary AS (
+                INSERT INTO alerter_data_summary AS s (alert_id, alerter, operation, count, success_count,
+                    skipped_count, first_received_time, last_received_time)
+                SELECT alert_id, alerter, operation, count(*), count(*) FILTER (WHERE success),
+                       count(*) FILTER (WHERE skipped), min(received_time), max(received_time)
+                  FROM deleted
+                 GROUP BY alert_id, alerter, operation
+                ON CONFLICT (alert_id, alerter, operation) DO UPDATE
+                   SET count=s.count + EXCLUDED.count,
+                       success_count=s.success_count + EXCLUDED.success_count,
+                       skipped_count=s.skipped_count + EXCLUDED.skipped_count,
+                       first_received_time=LEAST(s.first_received_time, EXCLUDED.first_received_time),
+                       last_received_time=GREATEST(s.last_received_time, EXCLUDED.last_received_time)
+                RETURNING 1
+            ), watermark AS (
+                INSERT INTO key_value_store (key, value)
+                SELECT %(watermark_key)s, max(max_id)::text
+                  FROM candidates
+                HAVING count(*) > 0
+                ON CONFLICT (key) DO UPDATE
+                   SET value=EXCLUDED.value
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM candidates) AS groups,
+                   (SELECT count(*) FROM deleted) AS deleted
+        """
+        retention = {operation: max(int(keep), 1) for operation, keep in (retention or {}).items()}
+        if default_retention is not None:
+            default_retention = max(int(default_retention), 1)
+        retention = json.dumps(retention, sort_keys=True)
+        watermark_key = self.COMPACTION_WATERMARK_KEY_PREFIX + hashlib.md5(
+            f"{retention}:{default_retention}".encode('utf-8')).hexdigest()[:16]
+        record = self.backend._upsert(query, dict(retention=retention, default_retention=default_retention,
+                                                  limit=limit, watermark_key=watermark_key))
+        return (record.groups, record.deleted) if record else (0, 0)
+
+    def prune_tracebacks(self, min_age: Optional[int] = None) -> int:
+        """
+        Removes the deduplicated tracebacks not referenced by any alerter or recovery action response.
+
+        References are tracked in the traceback_refs column of the responses, so only the tracebacks not stored
+        for a while are checked, each one through the index of that column.
+
+        :param min_age: only tracebacks not stored for this number of seconds are removed.
+            Default: TRACEBACK_MIN_AGE
+        :return: number of tracebacks removed
+        """
+        delete = """
+            WITH deleted AS (
+                DELETE FROM alerter_traceback t
+                 WHERE stored_time < (now() at time zone 'utc') - %(min_age)s * interval '1 second'
+                   AND NOT EXISTS (SELECT 1 FROM alerter_data d WHERE d.traceback_refs @> ARRAY[t.hash])
+                   AND NOT EXISTS (SELECT 1 FROM recovery_action_data r WHERE r.traceback_refs @> ARRAY[t.hash])
+                RETURNING 1
+            )
+            SELECT count(*) AS deleted FROM deleted
+        """
+        min_age = self.TRACEBACK_MIN_AGE if min_age is None else min_age
+        record = self.backend._upsert(delete, dict(min_age=min_age))
+        return record.deleted if record else 0
+
     def clear_alerters_data(self, alert_id: str):
         delete = """
             DELETE FROM alerter_data
              WHERE alert_id=%(alert_id)s
         """
         self.backend._deleteall(delete, dict(alert_id=alert_id))
+        delete = """
+            DELETE FROM alerter_data_summary
+             WHERE alert_id=%(alert_id)s
+        """
+        self.backend._deleteall(delete, dict(alert_id=alert_id))
 
     # -----------------------
     # Recovery actions
@@ -149,15 +682,15 @@ class SpecificBackend:
         insert = """
             INSERT INTO recovery_action_data (alert_id, provider, actions, status, received_time, start_time, 
                 end_time, recovery_time, alerting_time, success, retries, response, 
-                job_id, bg_task_id
+                job_id, bg_task_id, traceback_refs
                 )
             VALUES (%(alert_id)s, %(provider)s, %(actions)s, %(status)s, %(received_time)s, %(start_time)s, 
                 %(end_time)s, %(recovery_time)s, %(alerting_time)s, %(success)s, %(retries)s, %(response)s, 
-                %(job_id)s, %(bg_task_id)s
+                %(job_id)s, %(bg_task_id)s, %(traceback_refs)s
                 )
             RETURNING *
         """
-        record = self.backend._insert(insert, vars(recovery_action_data))
+        record = self.backend._insert(insert, self._storable(recovery_action_data))
         return RecoveryActionData.from_record(record) if record else None
 
     def update_recovery_action_data(self, recovery_action_data: RecoveryActionData) -> Optional[RecoveryActionData]:
@@ -166,11 +699,12 @@ class SpecificBackend:
                SET alert_id=%(alert_id)s, provider=%(provider)s, actions=%(actions)s, status=%(status)s, 
                    received_time=%(received_time)s, start_time=%(start_time)s, end_time=%(end_time)s, 
                    recovery_time=%(recovery_time)s, alerting_time=%(alerting_time)s, success=%(success)s, 
-                   retries=%(retries)s, response=%(response)s, job_id=%(job_id)s, bg_task_id=%(bg_task_id)s
+                   retries=%(retries)s, response=%(response)s, job_id=%(job_id)s, bg_task_id=%(bg_task_id)s,
+                   traceback_refs=%(traceback_refs)s
              WHERE alert_id=%(alert_id)s 
          RETURNING *
         """
-        record = self.backend._updateone(update, vars(recovery_action_data), returning=True)
+        record = self.backend._updateone(update, self._storable(recovery_action_data), returning=True)
         return RecoveryActionData.from_record(record) if record else None
 
     # ------------------------
@@ -0,0 +1,142 @@
+import logging
+from typing import Optional, Dict, Tuple
+
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class AlerterStatusCache:
+    """
+    Read-through cache of the alerters status in redis.
+
+    Status of the alerters of an alert are stored in a redis hash (one field per alerter). Hashes that hold
+    the status of all the alerters of the alert are marked with a special field, so missing alerters
+    in them are known to have no status stored.
+
+    Every status change in the database invalidates the hash of the alert and increments a version counter.
+    Statuses read from the database are only stored in the cache if the version has not changed since before
+    they were read, so a read that finishes after a concurrent change never caches a stale status.
+
+    Any error accessing redis is logged and handled as a cache miss. Database is always the source of truth.
+    """
+    KEY_PREFIX = 'alerta:alerter_status:'
+    VERSION_KEY_PREFIX = 'alerta:alerter_status_version:'
+    COMPLETE_FIELD = '__complete__'
+
+    # KEYS: status hash, version. ARGV: version read before reading the database, ttl, field, value, ...
+    POPULATE_SCRIPT = """
+local version = redis.call('GET', KEYS[2]) or ''
+if version ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 3))
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+    def __init__(self, client, ttl: int):
+        self.client = client
+        self.ttl = ttl
+        self._populate_script = client.register_script(self.POPULATE_SCRIPT)
+
+    @classmethod
+    def create(cls) -> Optional['AlerterStatusCache']:
+        """
+        Creates the cache if enabled in configuration.
+
+        :return: the cache or None if it is not enabled
+        """
+        from datadope_alerta import get_config, get_redis_client, CONFIG_ALERTER_STATUS_CACHE, \
+            DEFAULT_ALERTER_STATUS_CACHE, CONFIG_ALERTER_STATUS_CACHE_TTL, DEFAULT_ALERTER_STATUS_CACHE_TTL
+        if not get_config(CONFIG_ALERTER_STATUS_CACHE, DEFAULT_ALERTER_STATUS_CACHE, type=bool):
+            return None
+        ttl = get_config(CONFIG_ALERTER_STATUS_CACHE_TTL, DEFAULT_ALERTER_STATUS_CACHE_TTL, type=int)
+        logger.info("Using alerter status cache with ttl %d secs", ttl)
+        return cls(get_redis_client(), ttl)
+
+    def _key(self, alert_id):
+        return f"{self.KEY_PREFIX}{alert_id}"
+
+    def _version_key(self, alert_id):
+        return f"{self.VERSION_KEY_PREFIX}{alert_id}"
+
+    def get(self, alert_id: str, alerter: str) -> Tuple[bool, Optional[str]]:
+        """
+        :return: tuple with a boolean indicating if the status is known by the cache and the status
+            (None if the alerter has no status stored).
+        """
+        try:
+            status, complete = self.client.hmget(self._key(alert_id), alerter, self.COMPLETE_FIELD)
+        except RedisError as e:
+            logger.warning("Error reading alerter status cache: %s", e)
+            return False, None
+        if status is not None:
+            return True, status
+        return complete is not None, None
+
+    def get_all(self, alert_id: str) -> Optional[Dict[str, str]]:
+        """
+        :return: dict with the status of all the alerters of the alert or None if it is not known by the cache.
+        """
+        try:
+            statuses = self.client.hgetall(self._key(alert_id))
+        except RedisError as e:
+            logger.warning("Error reading alerter status cache: %s", e)
+            return None
+        if statuses.pop(self.COMPLETE_FIELD, None) is None:
+            return None
+        return statuses
+
+    def get_version(self, alert_id: str) -> Optional[str]:
+        """
+        Reads the version of the cached statuses of an alert. It must be read before reading the statuses from
+        the database to populate the cache with them.
+
+        :return: the version or None if it cannot be read (the cache must not be populated then).
+        """
+        try:
+            return self.client.get(self._version_key(alert_id)) or ''
+        except RedisError as e:
+            logger.warning("Error reading alerter status cache version: %s", e)
+            return None
+
+    def populate(self, alert_id: str, version: Optional[str], statuses: Dict[str, str], complete: bool = False):
+        """
+        Stores statuses read from the database if no status of the alert has changed since the version was read.
+
+        :param alert_id:
+        :param version: version returned by `get_version` before reading the statuses from the database
+        :param statuses: dict with the status of each alerter
+        :param complete: True if statuses include all the alerters with status stored for the alert
+        :return: True if the statuses have been stored
+        """
+        if version is None:
+            return False
+        mapping = dict(statuses, **{self.COMPLETE_FIELD: '1'}) if complete else statuses
+        if not mapping:
+            return False
+        args = [version, self.ttl]
+        for field, value in mapping.items():
+            args.extend((field, value))
+        try:
+            return bool(self._populate_script(keys=[self._key(alert_id), self._version_key(alert_id)], args=args))
+        except RedisError as e:
+            logger.warning("Error storing alerter status cache: %s", e)
+            return False
+
+    def invalidate(self, alert_id: str):
+        """
+        Removes the cached statuses of an alert. Must be called every time a status of the alert is changed
+        in the database.
+        """
+        version_key = self._version_key(alert_id)
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.delete(self._key(alert_id))
+            pipeline.incr(version_key)
+            pipeline.expire(version_key, self.ttl)
+            pipeline.execute()
+        except RedisError as e:
+            logger.warning("Error invalidating alerter status cache: %s", e)
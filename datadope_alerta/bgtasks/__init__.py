@@ -1,3 +1,6 @@
+# noinspection PyPackageRequirements
+from celery.signals import worker_process_init, worker_process_shutdown
+
 from alerta.app import create_app, create_celery_app
 # noinspection PyUnresolvedReferences
 from alerta.app import db  # To provide import for package modules
@@ -11,7 +14,8 @@ from alerta.utils.collections import merge  # To provide import for package modu
 # noinspection PyUnresolvedReferences
 from alertaclient.api import Client as AlertaClient  # To provide import for package modules
 
-from datadope_alerta import initialize, is_initialized
+from datadope_alerta import initialize, is_initialized, get_config, CONFIG_WORKER_WARM_UP, DEFAULT_WORKER_WARM_UP, \
+    CONFIG_REVOKE_BROADCAST_FALLBACK, DEFAULT_REVOKE_BROADCAST_FALLBACK
 from datadope_alerta.plugins import getLogger
 
 
@@ -29,7 +33,33 @@ logger = getLogger('bgtasks')
 
 
 def revoke_task(task_id):
-    celery.control.revoke(task_id)
+    """
+    Cancels a background task registering it in the cancellation registry, checked by the task before starting.
+    Task is revoked with a broadcast to all the workers only if it cannot be registered and
+    REVOKE_BROADCAST_FALLBACK is enabled.
+    """
+    from .cancellation import CancellationRegistry
+    from .delayed import DelayedScheduler
+    # Task may be waiting in the delayed scheduler. Cancelled anyway as it may have been moved to its queue
+    DelayedScheduler.cancel(task_id)
+    if not CancellationRegistry.cancel(task_id) \
+            and get_config(CONFIG_REVOKE_BROADCAST_FALLBACK, DEFAULT_REVOKE_BROADCAST_FALLBACK, type=bool,
+                           config=app.config):
+        celery.control.revoke(task_id)
+
+
+@worker_process_init.connect
+def init_worker_process(**_):
+    from .warm_up import warm_up
+    if get_config(CONFIG_WORKER_WARM_UP, DEFAULT_WORKER_WARM_UP, type=bool, config=app.config):
+        warm_up()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**_):
+    from datadope_alerta.backend.flexiblededup.metrics import MetricsBuffer
+    with app.app_context():
+        MetricsBuffer.get_instance().flush()
 
 
 # Import all tasks to ensure celery finds them including only the package in CELERY_IMPORTS
@@ -39,5 +69,9 @@ from .recovery_actions import launch_actions  # noqa - To provide import for pac
 
 from .async_alert_task import async_receive  # noqa - To provide import for package modules
 
+from .digest import flush_digest  # noqa - To provide import for package modules
+
+from .delayed import move_delayed_tasks  # noqa - To provide import for package modules
+
 # Tasks defined as classes must be instantiated and registered
-from .alert import event_task, recovery_task, repeat_task, action_task  # noqa - To provide import for package modules
+from .alert import event_task, recovery_task, repeat_task, action_task, fan_out_task  # noqa - To provide import for package modules
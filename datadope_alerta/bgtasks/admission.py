@@ -0,0 +1,196 @@
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+from datadope_alerta import get_config, get_redis_client, \
+    CONFIG_ASYNC_ALERT_HIGH_WATERMARK, DEFAULT_ASYNC_ALERT_HIGH_WATERMARK, \
+    CONFIG_ASYNC_ALERT_LOW_WATERMARK, DEFAULT_ASYNC_ALERT_LOW_WATERMARK, \
+    CONFIG_ASYNC_ALERT_LOW_SEVERITIES, DEFAULT_ASYNC_ALERT_LOW_SEVERITIES, \
+    CONFIG_ASYNC_ALERT_DEPTH_CACHE_TIME, DEFAULT_ASYNC_ALERT_DEPTH_CACHE_TIME, \
+    CONFIG_ASYNC_ALERT_MAX_RETRY_AFTER, DEFAULT_ASYNC_ALERT_MAX_RETRY_AFTER
+from . import app, getLogger
+
+logger = getLogger(__name__)
+
+# kombu redis transport defaults
+DEFAULT_PRIORITY_SEP = '\x06\x16'
+DEFAULT_PRIORITY_STEPS = [0, 3, 6, 9]
+
+
+@dataclass
+class QueueState:
+    depth: int
+    consumption_rate: float  # tasks per second
+    read_at: float
+
+
+class AdmissionControl:
+    """
+    Admission control of `/async/alert` based on the backlog of the async alert queue.
+
+    The depth of the queue is read from the broker (LLEN of the queue and its priority sub-queues) and the
+    consumption rate is counted by the workers in redis, in buckets of `RATE_BUCKET` seconds. Both values are cached
+    by each process during ASYNC_ALERT_DEPTH_CACHE_TIME seconds, so checking admission doesn't access redis for each
+    request.
+
+    Alerts are rejected while the depth is over ASYNC_ALERT_HIGH_WATERMARK. Alerts with a severity in
+    ASYNC_ALERT_LOW_SEVERITIES are also rejected while the depth is over ASYNC_ALERT_LOW_WATERMARK. Rejected requests
+    receive the seconds needed to consume the queue down to the watermark at the current consumption rate, limited
+    to ASYNC_ALERT_MAX_RETRY_AFTER.
+
+    Any error accessing redis is logged and the alert is admitted.
+    """
+    CONSUMED_KEY_PREFIX = 'alerta:async_alert:consumed:'
+    REJECTED_KEY = 'alerta:async_alert:rejected'
+    RATE_BUCKET = 10
+    RATE_BUCKETS = 6
+
+    _state: Optional[QueueState] = None
+    _broker_client = None
+
+    @staticmethod
+    def get_high_watermark() -> int:
+        return get_config(CONFIG_ASYNC_ALERT_HIGH_WATERMARK, DEFAULT_ASYNC_ALERT_HIGH_WATERMARK, type=int,
+                          config=app.config)
+
+    @classmethod
+    def is_enabled(cls) -> bool:
+        return cls.get_high_watermark() > 0
+
+    @classmethod
+    def _get_broker_client(cls):
+        if cls._broker_client is None:
+            # noinspection PyPackageRequirements
+            import redis
+            cls._broker_client = redis.Redis.from_url(get_config('CELERY_BROKER_URL', config=app.config),
+                                                      decode_responses=True)
+        return cls._broker_client
+
+    @staticmethod
+    def _get_queue_keys():
+        queue = app.config.get('ASYNC_ALERT_TASK_QUEUE') or app.config.get('CELERY_DEFAULT_QUEUE') or 'celery'
+        options = app.config.get('BROKER_TRANSPORT_OPTIONS') or {}
+        sep = options.get('sep', DEFAULT_PRIORITY_SEP)
+        steps = options.get('priority_steps', DEFAULT_PRIORITY_STEPS)
+        return queue, [f"{queue}{sep}{x}" if x else queue for x in sorted(set(steps) | {0})]
+
+    @classmethod
+    def _get_consumption_rate(cls, client, now: float) -> float:
+        # Current bucket is not complete, so it is not considered
+        current = int(now // cls.RATE_BUCKET)
+        keys = [f"{cls.CONSUMED_KEY_PREFIX}{x}" for x in range(current - cls.RATE_BUCKETS, current)]
+        consumed = sum(int(x) for x in client.mget(keys) if x)
+        return consumed / (cls.RATE_BUCKETS * cls.RATE_BUCKET)
+
+    @classmethod
+    def get_queue_state(cls, use_cache: bool = True) -> QueueState:
+        now = time.time()
+        state = cls._state
+        if use_cache and state is not None \
+                and now - state.read_at < get_config(CONFIG_ASYNC_ALERT_DEPTH_CACHE_TIME,
+                                                     DEFAULT_ASYNC_ALERT_DEPTH_CACHE_TIME, type=float,
+                                                     config=app.config):
+            return state
+        _, keys = cls._get_queue_keys()
+        pipeline = cls._get_broker_client().pipeline(transaction=False)
+        for key in keys:
+            pipeline.llen(key)
+        depth = sum(pipeline.execute())
+        state = QueueState(depth=depth,
+                           consumption_rate=cls._get_consumption_rate(get_redis_client(config=app.config), now),
+                           read_at=now)
+        cls._state = state
+        return state
+
+    @classmethod
+    def check(cls, severity: Optional[str]) -> Optional[int]:
+        """
+        Checks if an alert with the provided severity is admitted.
+
+        :return: None if the alert is admitted or the seconds to wait before retrying it
+        """
+        high_watermark = cls.get_high_watermark()
+        if high_watermark <= 0:
+            return None
+        try:
+            state = cls.get_queue_state()
+        except RedisError as e:
+            logger.warning("Error reading async alert queue depth. Alert admitted: %s", e)
+            return None
+        watermark = None
+        if state.depth >= high_watermark:
+            watermark = high_watermark
+        else:
+            low_watermark = get_config(CONFIG_ASYNC_ALERT_LOW_WATERMARK, DEFAULT_ASYNC_ALERT_LOW_WATERMARK,
+                                       type=int, config=app.config)
+            if 0 < low_watermark <= state.depth \
+                    and severity in get_config(CONFIG_ASYNC_ALERT_LOW_SEVERITIES, DEFAULT_ASYNC_ALERT_LOW_SEVERITIES,
+                                               type=list, config=app.config):
+                watermark = low_watermark
+        if watermark is None:
+            return None
+        retry_after = cls.get_retry_after(state, watermark)
+        cls._record_rejected('high' if watermark == high_watermark else 'low')
+        return retry_after
+
+    @staticmethod
+    def get_retry_after(state: QueueState, watermark: int) -> int:
+        """
+        Seconds needed to consume the queue down to the watermark at the current consumption rate.
+        """
+        max_retry_after = get_config(CONFIG_ASYNC_ALERT_MAX_RETRY_AFTER, DEFAULT_ASYNC_ALERT_MAX_RETRY_AFTER,
+                                     type=int, config=app.config)
+        if state.consumption_rate <= 0:
+            return max_retry_after
+        return min(max(math.ceil((state.depth - watermark + 1) / state.consumption_rate), 1), max_retry_after)
+
+    @classmethod
+    def _record_rejected(cls, reason: str):
+        try:
+            get_redis_client(config=app.config).hincrby(cls.REJECTED_KEY, reason, 1)
+        except RedisError as e:
+            logger.warning("Error counting rejected async alert: %s", e)
+
+    @classmethod
+    def record_consumed(cls):
+        """
+        Counts an async alert consumed by the worker. Used to compute the consumption rate.
+        """
+        if not cls.is_enabled():
+            return
+        key = f"{cls.CONSUMED_KEY_PREFIX}{int(time.time() // cls.RATE_BUCKET)}"
+        try:
+            pipeline = get_redis_client(config=app.config).pipeline()
+            pipeline.incr(key)
+            pipeline.expire(key, cls.RATE_BUCKET * (cls.RATE_BUCKETS + 2))
+            pipeline.execute()
+        except RedisError as e:
+            logger.warning("Error counting consumed async alert: %s", e)
+
+    @classmethod
+    def render_prometheus(cls) -> str:
+        """
+        Renders the state of the async alert queue and the rejected alerts using prometheus text format.
+        """
+        queue, _ = cls._get_queue_keys()
+        state = cls.get_queue_state(use_cache=False)
+        rejected = get_redis_client(config=app.config).hgetall(cls.REJECTED_KEY)
+        labels = f'{{queue="{queue}"}}'
+        output = [
+            "# HELP alerta_async_alert_queue_depth Messages waiting in the async alert queue\n",
+            "# TYPE alerta_async_alert_queue_depth gauge\n",
+            f"alerta_async_alert_queue_depth{labels} {state.depth}\n",
+            "# HELP alerta_async_alert_consumption_rate Async alerts consumed per second by the workers\n",
+            "# TYPE alerta_async_alert_consumption_rate gauge\n",
+            f"alerta_async_alert_consumption_rate{labels} {state.consumption_rate}\n",
+            "# HELP alerta_async_alert_rejected_total Async alerts rejected by admission control\n",
+            "# TYPE alerta_async_alert_rejected_total counter\n"
+        ]
+        for reason in ('high', 'low'):
+            output.append(f'alerta_async_alert_rejected_total{{queue="{queue}",watermark="{reason}"}} '
+                          f'{int(rejected.get(reason, 0))}\n')
+        return ''.join(output)
@@ -1,26 +1,39 @@
 import logging
 import random
+import time
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Optional, Tuple
 
+# noinspection PyPackageRequirements
+from billiard.einfo import ExceptionInfo
+# noinspection PyPackageRequirements
+from celery import states
+# noinspection PyPackageRequirements
+from celery.exceptions import Ignore, Retry
 # noinspection PyPackageRequirements
 from celery.utils.time import get_exponential_backoff_interval
 from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
 
-from alerta.models.metrics import Timer
 from datadope_alerta import BGTaskAlerterDataConstants as BGTadC, ContextualConfiguration, GlobalAttributes
 from datadope_alerta import DateTime, thread_local, ALERTERS_KEY_BY_OPERATION
+from datadope_alerta.backend.flexiblededup.metrics import BufferedTimer, MetricsBuffer
+from datadope_alerta.backend.flexiblededup.models.alert_snapshot import AlertSnapshot
 from datadope_alerta.backend.flexiblededup.models.alerters import AlerterOperationData
-from datadope_alerta.plugins import Alerter, AlerterStatus, RetryableException
+from datadope_alerta.plugins import Alerter, AlerterStatus, AlerterStateSnapshot, RetryableException, AlerterRegistry, \
+    TaskTiming, RateLimitedException
+from datadope_alerta.plugins.priority_lanes import DEFAULT_LANE
+from datadope_alerta.plugins.rate_limiter import must_defer
 from .. import app, celery, getLogger, Alert
+from ..cancellation import CancellableTask
+from ..delayed import DelayedScheduler, DelayedSignature
 # noinspection PyUnresolvedReferences
 from .. import revoke_task  # To provide import to package modules
 
 
-class AlertTask(celery.Task, ABC):
+class AlertTask(CancellableTask, ABC):
     ignore_result = True
-    _time_management = {}
+    _status_transition_attempts = 5
     _recovery_task = None
     _action_task = None
 
@@ -105,7 +118,7 @@ class AlertTask(celery.Task, ABC):
     def _get_alerter(alerter_data, task):
         alerter_name = alerter_data[BGTadC.NAME]
         alerter_class = alerter_data[BGTadC.CLASS]
-        return Alerter.get_alerter_type(alerter_class)(alerter_name, task)
+        return AlerterRegistry.get_alerter(alerter_class, alerter_name, task)
 
     @classmethod
     def _get_parameters(cls, kwargs):  # task_id null for intermediate requests => begin time is not popped
@@ -117,30 +130,102 @@ class AlertTask(celery.Task, ABC):
         operation_key = action_ or ALERTERS_KEY_BY_OPERATION[operation]
         return alert_id, alerter_name, operation, operation_key
 
-    @classmethod
-    def _get_timing_from_now(cls, task_id):
+    def _get_timing_from_now(self):
         """
         Returns task begin time if available, finish time == now and duration (if begin time is available).
+        Begin time is only available for the first execution of the task (not for retries).
 
-        :param task_id:
         :return:
         """
         now = datetime.utcnow()
         duration = 0.0
-        begin = cls._time_management.get(task_id, None)
+        begin = getattr(self.request, 'task_start_time', None)
         if begin:
             duration = (now - begin).total_seconds()
         return begin, now, duration
 
-    @classmethod
-    def _update_alerter_db_info(cls, status: AlerterStatus,
-                                alerter_operation_data: AlerterOperationData):
+    @property
+    def task_timing(self) -> TaskTiming:
+        """
+        Timing of the phases of the task being executed.
+        """
+        timing = getattr(self.request, 'task_timing', None)
+        if timing is None:
+            timing = TaskTiming()
+            self.request.task_timing = timing
+        return timing
+
+    def _get_queue(self) -> str:
+        return (self.request.delivery_info or {}).get('routing_key') or ''
+
+    def _get_lane(self) -> str:
+        return (getattr(self.request, 'properties', None) or {}).get('lane') or DEFAULT_LANE
+
+    def _get_deferrals(self) -> int:
+        """
+        Number of times the task has been rescheduled because its destination was rate limited or its circuit was
+        open. Celery counts them as retries, but they don't consume the retries of the retry policy.
+        """
+        return int((getattr(self.request, 'properties', None) or {}).get('deferrals') or 0)
+
+    @property
+    def retry_number(self) -> int:
+        """
+        Number of retries of the task consumed from the retry policy.
+        """
+        return self.request.retries - self._get_deferrals()
+
+    def _get_queue_wait(self, start_time: datetime) -> Optional[float]:
+        """
+        Returns the seconds since the task was scheduled to run (its eta or the time it was due in the delayed
+        scheduler) until start time, if it has eta.
+        """
+        eta = self.request.eta or DelayedScheduler.get_due_time(self.request)
+        if not eta:
+            return None
+        try:
+            if isinstance(eta, str):
+                eta = datetime.fromisoformat(eta)
+        except ValueError:
+            return None
+        if eta.tzinfo is not None:
+            eta = eta.astimezone(timezone.utc).replace(tzinfo=None)
+        return max(0.0, (start_time - eta).total_seconds())
+
+    def _export_timing(self, alerter_name, operation_key):
+        """
+        Adds the time of each phase of the task to the latency histograms of the phases of alerters tasks.
+        """
+        labels = {'alerter': alerter_name, 'operation': operation_key, 'queue': self._get_queue()}
+        metrics_buffer = MetricsBuffer.get_instance()
+        for phase, seconds in self.task_timing.phases.items():
+            metrics_buffer.observe('alerter_task_phase_seconds', seconds, labels=dict(labels, phase=phase))
+        queue_wait = self.task_timing.phases.get(TaskTiming.QUEUE_WAIT)
+        if queue_wait is not None:
+            metrics_buffer.observe('alerter_lane_queue_wait_seconds', queue_wait,
+                                   labels={'lane': self._get_lane(), 'queue': labels['queue'],
+                                           'operation': operation_key})
+        TaskTiming.set_current(None)
+
+    @property
+    def alerter_state(self) -> Optional[AlerterStateSnapshot]:
+        """
+        Snapshot of the alerter status and operations data loaded for the task being executed.
+        """
+        return getattr(self.request, 'alerter_state', None)
+
+    def _load_alerter_state(self, alert_id, alerter_name) -> AlerterStateSnapshot:
+        self.request.alerter_state = AlerterStateSnapshot.load(alert_id, alerter_name)
+        return self.request.alerter_state
+
+    def _update_alerter_db_info(self, status: AlerterStatus,
+                                alerter_operation_data: AlerterOperationData,
+                                expected_status: Optional[AlerterStatus] = None) -> Tuple[bool, AlerterStatus]:
         alerter_operation_data.task_chain_info = None
-        AlerterStatus.store(alerter_operation_data.alert_id, alerter_operation_data.alerter, status=status)
-        alerter_operation_data.store()
+        return self.alerter_state.transition(status, alerter_operation_data, expected_status)
 
     def _finish_task(self, alerter_operation_data: AlerterOperationData, status, retval, start_time,
-                     end_time):
+                     end_time, expected_status: Optional[AlerterStatus] = None) -> Tuple[bool, AlerterStatus]:
         if start_time is None:
             start_time = alerter_operation_data.start_time
         if start_time is not None and end_time is not None:
@@ -149,11 +234,19 @@ class AlertTask(celery.Task, ABC):
             duration = 0.0
         alerter_operation_data = Alerter.prepare_result(alerter_operation_data=alerter_operation_data, retval=retval,
                                                         start_time=start_time, end_time=end_time,
-                                                        retries=self.request.retries)
+                                                        retries=self.retry_number)
+        alerter_operation_data.timing = self.task_timing.as_dict()
         self.logger.info("PROCESS FINISHED IN %.3f sec. RESULT %s -> %s",
                          duration, 'SUCCESS' if alerter_operation_data.success else 'FAILURE', retval)
-        self._update_alerter_db_info(status, alerter_operation_data)
+        return self._update_alerter_db_info(status, alerter_operation_data, expected_status)
+
+    def _log_concurrent_status_change(self, expected_status, current_status):
+        self.logger.info("Alerter status changed concurrently from '%s' to '%s'. Reevaluating",
+                         expected_status.value, current_status.value)
 
+    def _log_status_conflict(self, new_status):
+        self.logger.warning("Alerter status is changing concurrently. Status '%s' not stored after %d attempts",
+                            new_status.value, self._status_transition_attempts)
 
     def before_start(self, task_id, args, kwargs):  # noqa
         start_time = datetime.utcnow()
@@ -161,101 +254,213 @@ class AlertTask(celery.Task, ABC):
         thread_local.alert_id = alert_id
         thread_local.alerter_name = alerter_name
         thread_local.operation = operation_key
+        self.ignore_if_cancelled(task_id)
+        timing = TaskTiming()
+        self.request.task_timing = timing
+        TaskTiming.set_current(timing)
+        queue_wait = self._get_queue_wait(start_time)
+        if queue_wait is not None:
+            timing.add(TaskTiming.QUEUE_WAIT, queue_wait)
         is_retrying = self.request.retries > 0
         if is_retrying:
-            self.logger.info("Retry %d", self.request.retries)
+            self.logger.info("Retry %d (%d deferrals)", self.retry_number, self._get_deferrals())
         else:
-            self._time_management[task_id] = start_time
+            self.request.task_start_time = start_time
             self.logger.info("Starting task")
-        with app.app_context():
-            current_status = AlerterStatus.from_db(alert_id, alerter_name)
-            alerter_operation_data = AlerterOperationData.from_db(alert_id, alerter_name, operation_key)
-            new_status = self.before_start_operation(task_id, alerter_operation_data,
-                                                     current_status, kwargs)
-            if is_retrying:
-                alerter_operation_data.retries = self.request.retries
+        with app.app_context(), timing.measure(TaskTiming.BEFORE_START_DB):
+            alerter_state = self._load_alerter_state(alert_id, alerter_name)
+            for _ in range(self._status_transition_attempts):
+                current_status = alerter_state.status
+                alerter_operation_data = alerter_state.get_operation_data(operation_key)
+                new_status = self.before_start_operation(task_id, alerter_operation_data,
+                                                         current_status, kwargs)
+                if is_retrying:
+                    alerter_operation_data.retries = self.retry_number
+                else:
+                    alerter_operation_data.start_time = start_time
+                    if alerter_operation_data.received_time is None:
+                        alerter_operation_data.received_time = alerter_operation_data.start_time
+                expected_status = current_status
+                applied, current_status = alerter_state.transition(new_status, alerter_operation_data,
+                                                                   expected_status)
+                if applied:
+                    break
+                self._log_concurrent_status_change(expected_status, current_status)
+                alerter_state = self._load_alerter_state(alert_id, alerter_name)
             else:
-                alerter_operation_data.start_time = start_time
-                if alerter_operation_data.received_time is None:
-                    alerter_operation_data.received_time = alerter_operation_data.start_time
-            AlerterStatus.store(alert_id, alerter_name, new_status)
-            alerter_operation_data.store()
+                self._log_status_conflict(new_status)
+                self.update_state(state=states.IGNORED)
+                raise Ignore()
+
+    def signature_from_request(self, request=None, args=None, kwargs=None, queue=None, **extra_options):
+        # Retries keep the priority lane and the deferrals count of the task
+        properties = getattr(self.request if request is None else request, 'properties', None) or {}
+        for option in ('lane', 'deferrals'):
+            if properties.get(option):
+                extra_options.setdefault(option, properties[option])
+        # Retries are scheduled using the delayed scheduler
+        return DelayedSignature(super().signature_from_request(request, args, kwargs, queue=queue, **extra_options),
+                                app=self.app)
 
     def on_success(self, retval, task_id, args, kwargs):  # noqa
-        try:
-            alert_id, alerter_name, operation, operation_key = self._get_parameters(kwargs)
-            start_time, end_time, duration = self._get_timing_from_now(task_id)
-            with app.app_context():
-                current_status = AlerterStatus.from_db(alert_id, alerter_name)
-                alerter_operation_data = AlerterOperationData.from_db(alert_id, alerter_name, operation_key)
-                next_status = self.on_success_operation(alerter_operation_data, current_status, kwargs)
-                self._finish_task(alerter_operation_data=alerter_operation_data, status=next_status, retval=retval,
-                                  start_time=start_time, end_time=end_time)
-        finally:
-            self._time_management.pop(task_id, None)
+        alert_id, alerter_name, operation, operation_key = self._get_parameters(kwargs)
+        start_time, end_time, duration = self._get_timing_from_now()
+        with app.app_context():
+            with self.task_timing.measure(TaskTiming.FINISH_DB):
+                alerter_state = self._load_alerter_state(alert_id, alerter_name)
+                for _ in range(self._status_transition_attempts):
+                    current_status = alerter_state.status
+                    alerter_operation_data = alerter_state.get_operation_data(operation_key)
+                    next_status = self.on_success_operation(alerter_operation_data, current_status, kwargs)
+                    expected_status = current_status
+                    applied, current_status = self._finish_task(
+                        alerter_operation_data=alerter_operation_data, status=next_status, retval=retval,
+                        start_time=start_time, end_time=end_time, expected_status=expected_status)
+                    if applied:
+                        break
+                    self._log_concurrent_status_change(expected_status, current_status)
+                    alerter_state = self._load_alerter_state(alert_id, alerter_name)
+                else:
+                    self._log_status_conflict(next_status)
+            self._export_timing(alerter_name, operation_key)
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):  # noqa
-        try:
-            include_traceback = self.request.properties.get('include_traceback', False)
-            retval = False, Alerter.result_for_exception(exc, einfo, include_traceback=include_traceback)
-            alert_id, alerter_name, operation, operation_key = self._get_parameters(kwargs)
-            start_time, end_time, duration = self._get_timing_from_now(task_id)
-            with app.app_context():
-                current_status = AlerterStatus.from_db(alert_id, alerter_name)
-                alerter_operation_data = AlerterOperationData.from_db(alert_id, alerter_name, operation_key)
-                next_status = self.on_failure_operation(task_id=task_id, alerter_operation_data=alerter_operation_data,
-                                                        current_status=current_status, retval=retval, kwargs=kwargs)
-                if next_status:
-                    self._finish_task(alerter_operation_data=alerter_operation_data, status=next_status, retval=retval,
-                                      start_time=start_time, end_time=end_time)
-        finally:
-            self._time_management.pop(task_id, None)
+        include_traceback = self.request.properties.get('include_traceback', False)
+        retval = False, Alerter.result_for_exception(exc, einfo, include_traceback=include_traceback)
+        alert_id, alerter_name, operation, operation_key = self._get_parameters(kwargs)
+        start_time, end_time, duration = self._get_timing_from_now()
+        with app.app_context():
+            with self.task_timing.measure(TaskTiming.FINISH_DB):
+                alerter_state = self._load_alerter_state(alert_id, alerter_name)
+                for _ in range(self._status_transition_attempts):
+                    current_status = alerter_state.status
+                    alerter_operation_data = alerter_state.get_operation_data(operation_key)
+                    next_status = self.on_failure_operation(task_id=task_id,
+                                                            alerter_operation_data=alerter_operation_data,
+                                                            current_status=current_status, retval=retval,
+                                                            kwargs=kwargs)
+                    if not next_status:
+                        break
+                    expected_status = current_status
+                    applied, current_status = self._finish_task(
+                        alerter_operation_data=alerter_operation_data, status=next_status, retval=retval,
+                        start_time=start_time, end_time=end_time, expected_status=expected_status)
+                    if applied:
+                        break
+                    self._log_concurrent_status_change(expected_status, current_status)
+                    alerter_state = self._load_alerter_state(alert_id, alerter_name)
+                else:
+                    self._log_status_conflict(next_status)
+            self._export_timing(alerter_name, operation_key)
 
     def on_retry(self, exc, task_id, args, kwargs, einfo):  # noqa
         alert_id, alerter_name, operation, operation_key = self._get_parameters(kwargs)
         with app.app_context():
-            current_status = AlerterStatus.from_db(alert_id, alerter_name)
-            alerter_operation_data = AlerterOperationData.from_db(alert_id, alerter_name, operation_key)
-            should_retry = self.on_retry_operation(task_id=task_id, alerter_operation_data=alerter_operation_data,
-                                                   current_status=current_status,
-                                                   exc=exc, einfo=einfo, kwargs=kwargs)
+            with self.task_timing.measure(TaskTiming.FINISH_DB):
+                alerter_state = self._load_alerter_state(alert_id, alerter_name)
+                alerter_operation_data = alerter_state.get_operation_data(operation_key)
+                should_retry = self.on_retry_operation(task_id=task_id,
+                                                       alerter_operation_data=alerter_operation_data,
+                                                       current_status=alerter_state.status,
+                                                       exc=exc, einfo=einfo, kwargs=kwargs)
+            self._export_timing(alerter_name, operation_key)
         if should_retry:
-            countdown = self.request.properties.get('retry_spec', {}).get('_countdown_', 0.0)
-            self.logger.info("SCHEDULED RETRY %d/%d IN %.0f secs -> %s",
-                             self.request.retries + 1, self.override_max_retries, countdown, exc)
+            if must_defer(exc, self._get_deferrals()):
+                self.logger.info("RESCHEDULED IN %.0f secs -> %s", exc.retry_after, exc)
+            else:
+                countdown = (self.request.properties.get('retry_spec') or {}).get('_countdown_', 0.0)
+                self.logger.info("SCHEDULED RETRY %d/%d IN %.0f secs -> %s",
+                                 self.retry_number + 1, (self.override_max_retries or 0) - self._get_deferrals(),
+                                 countdown, exc)
         else:
             revoke_task(task_id)
 
+    def run_as_fan_out_member(self, task_id, kwargs, properties, delivery_info, alert: Alert, eta=None):
+        """
+        Executes the task for one alerter as part of a fan-out task, invoking the same handlers celery invokes
+        for a task. The alert already read by the fan-out task is used.
+        Retries are scheduled as independent tasks with the same task id, using the queue in delivery_info.
+
+        :param task_id: task id of the alerter. Used as bg_task_id in alerter data.
+        :param kwargs: task kwargs
+        :param properties: task message properties (include_traceback, retry_spec)
+        :param delivery_info: task delivery info used to schedule retries
+        :param alert:
+        :param eta: eta of the fan-out task
+        """
+        self.push_request(id=task_id, args=[], kwargs=kwargs, retries=0, called_directly=False,
+                          properties=properties, delivery_info=delivery_info, fan_out_alert=alert, eta=eta)
+        try:
+            with app.app_context():
+                try:
+                    self.before_start(task_id, [], kwargs)
+                    retval = self.run(**kwargs)
+                except Ignore:
+                    pass
+                except Retry as exc:
+                    self.on_retry(exc.exc, task_id, [], kwargs, ExceptionInfo())
+                except Exception as exc:  # noqa
+                    self.on_failure(exc, task_id, [], kwargs, ExceptionInfo())
+                else:
+                    self.on_success(retval, task_id, [], kwargs)
+        finally:
+            self.pop_request()
+
     # noinspection PyShadowingNames
-    def run(self, alerter_data: dict, alert_id: str, reason: Optional[str], action: str = None):
+    def run(self, alerter_data: dict, alert_id: str, reason: Optional[str], action: str = None,
+            alert_snapshot: Optional[dict] = None):
         alerter = self._get_alerter(alerter_data, self)
         operation = self.get_operation()
         operation_key = action or ALERTERS_KEY_BY_OPERATION[operation]
         self.logger.info("Running background task")
-        bg_timer = Timer('alerters', f"{alerter.name}_{operation_key}",
-                         f"{alerter.name} {operation_key}",
-                         f"Total time and number of alerter {alerter.name} operation {operation_key}")
+        bg_timer = BufferedTimer('alerters', f"{alerter.name}_{operation_key}",
+                                 f"{alerter.name} {operation_key}",
+                                 f"Total time and number of alerter {alerter.name} operation {operation_key}",
+                                 histogram='alerter_operation_seconds',
+                                 labels={'alerter': alerter.name, 'operation': operation_key,
+                                         'queue': self._get_queue()})
         ts = bg_timer.start_timer()
         do_not_retry = False
+        timing = self.task_timing
         try:
-            alert = Alert.find_by_id(alert_id)
+            with timing.measure(TaskTiming.ALERT_READ):
+                alert = getattr(self.request, 'fan_out_alert', None) \
+                    or AlertSnapshot.get_alert(alert_id, alert_snapshot)
             do_not_retry_tag = ContextualConfiguration.get_global_configuration(GlobalAttributes.DO_NOT_RETRY_TAG)
             do_not_retry = do_not_retry_tag in alert.tags
             parameters = [alert, reason]
             if action:
                 parameters.append(action)
-            response = getattr(alerter, operation)(*parameters)
+            config_render_before = timing.get(TaskTiming.CONFIG_RENDER)
+            call_start = time.perf_counter()
+            try:
+                with alerter.running_in_task(self):
+                    response = getattr(alerter, operation)(*parameters)
+            finally:
+                timing.add(TaskTiming.EXTERNAL_CALL, time.perf_counter() - call_start
+                           - (timing.get(TaskTiming.CONFIG_RENDER) - config_render_before))
             return response
-        except (RetryableException, ConnectionError, RequestsConnectionError, RequestsTimeout) as e:
+        except (RetryableException, RateLimitedException, ConnectionError, RequestsConnectionError,
+                RequestsTimeout) as e:
             retry_data = self.request.properties.get('retry_spec')
-            if not retry_data or do_not_retry:
+            if do_not_retry:
+                raise
+            elif must_defer(e, self._get_deferrals()):
+                # Not a failure: task is rescheduled when the destination will accept the request, counted as a
+                # deferral instead of as a retry of the retry policy
+                options = {'retry_spec': retry_data} if retry_data else {}
+                self.retry(exc=e, max_retries=self.request.retries + 1, countdown=e.retry_after,
+                           deferrals=self._get_deferrals() + 1, **options)
+            elif not retry_data:
                 raise
             else:
-                max_retries, countdown = self.get_retry_parameters(self.request.retries, retry_data)
+                max_retries, countdown = self.get_retry_parameters(self.retry_number, retry_data)
                 if max_retries == 0:
                     raise
                 retry_data['_countdown_'] = countdown
-                self.retry(exc=e, max_retries=max_retries, countdown=countdown, retry_spec=retry_data)
+                # Celery compares max_retries with all the retries of the task, including deferrals
+                self.retry(exc=e, max_retries=max_retries + self._get_deferrals(), countdown=countdown,
+                           retry_spec=retry_data)
         except Exception as e:
             if self.logger.getEffectiveLevel() <= logging.DEBUG:
                 self.logger.exception("Exception in background task")
@@ -280,3 +485,7 @@ celery.register_task(repeat_task)
 from .action import Task as ActionTask  # noqa
 action_task = ActionTask()
 celery.register_task(action_task)
+
+from .fan_out import Task as FanOutTask  # noqa
+fan_out_task = FanOutTask()
+celery.register_task(fan_out_task)
@@ -1,4 +1,4 @@
-from . import Alert, Alerter, AlerterStatus, AlertTask, AlerterOperationData
+from . import Alerter, AlerterStatus, AlertTask, AlerterOperationData, AlertSnapshot
 
 # noinspection PyPackageRequirements
 from celery import signature, states
@@ -10,40 +10,36 @@ class Task(AlertTask):
 
     def _ignore_recovery_while_processing(self, task_id, alerter_operation_data: AlerterOperationData,
                                           event_retval, recovery_message):
-        start_time, end_time, duration = self._get_timing_from_now(task_id=task_id)
-        alert_id = alerter_operation_data.alert_id
-        alerter_name = alerter_operation_data.alerter
+        start_time, end_time, duration = self._get_timing_from_now()
         self._finish_task(alerter_operation_data=alerter_operation_data, status=AlerterStatus.Recovered,
                           retval=event_retval, start_time=start_time, end_time=end_time)
         recovery_retval = True, {"info": {"message": recovery_message}}
-        alerter_operation_data_recovery = AlerterOperationData.from_db(alert_id, alerter_name,
-                                                                       self.get_recovery_task().get_operation_key())
+        alerter_operation_data_recovery = self.alerter_state.get_operation_data(
+            self.get_recovery_task().get_operation_key())
         alerter_operation_data_recovery = Alerter.prepare_result(alerter_operation_data=alerter_operation_data_recovery,
                                                                  retval=recovery_retval,
                                                                  start_time=None,
                                                                  end_time=None,
                                                                  skipped=True)
-        alerter_operation_data_recovery.store()
+        self.alerter_state.store_operation_data(alerter_operation_data_recovery)
 
     def _ignore_action_while_processing(self, task_id, alerter_operation_data: AlerterOperationData,
                                         event_retval, recovery_message):
-        start_time, end_time, duration = self._get_timing_from_now(task_id=task_id)
-        alert_id = alerter_operation_data.alert_id
-        alerter_name = alerter_operation_data.alerter
+        start_time, end_time, duration = self._get_timing_from_now()
+        # Finishing the task clears the task chain info
+        task_data = alerter_operation_data.task_chain_info
         self._finish_task(alerter_operation_data=alerter_operation_data, status=AlerterStatus.Processed,
                           retval=event_retval, start_time=start_time, end_time=end_time)
-        task_data = alerter_operation_data.task_chain_info
         if not task_data:
             self.logger.warning("Action task data not found!")
         else:
             action = task_data.get(AlerterOperationData.FIELD_TASK_CHAIN_INFO_ACTION, '')
             recovery_retval = True, {"info": {"message": recovery_message}}
-            alerter_operation_data_action = AlerterOperationData.from_db(
-                alert_id, alerter_name, action)
+            alerter_operation_data_action = self.alerter_state.get_operation_data(action)
             alerter_operation_data_action = Alerter.prepare_result(
                 alerter_operation_data=alerter_operation_data_action, retval=recovery_retval,
                 start_time=None, end_time=None, skipped=True)
-            alerter_operation_data_action.store()
+            self.alerter_state.store_operation_data(alerter_operation_data_action)
 
     @staticmethod
     def get_operation():
@@ -63,7 +59,6 @@ class Task(AlertTask):
                 or current_status not in (AlerterStatus.New, AlerterStatus.Scheduled, AlerterStatus.Processing):
             self.logger.warning("Ignoring task -> Current status is not valid for this task: %s",
                                 current_status.value)
-            self._time_management.pop(task_id, None)
             self.update_state(state=states.IGNORED)
             raise Ignore()
         return AlerterStatus.Processing
@@ -75,20 +70,19 @@ class Task(AlertTask):
             if not task_data:
                 self.logger.warning("Recovering task data not found!")
             else:
-                alert = Alert.find_by_id(alerter_operation_data.alert_id)
+                alert = AlertSnapshot.get_alert(alerter_operation_data.alert_id, kwargs.get('alert_snapshot'))
                 alerter_operation_data.task_chain_info = None
                 reason = task_data.get(AlerterOperationData.FIELD_TASK_CHAIN_INFO_TEXT, alert.text)
                 task_def = task_data.get(AlerterOperationData.FIELD_TASK_CHAIN_INFO_TASK_DEF, {})
                 kwargs['alert_id'] = alert.id
+                kwargs['alert_snapshot'] = AlertSnapshot.for_task(alert)
                 kwargs['reason'] = reason
                 recovery_task = self.get_recovery_task()
                 task = signature(recovery_task, args=[], kwargs=kwargs).apply_async(countdown=2.0, **task_def)
-                alerter_operation_data_recovery = AlerterOperationData.from_db(
-                    alert_id=alerter_operation_data.alert_id,
-                    alerter=alerter_operation_data.alerter,
-                    operation=recovery_task.get_operation_key())
+                alerter_operation_data_recovery = self.alerter_state.get_operation_data(
+                    recovery_task.get_operation_key())
                 alerter_operation_data_recovery.bg_task_id = task.id
-                alerter_operation_data_recovery.store()
+                self.alerter_state.store_operation_data(alerter_operation_data_recovery)
             return current_status
         elif current_status == AlerterStatus.Actioning:
             self.logger.info("Alert action during processing. Sending action from processing task")
@@ -96,22 +90,20 @@ class Task(AlertTask):
             if not task_data:
                 self.logger.warning("Action task data not found!")
             else:
-                alert = Alert.find_by_id(alerter_operation_data.alert_id)
+                alert = AlertSnapshot.get_alert(alerter_operation_data.alert_id, kwargs.get('alert_snapshot'))
                 alerter_operation_data.task_chain_info = None
                 reason = task_data.get(AlerterOperationData.FIELD_TASK_CHAIN_INFO_TEXT, alert.text)
                 task_def = task_data.get(AlerterOperationData.FIELD_TASK_CHAIN_INFO_TASK_DEF, {})
                 action = task_data.get(AlerterOperationData.FIELD_TASK_CHAIN_INFO_ACTION, '')
                 kwargs['alert_id'] = alert.id
+                kwargs['alert_snapshot'] = AlertSnapshot.for_task(alert)
                 kwargs['reason'] = reason
                 kwargs['action'] = action
                 action_task = self.get_action_task()
                 task = signature(action_task, args=[], kwargs=kwargs).apply_async(countdown=2.0, **task_def)
-                alerter_operation_data_action = AlerterOperationData.from_db(
-                    alert_id=alerter_operation_data.alert_id,
-                    alerter=alerter_operation_data.alerter,
-                    operation=action)
+                alerter_operation_data_action = self.alerter_state.get_operation_data(action)
                 alerter_operation_data_action.bg_task_id = task.id
-                alerter_operation_data_action.store()
+                self.alerter_state.store_operation_data(alerter_operation_data_action)
             return current_status
         return AlerterStatus.Processed
 
@@ -0,0 +1,47 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from datadope_alerta import BGTaskAlerterDataConstants as BGTadC, thread_local, \
+    CONFIG_ALERTERS_TASK_FAN_OUT_THREADS, DEFAULT_ALERTERS_TASK_FAN_OUT_THREADS
+from . import app, celery, getLogger, AlertSnapshot
+from ..delayed import DelayedScheduler
+
+
+class Task(celery.Task):
+    """
+    Executes the same operation of several alerters for one alert. The alert is read only once and each
+    alerter is executed with the handlers of its alerter task, so status and retries are managed by alerter.
+    """
+    ignore_result = True
+
+    def __init__(self):
+        super().__init__()
+        self.logger = getLogger(self.__module__)
+
+    def _run_member(self, alert_task, alert, member):
+        try:
+            alert_task.run_as_fan_out_member(task_id=member['task_id'], kwargs=member['kwargs'],
+                                             properties=member['properties'],
+                                             delivery_info=member['delivery_info'],
+                                             alert=copy.deepcopy(alert),
+                                             eta=self.request.eta or DelayedScheduler.get_due_time(self.request))
+        except Exception as e:
+            self.logger.error("Error executing alerter '%s' in fan-out task: %s",
+                              member['kwargs']['alerter_data'][BGTadC.NAME], e, exc_info=e)
+
+    def run(self, task_name: str, alert_id: str, members: list, alert_snapshot: Optional[dict] = None):
+        thread_local.alert_id = alert_id
+        alert_task = self.app.tasks[task_name]
+        alert = AlertSnapshot.get_alert(alert_id, alert_snapshot)
+        self.logger.info("Running fan-out task for alerters: %s",
+                         ', '.join(x['kwargs']['alerter_data'][BGTadC.NAME] for x in members))
+        threads = min(len(members), int(app.config.get(CONFIG_ALERTERS_TASK_FAN_OUT_THREADS,
+                                                       DEFAULT_ALERTERS_TASK_FAN_OUT_THREADS)))
+        if threads > 1:
+            with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='fan-out') as executor:
+                for future in [executor.submit(self._run_member, alert_task, alert, x) for x in members]:
+                    future.result()
+        else:
+            for member in members:
+                self._run_member(alert_task, alert, member)
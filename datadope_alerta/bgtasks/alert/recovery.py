@@ -20,7 +20,6 @@ class Task(AlertTask):
     def before_start_operation(self, task_id, alerter_operation_data, current_status, kwargs):
         if current_status != AlerterStatus.Recovering:
             self.logger.warning("Ignoring task -> Current status is not valid for this task: %s", current_status.value)
-            self._time_management.pop(task_id, None)
             self.update_state(state=states.IGNORED)
             raise Ignore()
         return AlerterStatus.Recovering
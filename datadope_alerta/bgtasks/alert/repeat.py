@@ -1,4 +1,4 @@
-from . import Alert, Alerter, AlerterStatus, AlertTask, AlerterOperationData
+from . import Alerter, AlerterStatus, AlertTask, AlerterOperationData, AlertSnapshot
 
 # noinspection PyPackageRequirements
 from celery import states, signature
@@ -17,14 +17,13 @@ class Task(AlertTask):
             reason = task_data.get(AlerterOperationData.FIELD_TASK_CHAIN_INFO_TEXT, "")
             task_def = task_data.get(AlerterOperationData.FIELD_TASK_CHAIN_INFO_TASK_DEF, {})
             kwargs['alert_id'] = alert.id
+            kwargs['alert_snapshot'] = AlertSnapshot.for_task(alert)
             kwargs['reason'] = reason
             recovery_task = self.get_recovery_task()
             task = signature(recovery_task, args=[], kwargs=kwargs).apply_async(countdown=2.0, **task_def)
-            alerter_operation_data_recovery = AlerterOperationData.from_db(alerter_operation_data.alert_id,
-                                                                           alerter_operation_data.alerter,
-                                                                           recovery_task.get_operation_key())
+            alerter_operation_data_recovery = self.alerter_state.get_operation_data(recovery_task.get_operation_key())
             alerter_operation_data_recovery.bg_task_id = task.id
-            alerter_operation_data_recovery.store()
+            self.alerter_state.store_operation_data(alerter_operation_data_recovery)
 
     @staticmethod
     def get_operation():
@@ -34,9 +33,8 @@ class Task(AlertTask):
         is_retrying = self.request.retries > 0
         if current_status == AlerterStatus.Recovering:
             self.logger.info("Ignoring repeat task -> Alert recovered before repeating. Recovering")
-            alert = Alert.find_by_id(alerter_operation_data.alert_id)
-            self._time_management.pop(task_id, None)
-            start_time, end_time, duration = self._get_timing_from_now(task_id=task_id)
+            alert = AlertSnapshot.get_alert(alerter_operation_data.alert_id, kwargs.get('alert_snapshot'))
+            start_time, end_time, duration = self._get_timing_from_now()
             event_retval = not is_retrying, {"info": {"message": "RECOVERED BEFORE ALERTING"}}
             self._schedule_recovery_task(alert, alerter_operation_data, kwargs)
             self._finish_task(alerter_operation_data=alerter_operation_data, status=current_status,
@@ -46,14 +44,13 @@ class Task(AlertTask):
         elif current_status not in (AlerterStatus.Repeating, AlerterStatus.Actioning):
             self.logger.warning("Ignoring repeat task -> Current status is not valid for this task: %s",
                                 current_status.value)
-            self._time_management.pop(task_id, None)
             self.update_state(state=states.IGNORED)
             raise Ignore()
         return AlerterStatus.Repeating
 
     def on_success_operation(self, alerter_operation_data: AlerterOperationData, current_status, kwargs):
         if current_status == AlerterStatus.Recovering:
-            alert = Alert.find_by_id(alerter_operation_data.alert_id)
+            alert = AlertSnapshot.get_alert(alerter_operation_data.alert_id, kwargs.get('alert_snapshot'))
             self.logger.info("Alert recovered during repeating. Sending recovery from repeat task")
             self._schedule_recovery_task(alert, alerter_operation_data, kwargs)
             return AlerterStatus.Recovering
@@ -63,7 +60,7 @@ class Task(AlertTask):
                              current_status, retval, kwargs):
         if current_status == AlerterStatus.Recovering:
             # Recovered while processing. Ignoring recovery
-            alert = Alert.find_by_id(alerter_operation_data.alert_id)
+            alert = AlertSnapshot.get_alert(alerter_operation_data.alert_id, kwargs.get('alert_snapshot'))
             self.logger.info("Alert recovered and repeating failed. Sending recovery from repeat")
             self._schedule_recovery_task(alert, alerter_operation_data, kwargs)
             return AlerterStatus.Recovering
@@ -71,13 +68,12 @@ class Task(AlertTask):
 
     def on_retry_operation(self, task_id, alerter_operation_data, current_status, exc, einfo, kwargs):
         if current_status == AlerterStatus.Recovering:
-            alert = Alert.find_by_id(alerter_operation_data.alert_id)
+            alert = AlertSnapshot.get_alert(alerter_operation_data.alert_id, kwargs.get('alert_snapshot'))
             self.logger.info("Alert recovered before launching a repeat retry. "
                              "Cancelling retry and sending recovery")
             include_traceback = self.request.properties.get('include_traceback', False)
             retval = False, Alerter.result_for_exception(exc, einfo, include_traceback=include_traceback)
-            start_time, end_time, duration = self._get_timing_from_now(task_id)
-            self._time_management.pop(task_id, None)
+            start_time, end_time, duration = self._get_timing_from_now()
             self._schedule_recovery_task(alert, alerter_operation_data, kwargs)
             self._finish_task(alerter_operation_data=alerter_operation_data, status=AlerterStatus.Recovering,
                               retval=retval, start_time=start_time, end_time=end_time)
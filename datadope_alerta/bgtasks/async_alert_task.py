@@ -11,6 +11,7 @@ from alerta.utils.api import process_alert
 from datadope_alerta import thread_local
 from datadope_alerta.plugins import getLogger
 from datadope_alerta.bgtasks import celery
+from datadope_alerta.bgtasks.admission import AdmissionControl
 
 
 logger = getLogger(__name__)
@@ -23,6 +24,7 @@ def jsonify(**kwargs):
 def async_receive(self, alert_dict: dict, user: str, customers: Optional[list], scopes,
                   request_environ: dict):
     logger.debug("Creating new alert asynchronously")
+    AdmissionControl.record_consumed()
     alert = Alert.parse(alert_dict)
     g.login = user
     g.customers = customers
@@ -0,0 +1,64 @@
+# noinspection PyPackageRequirements
+from celery import states
+# noinspection PyPackageRequirements
+from celery.exceptions import Ignore
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+from datadope_alerta import get_config, get_redis_client, \
+    CONFIG_CANCELLED_TASKS_TTL, DEFAULT_CANCELLED_TASKS_TTL
+from . import app, celery, getLogger
+
+logger = getLogger(__name__)
+
+
+class CancellationRegistry:
+    """
+    Registry in redis of the background tasks cancelled before being executed.
+
+    Each cancelled task id is stored in its own key with a TTL (CANCELLED_TASKS_TTL), so cancelling and checking
+    a task are O(1) operations. Tasks check the registry before starting and are ignored if they are cancelled,
+    including their retries, as they keep the same task id.
+    """
+    KEY_PREFIX = 'alerta:cancelled:'
+
+    @classmethod
+    def cancel(cls, task_id) -> bool:
+        """
+        Registers the task as cancelled.
+
+        :return: False if the task cannot be registered
+        """
+        try:
+            get_redis_client(config=app.config).set(
+                cls.KEY_PREFIX + task_id, 1,
+                ex=get_config(CONFIG_CANCELLED_TASKS_TTL, DEFAULT_CANCELLED_TASKS_TTL, type=int, config=app.config))
+            return True
+        except RedisError as e:
+            logger.warning("Error registering cancelled task '%s': %s", task_id, e)
+            return False
+
+    @classmethod
+    def is_cancelled(cls, task_id) -> bool:
+        if not task_id:
+            return False
+        try:
+            return bool(get_redis_client(config=app.config).exists(cls.KEY_PREFIX + task_id))
+        except RedisError as e:
+            logger.warning("Error checking if task '%s' is cancelled. Considered not cancelled: %s", task_id, e)
+            return False
+
+
+class CancellableTask(celery.Task):
+    """
+    Base class of the tasks that may be cancelled using `revoke_task`.
+    """
+
+    def ignore_if_cancelled(self, task_id):
+        if CancellationRegistry.is_cancelled(task_id):
+            logger.info("Ignoring task -> Task cancelled")
+            self.update_state(state=states.IGNORED)
+            raise Ignore()
+
+    def before_start(self, task_id, args, kwargs):
+        self.ignore_if_cancelled(task_id)
@@ -0,0 +1,267 @@
+import json
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+# noinspection PyPackageRequirements
+from celery import uuid
+# noinspection PyPackageRequirements
+from celery.canvas import Signature
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+from datadope_alerta import get_config, get_redis_client, thread_local, \
+    CONFIG_DELAYED_SCHEDULER, DEFAULT_DELAYED_SCHEDULER, \
+    CONFIG_DELAYED_SCHEDULER_MIN_DELAY, DEFAULT_DELAYED_SCHEDULER_MIN_DELAY, \
+    CONFIG_DELAYED_SCHEDULER_BATCH_SIZE, DEFAULT_DELAYED_SCHEDULER_BATCH_SIZE
+from . import app, celery, getLogger
+
+logger = getLogger(__name__)
+
+
+class DelayedScheduler:
+    """
+    Stores delayed tasks in redis until they are due, instead of sending them to the broker with an eta.
+
+    Tasks sent with an eta are reserved by the workers until they are due, consuming worker memory and,
+    with redis broker, being redelivered if they are not acknowledged before the visibility timeout.
+    The scheduler keeps the due time of each task in a sorted set and its message in a hash. A periodic task
+    (`move_delayed_tasks`) takes the due tasks and sends them to their queues to be executed immediately.
+
+    Tasks are sent directly to the broker if the scheduler is not enabled, if their delay is lower than
+    DELAYED_SCHEDULER_MIN_DELAY or if redis cannot be accessed.
+    """
+    DUE_KEY = 'alerta:delayed:due'
+    PAYLOADS_KEY = 'alerta:delayed:payloads'
+    PROCESSING_KEY = 'alerta:delayed:processing'
+    LEASE_TIME = 60
+    """
+    Seconds a mover has to send the tasks taken. Tasks not acknowledged in that time (i.e. the mover died)
+    are taken again by other mover.
+    """
+    DUE_PROPERTY = 'delayed_due'
+    """
+    Message property with the time the task was due (ISO format). Used to measure the queue wait of the task.
+    """
+
+    # Takes atomically the due tasks and the tasks with an expired lease, so several movers may be running at the
+    # same time. Tasks taken are kept in the processing set with the deadline of the lease until they are sent.
+    # Returns the id and the payload of each task taken.
+    CLAIM_SCRIPT = """
+local now = ARGV[1]
+local limit = tonumber(ARGV[2])
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, limit)
+if #ids < limit then
+    local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, limit - #ids)
+    if #due > 0 then
+        redis.call('ZREM', KEYS[1], unpack(due))
+        for _, id in ipairs(due) do
+            ids[#ids + 1] = id
+        end
+    end
+end
+if #ids == 0 then
+    return {}
+end
+local lease = {}
+for _, id in ipairs(ids) do
+    lease[#lease + 1] = ARGV[3]
+    lease[#lease + 1] = id
+end
+redis.call('ZADD', KEYS[2], unpack(lease))
+local payloads = redis.call('HMGET', KEYS[3], unpack(ids))
+local result = {}
+for i, id in ipairs(ids) do
+    result[i] = {id, payloads[i]}
+end
+return result
+"""
+
+    # Removes a task taken once it has been sent. The payload is only removed if the task has not been scheduled
+    # again (i.e. a retry of the task) since it was taken.
+    ACK_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+"""
+
+    # Stores again a task taken that could not be sent, unless it has been cancelled or scheduled again
+    RESTORE_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+if redis.call('HGET', KEYS[2], ARGV[1]) == ARGV[2] then
+    redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+end
+"""
+
+    _claim_script = None
+    _ack_script = None
+    _restore_script = None
+
+    @staticmethod
+    def is_enabled(config=None) -> bool:
+        return get_config(CONFIG_DELAYED_SCHEDULER, DEFAULT_DELAYED_SCHEDULER, type=bool,
+                          config=config or app.config)
+
+    @staticmethod
+    def _get_due(countdown=None, eta: Optional[datetime] = None) -> Optional[float]:
+        if eta is not None:
+            if eta.tzinfo is None:
+                eta = eta.replace(tzinfo=timezone.utc)
+            return eta.timestamp()
+        if countdown is not None:
+            return time.time() + countdown
+        return None
+
+    @classmethod
+    def apply_async(cls, task, args=None, kwargs=None, **options):
+        """
+        Schedules the execution of a task. Same parameters as celery `Task.apply_async`.
+
+        :return: AsyncResult of the task
+        """
+        due = cls._get_due(options.get('countdown'), options.get('eta'))
+        if due is None or not cls.is_enabled() \
+                or due - time.time() < get_config(CONFIG_DELAYED_SCHEDULER_MIN_DELAY,
+                                                  DEFAULT_DELAYED_SCHEDULER_MIN_DELAY, type=float, config=app.config):
+            return task.apply_async(args, kwargs, **options)
+        task_id = options.get('task_id') or uuid()
+        message_options = {x: y for x, y in dict(task._get_exec_options(), **options).items()
+                           if y is not None and x not in ('countdown', 'eta')}
+        message_options['task_id'] = task_id
+        payload = json.dumps({'task': task.name, 'args': list(args or ()), 'kwargs': kwargs or {},
+                              'options': message_options, 'due': due}, default=str)
+        try:
+            pipeline = get_redis_client(config=app.config).pipeline()
+            pipeline.hset(cls.PAYLOADS_KEY, task_id, payload)
+            pipeline.zadd(cls.DUE_KEY, {task_id: due})
+            pipeline.zrem(cls.PROCESSING_KEY, task_id)
+            pipeline.execute()
+        except RedisError as e:
+            logger.warning("Error storing delayed task in redis. Sending it to the broker: %s", e)
+            return task.apply_async(args, kwargs, **options)
+        return task.AsyncResult(task_id)
+
+    @classmethod
+    def cancel(cls, task_id) -> bool:
+        """
+        Removes a task pending to be due.
+
+        :return: True if the task was pending
+        """
+        try:
+            pipeline = get_redis_client(config=app.config).pipeline()
+            pipeline.zrem(cls.DUE_KEY, task_id)
+            pipeline.zrem(cls.PROCESSING_KEY, task_id)
+            pipeline.hdel(cls.PAYLOADS_KEY, task_id)
+            removed, removed_taken, _ = pipeline.execute()
+            return bool(removed or removed_taken)
+        except RedisError as e:
+            logger.warning("Error removing delayed task from redis: %s", e)
+            return False
+
+    @classmethod
+    def _register_scripts(cls, client):
+        if cls._claim_script is None:
+            cls._claim_script = client.register_script(cls.CLAIM_SCRIPT)
+            cls._ack_script = client.register_script(cls.ACK_SCRIPT)
+            cls._restore_script = client.register_script(cls.RESTORE_SCRIPT)
+
+    @classmethod
+    def _claim_due(cls, client, now: float, limit: int) -> list:
+        cls._register_scripts(client)
+        return cls._claim_script(keys=[cls.DUE_KEY, cls.PROCESSING_KEY, cls.PAYLOADS_KEY],
+                                 args=[now, limit, now + cls.LEASE_TIME], client=client)
+
+    @classmethod
+    def _ack(cls, client, task_id, raw_payload):
+        cls._ack_script(keys=[cls.PROCESSING_KEY, cls.PAYLOADS_KEY], args=[task_id, raw_payload or ''],
+                        client=client)
+
+    @classmethod
+    def _restore(cls, client, task_id, raw_payload, due: float):
+        cls._restore_script(keys=[cls.PROCESSING_KEY, cls.PAYLOADS_KEY, cls.DUE_KEY],
+                            args=[task_id, raw_payload, due], client=client)
+
+    @classmethod
+    def move_due(cls, batch_size: int) -> int:
+        """
+        Sends the due tasks to their queues.
+
+        Tasks taken are kept in redis with a lease of LEASE_TIME seconds until they are sent, so tasks taken by a
+        mover that dies before sending them are sent by other mover when the lease expires (a task may be sent
+        twice, but it is never lost). If a task cannot be sent, it is stored again to be retried in the next
+        execution.
+
+        :return: number of tasks sent
+        """
+        client = get_redis_client(config=app.config)
+        moved = 0
+        while True:
+            claimed = cls._claim_due(client, time.time(), batch_size)
+            failed = False
+            for task_id, raw_payload in claimed:
+                if not raw_payload:
+                    # Cancelled
+                    cls._ack(client, task_id, raw_payload)
+                    continue
+                payload = json.loads(raw_payload)
+                options = dict(payload['options'])
+                options[cls.DUE_PROPERTY] = datetime.fromtimestamp(payload['due'], tz=timezone.utc).isoformat()
+                try:
+                    celery.send_task(payload['task'], args=payload['args'], kwargs=payload['kwargs'], **options)
+                except Exception as e:
+                    logger.warning("Error sending delayed task '%s'. Retrying later: %s", task_id, e)
+                    cls._restore(client, task_id, raw_payload, payload['due'])
+                    failed = True
+                    continue
+                moved += 1
+                cls._ack(client, task_id, raw_payload)
+            if failed or len(claimed) < batch_size:
+                break
+        return moved
+
+    @staticmethod
+    def get_due_time(request) -> Optional[datetime]:
+        """
+        Returns the time a task moved by the scheduler was due, if the task was moved by the scheduler.
+        """
+        due = (getattr(request, 'properties', None) or {}).get(DelayedScheduler.DUE_PROPERTY)
+        if not due:
+            return None
+        try:
+            return datetime.fromisoformat(due)
+        except (TypeError, ValueError):
+            return None
+
+
+class DelayedSignature(Signature):
+    """
+    Signature sent using the delayed scheduler. Used by tasks to schedule their retries.
+    """
+
+    def apply_async(self, args=None, kwargs=None, route_name=None, **options):
+        options = {x: y for x, y in options.items() if y is not None}
+        if args or kwargs or options:
+            args, kwargs, options = self._merge(args, kwargs, options)
+        else:
+            args, kwargs, options = self.args, self.kwargs, self.options
+        return DelayedScheduler.apply_async(self.type, args, kwargs, **options)
+
+
+@celery.task(ignore_result=True, queue=app.config.get('DELAYED_SCHEDULER_TASK_QUEUE'))
+def move_delayed_tasks():
+    thread_local.alert_id = None
+    thread_local.alerter_name = 'system'
+    thread_local.operation = 'delayed_scheduler'
+    try:
+        moved = DelayedScheduler.move_due(get_config(CONFIG_DELAYED_SCHEDULER_BATCH_SIZE,
+                                                     DEFAULT_DELAYED_SCHEDULER_BATCH_SIZE, type=int,
+                                                     config=app.config))
+        if moved:
+            logger.debug("Moved %d due tasks to their queues", moved)
+    except Exception as e:
+        logger.warning("Error moving delayed tasks: %s", e)
+    finally:
+        thread_local.alerter_name = None
+        thread_local.operation = None
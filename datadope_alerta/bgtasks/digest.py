@@ -0,0 +1,76 @@
+from typing import Optional, List
+
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+
+from datadope_alerta import thread_local
+from datadope_alerta.plugins import AlerterRegistry, AlerterStatus, RetryableException, RateLimitedException, \
+    TaskTiming
+from datadope_alerta.plugins.rate_limiter import must_defer
+from . import celery, db, getLogger
+
+logger = getLogger(__name__)
+
+DIGEST_RETRY_INTERVAL = 30.0
+
+
+@celery.task(bind=True, ignore_result=True, max_retries=5)
+def flush_digest(self, alerter_class: str, alerter_name: str, destination: str, destination_data: dict,
+                 digest_id: Optional[str] = None, alerts: Optional[List[dict]] = None, deferrals: int = 0):
+    """
+    Sends the digest of the alerts buffered for a destination by an alerter.
+
+    Alerts are taken from the buffer in the first execution, discarding the alerts recovered since they were
+    buffered. Retries receive them as parameters, with the number of reschedules due to rate limits (deferrals),
+    which are not counted as retries until ALERTERS_MAX_DEFERRALS is reached.
+
+    Destination and destination data don't include credentials. The alerter resolves them from its configuration.
+    """
+    thread_local.alert_id = None
+    thread_local.alerter_name = alerter_name
+    thread_local.operation = 'digest'
+    TaskTiming.set_current(None)
+    alerter = AlerterRegistry.get_alerter(alerter_class, alerter_name, bgtask=self)
+    if alerts is None:
+        digest_id, alerts = alerter.digest_buffer.take(alerter_name, destination)
+        alerts = _discard_recovered(alerter_name, alerts)
+        if not alerts:
+            logger.info("Digest '%s' is empty", digest_id)
+            return
+    logger.info("Sending digest '%s' with %d alerts", digest_id, len(alerts))
+    retry_kwargs = dict(digest_id=digest_id, alerts=alerts)
+    try:
+        with alerter.running_in_task(self):
+            alerter.send_digest(digest_id, alerts, destination_data)
+    except (RetryableException, RateLimitedException, ConnectionError, RequestsConnectionError,
+            RequestsTimeout) as e:
+        if must_defer(e, deferrals):
+            self.retry(exc=e, countdown=e.retry_after, max_retries=self.request.retries + 1,
+                       kwargs=dict(retry_kwargs, deferrals=deferrals + 1))
+        logger.warning("Error sending digest '%s': %s", digest_id, e)
+        self.retry(exc=e, countdown=DIGEST_RETRY_INTERVAL, max_retries=self.max_retries + deferrals,
+                   kwargs=dict(retry_kwargs, deferrals=deferrals))
+    finally:
+        thread_local.alerter_name = None
+        thread_local.operation = None
+
+
+def _discard_recovered(alerter_name: str, alerts: List[dict]) -> List[dict]:
+    """
+    Removes the alerts recovered by the alerter (or deleted) since they were buffered.
+    """
+    if not alerts:
+        return alerts
+    try:
+        summary = db.backend_alerters.get_alerters_summary([x['id'] for x in alerts], alerters=[alerter_name])
+    except Exception as e:
+        logger.warning("Error reading status of alerts in digest. All of them are sent: %s", e)
+        return alerts
+    recovered = (AlerterStatus.Recovering.value, AlerterStatus.Recovered.value)
+    result = []
+    for alert in alerts:
+        status = summary.get(alert['id'], {}).get(alerter_name, {}).get('status')
+        if status is None or status in recovered:
+            logger.info("Alert '%s' recovered before sending the digest. Discarded", alert['id'])
+        else:
+            result.append(alert)
+    return result
@@ -2,7 +2,11 @@ from datetime import timedelta
 
 from datadope_alerta import CONFIG_AUTO_CLOSE_TASK_INTERVAL, \
     NormalizedDictView, DEFAULT_AUTO_CLOSE_TASK_INTERVAL, ContextualConfiguration, thread_local, \
-    CONFIG_AUTO_RESOLVE_TASK_INTERVAL, DEFAULT_AUTO_RESOLVE_TASK_INTERVAL, render_value
+    CONFIG_AUTO_RESOLVE_TASK_INTERVAL, DEFAULT_AUTO_RESOLVE_TASK_INTERVAL, render_value, get_config, \
+    CONFIG_ALERTER_DATA_RETENTION, DEFAULT_ALERTER_DATA_RETENTION, CONFIG_ALERTER_DATA_RETENTION_TASK_INTERVAL, \
+    DEFAULT_ALERTER_DATA_RETENTION_TASK_INTERVAL, CONFIG_ALERTER_DATA_RETENTION_CHUNK_SIZE, \
+    DEFAULT_ALERTER_DATA_RETENTION_CHUNK_SIZE, CONFIG_DELAYED_SCHEDULER, DEFAULT_DELAYED_SCHEDULER, \
+    CONFIG_DELAYED_SCHEDULER_INTERVAL, DEFAULT_DELAYED_SCHEDULER_INTERVAL
 
 from . import app, celery, db, getLogger, Alert, Status, AlertaClient
 
@@ -22,6 +26,22 @@ def setup_periodic_tasks(sender, **kwargs):
     sender.add_periodic_task(timedelta(seconds=interval),
                              check_automatic_resolving.s(),
                              name='auto_resolve')
+    # Schedule alerter data compaction task only if retention is configured
+    if config.get(CONFIG_ALERTER_DATA_RETENTION):
+        interval = config.get(CONFIG_ALERTER_DATA_RETENTION_TASK_INTERVAL,
+                              DEFAULT_ALERTER_DATA_RETENTION_TASK_INTERVAL)
+        sender.add_periodic_task(timedelta(seconds=interval),
+                                 compact_alerters_data.s(),
+                                 name='alerter_data_retention')
+    # Schedule the mover of due tasks only if the delayed scheduler is enabled
+    if config.get(CONFIG_DELAYED_SCHEDULER, DEFAULT_DELAYED_SCHEDULER):
+        from .delayed import move_delayed_tasks
+        interval = config.get(CONFIG_DELAYED_SCHEDULER_INTERVAL, DEFAULT_DELAYED_SCHEDULER_INTERVAL)
+        # Executions not started in time are discarded. Next executions will move the due tasks
+        sender.add_periodic_task(timedelta(seconds=interval),
+                                 move_delayed_tasks.s(),
+                                 name='delayed_scheduler',
+                                 expires=interval * 5)
     from alerta.app import plugins
     for plugin in plugins.plugins.values():
         if getattr(plugin, 'register_periodic_tasks', None):
@@ -86,6 +106,39 @@ def check_automatic_resolving(self):
         thread_local.alerter_name = None
         thread_local.operation = None
 
+
+@celery.task(ignore_result=True, queue=app.config.get('ALERTER_DATA_RETENTION_TASK_QUEUE'))
+def compact_alerters_data():
+    thread_local.alert_id = None
+    thread_local.alerter_name = 'system'
+    thread_local.operation = 'alerter_data_retention'
+    logger.debug('Alerter data compaction task launched')
+    try:
+        retention = dict(get_config(CONFIG_ALERTER_DATA_RETENTION, DEFAULT_ALERTER_DATA_RETENTION, type=dict))
+        default_retention = retention.pop('*', None)
+        chunk_size = get_config(CONFIG_ALERTER_DATA_RETENTION_CHUNK_SIZE, DEFAULT_ALERTER_DATA_RETENTION_CHUNK_SIZE,
+                                type=int)
+        total_groups = total_deleted = 0
+        while True:
+            # Each chunk is compacted in its own transaction
+            groups, deleted = db.backend_alerters.compact_alerters_data(retention, default_retention,
+                                                                        limit=chunk_size)
+            total_groups += groups
+            total_deleted += deleted
+            if groups < chunk_size:
+                break
+        if total_deleted:
+            logger.info("Compacted %d alerter data records checking %d alert operations", total_deleted, total_groups)
+        pruned = db.backend_alerters.prune_tracebacks()
+        if pruned:
+            logger.info("Removed %d unreferenced tracebacks", pruned)
+    except Exception as e:
+        logger.warning("Error compacting alerter data: %s", e)
+    finally:
+        thread_local.alerter_name = None
+        thread_local.operation = None
+
+
 def _action_on_alerts(alerts_ids, action, text):
     from flask import current_app, g
     from alerta.utils.api import process_action
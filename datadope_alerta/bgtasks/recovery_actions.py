@@ -2,7 +2,7 @@ import random
 from datetime import datetime, timedelta
 from importlib import import_module
 from math import floor
-from typing import Union, Dict
+from typing import Union, Dict, Optional
 
 # noinspection PyPackageRequirements
 from celery import signature
@@ -13,10 +13,14 @@ from alerta.models.enums import Status
 
 from datadope_alerta import DateTime, RecoveryActionsFields, thread_local
 from datadope_alerta import GlobalAttributes
+from datadope_alerta.backend.flexiblededup.models.alert_snapshot import AlertSnapshot
 from datadope_alerta.backend.flexiblededup.models.recovery_actions import RecoveryActionData, RecoveryActionsStatus
 from datadope_alerta.plugins import Alerter, RetryableException
+from datadope_alerta.plugins.iom_plugin import AlerterTasksDispatch
 from . import app, celery, getLogger, Alert
 from . import revoke_task  # noqa - Provide import to other classes
+from .cancellation import CancellableTask
+from .delayed import DelayedScheduler
 from datadope_alerta.plugins.recovery_actions.providers import RecoveryActionsProvider, RecoveryActionsResponseStatus, RecoveryActionsResponse
 
 logger = getLogger(__name__)
@@ -51,6 +55,13 @@ def launch_alerters(alert, recovery_actions_config, alerter_plugins: Dict[str, s
 
 
 def do_alert(alert, alerters, config, alerter_plugins: dict, repeating=False) -> Alert:
+    if AlerterTasksDispatch.is_enabled(config):
+        with AlerterTasksDispatch.open():
+            return _do_alert(alert, alerters, config, alerter_plugins, repeating)
+    return _do_alert(alert, alerters, config, alerter_plugins, repeating)
+
+
+def _do_alert(alert, alerters, config, alerter_plugins: dict, repeating=False) -> Alert:
     for alerter in alerters:
         if alerter not in alerter_plugins:
             logger.error("Unregistered alerter plugin '%s'", alerter)
@@ -76,14 +87,14 @@ def do_alert(alert, alerters, config, alerter_plugins: dict, repeating=False) ->
     return alert
 
 
-@celery.task(base=celery.Task, bind=True, ignore_result=True)
+@celery.task(base=CancellableTask, bind=True, ignore_result=True)
 def launch_actions(self, alert_id: str, provider_name, provider_class: str, alerter_plugins: Dict[str, str],
-                   operation_id=None):
+                   operation_id=None, alert_snapshot: Optional[dict] = None):
     thread_local.alert_id = alert_id
     thread_local.alerter_name = provider_name
     thread_local.operation = 'recovery_actions'
     begin = datetime.now()
-    alert = Alert.find_by_id(alert_id)
+    alert = AlertSnapshot.get_alert(alert_id, alert_snapshot)
     if alert.status in (Status.Closed, Status.Expired):
         logger.info("Cancelling execution of recovery actions on a closed or expired alert")
         return
@@ -153,7 +164,8 @@ def relaunch_actions(alert, provider_name, provider_class, alerter_plugins: Dict
             'provider_name': provider_name,
             'provider_class': provider_class,
             'alerter_plugins': alerter_plugins,
-            'operation_id': operation_id
+            'operation_id': operation_id,
+            'alert_snapshot': AlertSnapshot.for_task(alert)
         }
         task = signature(launch_actions, args=[], kwargs=kwargs).apply_async(
             countdown=countdown, queue=queue, retries=consumed_retries,
@@ -165,13 +177,13 @@ def relaunch_actions(alert, provider_name, provider_class, alerter_plugins: Dict
                                   begin=None, retries=max_retries)
 
 
-@celery.task(base=celery.Task, bind=True, ignore_result=True)
+@celery.task(base=CancellableTask, bind=True, ignore_result=True)
 def request_async_status(self, alert_id: str, provider_name, provider_class: str, alerter_plugins: Dict[str, str],
-                         operation_id):
+                         operation_id, alert_snapshot: Optional[dict] = None):
     thread_local.alert_id = alert_id
     thread_local.alerter_name = provider_name
     thread_local.operation = 'recovery_actions'
-    alert = Alert.find_by_id(alert_id)
+    alert = AlertSnapshot.get_alert(alert_id, alert_snapshot)
     if alert.status in (Status.Closed, Status.Expired):
         logger.info("Cancelling requesting recovery operation status on a closed or expired alert")
         return
@@ -225,7 +237,8 @@ def wait_for_response(alert: Alert, provider_name: str, provider_class: str, ale
         'provider_name': provider_name,
         'provider_class': provider_class,
         'alerter_plugins': alerter_plugins,
-        'operation_id': operation_id
+        'operation_id': operation_id,
+        'alert_snapshot': AlertSnapshot.for_task(alert)
     }
     task = signature(request_async_status, args=[], kwargs=kwargs).apply_async(**properties)
     recovery_actions_data.bg_task_id = task.id
@@ -248,8 +261,10 @@ def wait_for_recovery(alert: Alert, recovery_actions_config, recovery_actions_da
     kwargs = {
         'alert_id': alert.id,
         'alerter_plugins': alerter_plugins,
+        'alert_snapshot': AlertSnapshot.for_task(alert)
     }
-    task = signature(fail_not_resolved, args=[], kwargs=kwargs).apply_async(**properties)
+    # Long wait: task is kept by the delayed scheduler (if enabled) instead of by the workers
+    task = DelayedScheduler.apply_async(fail_not_resolved, kwargs=kwargs, **properties)
     recovery_actions_data.bg_task_id = task.id
     alerters_always = recovery_actions_config.get(RecoveryActionsFields.ALERTERS_ALWAYS.var_name, [])
     # Repeat event is forced in alerters invoked before, as recovery action providers may have enriched the alert
@@ -260,12 +275,12 @@ def wait_for_recovery(alert: Alert, recovery_actions_config, recovery_actions_da
     return alert
 
 
-@celery.task(ignore_result=True, max_retries=0)
-def fail_not_resolved(alert_id: str, alerter_plugins: Dict[str, str]):
+@celery.task(base=CancellableTask, ignore_result=True, max_retries=0)
+def fail_not_resolved(alert_id: str, alerter_plugins: Dict[str, str], alert_snapshot: Optional[dict] = None):
     thread_local.alert_id = alert_id
     thread_local.operation = 'recovery_actions'
     # If here, alert is not closed. But check anyway
-    alert = Alert.find_by_id(alert_id)
+    alert = AlertSnapshot.get_alert(alert_id, alert_snapshot)
     if alert.status not in (Status.Closed, Status.Expired):
         logger.info("Alert not recovered in time after recovery actions")
         recovery_actions_config = alert.attributes[GlobalAttributes.RECOVERY_ACTIONS.var_name]
@@ -0,0 +1,81 @@
+import time
+
+import jinja2
+from pkg_resources import iter_entry_points
+
+from alerta.app import plugins
+from datadope_alerta import ALERTERS_TEMPLATES_LOCATION
+from datadope_alerta.backend.flexiblededup.base import CONFIG_DATABASE_POOL_SIZE, DEFAULT_DATABASE_POOL_SIZE
+from datadope_alerta.plugins import Alerter, AlerterRegistry
+from datadope_alerta.plugins.iom_plugin import IOMAlerterPlugin
+from . import app, db, getLogger
+
+logger = getLogger(__name__)
+
+
+def preload_alerters():
+    """
+    Reads the configuration of the alerters of the configured plugins and creates the reusable instances,
+    so tasks executed in this process use them.
+    """
+    for plugin in plugins.plugins.values():
+        if not isinstance(plugin, IOMAlerterPlugin):
+            continue
+        try:
+            alerter_class = Alerter.get_fullname(plugin.get_alerter_class())
+            alerter_type = AlerterRegistry.get_alerter_type(alerter_class)
+            alerter_type.get_alerter_config(plugin.alerter_name)
+            if alerter_type.reusable:
+                AlerterRegistry.get_alerter(alerter_class, plugin.alerter_name)
+        except Exception as e:
+            logger.warning("Error preloading alerter '%s': %s", plugin.alerter_name, e)
+
+
+def preload_recovery_actions_providers():
+    for ep in iter_entry_points('alerta.recovery_actions.providers'):
+        try:
+            ep.load()
+        except Exception as e:
+            logger.warning("Error preloading recovery actions provider '%s': %s", ep.name, e)
+
+
+def compile_templates():
+    """
+    Compiles alerters templates and stores them in the template cache of the application.
+    """
+    for template in jinja2.FileSystemLoader(ALERTERS_TEMPLATES_LOCATION).list_templates():
+        try:
+            app.jinja_env.get_template(template)
+        except Exception as e:
+            logger.warning("Error compiling template '%s': %s", template, e)
+
+
+def open_database():
+    """
+    Opens a database connection that is returned to the pool of the process for the next task.
+    """
+    cursor = db.get_db().cursor()
+    cursor.execute('SELECT 1')
+    cursor.fetchone()
+
+
+def warm_up():
+    """
+    Loads in the worker process the resources needed by tasks, so the first task executed by the process
+    doesn't have to load them.
+    """
+    steps = [preload_alerters, preload_recovery_actions_providers, compile_templates]
+    # Without pool, the connection would be closed after warm-up
+    if int(app.config.get(CONFIG_DATABASE_POOL_SIZE, DEFAULT_DATABASE_POOL_SIZE) or 0) > 0:
+        steps.append(open_database)
+    timings = []
+    start = time.perf_counter()
+    with app.app_context():
+        for step in steps:
+            step_start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                logger.warning("Error in worker warm-up step '%s': %s", step.__name__, e)
+            timings.append(f"{step.__name__}: {time.perf_counter() - step_start:.3f}s")
+    logger.info("Worker process warm-up finished in %.3f sec (%s)", time.perf_counter() - start, ', '.join(timings))
@@ -1,25 +1,36 @@
+import contextvars
 import json
 import os
+import threading
+import time
 import traceback
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from datetime import datetime
 from enum import Enum
+from functools import wraps
 from importlib import import_module
 from json import JSONDecodeError
-from typing import Any, Dict, Tuple, Optional, Union
+from typing import Any, Dict, Tuple, Optional, Union, List, Callable, Iterator
 
 # noinspection PyPackageRequirements
 from celery.utils.log import get_task_logger
 # noinspection PyPackageRequirements
 from jinja2 import TemplateNotFound
+# noinspection PyPackageRequirements
+from redis import RedisError
 
 from alerta.models.alert import Alert
 from datadope_alerta import ContextualConfiguration, ConfigurationContext, VarDefinition, \
     NormalizedDictView, render_template, ALERTERS_KEY_BY_OPERATION, \
     alert_pretty_json_string, safe_convert, render_value, ALERTER_SPECIFIC_CONFIG_KEY_SUFFIX, get_config, merge, \
-    AlertIdFilter, GlobalAttributes
+    AlertIdFilter, GlobalAttributes, thread_local, get_redis_client
 from datadope_alerta.backend.flexiblededup.models.alerters import AlerterOperationData
 from datadope_alerta.plugins.event_tags_parser import MessageParserByTags
+from datadope_alerta.plugins.rate_limiter import RateLimiter, RateLimitedException
+from datadope_alerta.plugins.circuit_breaker import CircuitBreaker, CircuitCall, CircuitOpenException
+from datadope_alerta.plugins.digest import DigestBuffer, DEFAULT_DIGEST_MESSAGE
+from datadope_alerta.plugins.delivery import DeliveryPool, DeliveryResult, DeliveryProgress
 
 
 def getLogger(name):  # noqa
@@ -37,6 +48,10 @@ def getLogger(name):  # noqa
 
 logger = getLogger('datadope_alerta.plugins')
 
+# Background task and request bound to each alerter instance (by id) in the current context.
+# See Alerter.running_in_task
+_alerters_task_context: contextvars.ContextVar[Dict[int, tuple]] = contextvars.ContextVar('alerters_task_context')
+
 
 class RetryableException(Exception):
     """
@@ -71,6 +86,11 @@ class AlerterStatus(str, Enum):
         from datadope_alerta import db_alerters
         return AlerterStatus(db_alerters.get_status(alert_id, alerter_name))
 
+    @classmethod
+    def all_from_db(cls, alert_id) -> Dict[str, 'AlerterStatus']:
+        from datadope_alerta import db_alerters
+        return {alerter: AlerterStatus(status) for alerter, status in db_alerters.get_statuses(alert_id).items()}
+
     @classmethod
     def store(cls, alert_id, alerter, status: 'AlerterStatus') -> 'AlerterStatus':
         from datadope_alerta import db_alerters
@@ -83,20 +103,246 @@ class AlerterStatus(str, Enum):
             logger.warning("Exception storing alerter status: %s", e)
             return status
 
+    @classmethod
+    def transition(cls, alert_id, alerter, status: 'AlerterStatus',
+                   alerter_operation_data: Optional[AlerterOperationData] = None,
+                   expected_statuses=None) -> 'AlerterStatus':
+        """
+        Stores alerter status and alerter operation data in a single database round trip.
+
+        :param alert_id:
+        :param alerter:
+        :param status: new status
+        :param alerter_operation_data: operation data to store with the new status
+        :param expected_statuses: if provided, the transition is only done if current status is one of them
+        :return: status previous to the transition
+        """
+        from datadope_alerta import db_alerters
+        expected = [x.value for x in expected_statuses] if expected_statuses is not None else None
+        previous, _ = db_alerters.transition(alert_id, alerter, status.value, alerter_operation_data, expected)
+        return AlerterStatus(previous)
+
+    @classmethod
+    def compare_and_set(cls, alert_id, alerter, expected_statuses, status: 'AlerterStatus',
+                        alerter_operation_data: Optional[AlerterOperationData] = None,
+                        chain_operation_data: Optional[AlerterOperationData] = None) \
+            -> Tuple[bool, 'AlerterStatus']:
+        """
+        Atomically changes alerter status only if current status is one of the expected ones.
+
+        Alerter operation data, if provided, is only stored if the transition is applied.
+
+        :param alert_id:
+        :param alerter:
+        :param expected_statuses: an AlerterStatus or a list of them that are valid as current status
+        :param status: new status
+        :param alerter_operation_data: operation data to store with the new status
+        :param chain_operation_data: operation data of the running task. Only its task chain info is stored,
+            if the transition is applied.
+        :return: tuple with a boolean indicating if the transition has been applied and the current status:
+            the new status if applied or the status found in the database if not applied
+        """
+        from datadope_alerta import db_alerters
+        if isinstance(expected_statuses, AlerterStatus):
+            expected_statuses = [expected_statuses]
+        previous, applied = db_alerters.transition(alert_id, alerter, status.value, alerter_operation_data,
+                                                   [x.value for x in expected_statuses], chain_operation_data)
+        return applied, status if applied else AlerterStatus(previous)
+
     @classmethod
     def clear(cls, alert_id):
         from datadope_alerta import db_alerters
         db_alerters.clear_status(alert_id)
 
 
+class AlerterStateSnapshot:
+    """
+    In-memory view of the status of an alerter for an alert and the last operation data of each of its operations.
+
+    It is loaded using only one query. Writes done through the snapshot are stored in the database and
+    kept in the snapshot, so later reads don't need to access the database.
+    """
+
+    def __init__(self, alert_id, alerter, status: AlerterStatus,
+                 operations_data: Optional[Dict[str, AlerterOperationData]] = None):
+        self.alert_id = alert_id
+        self.alerter = alerter
+        self.status = status
+        self._operations_data = operations_data or {}
+
+    @classmethod
+    def load(cls, alert_id, alerter) -> 'AlerterStateSnapshot':
+        from datadope_alerta import db_alerters
+        status, operations_data = db_alerters.get_alerter_state(alert_id, alerter)
+        return cls(alert_id, alerter, AlerterStatus(status), operations_data)
+
+    def get_operation_data(self, operation, create_default=True) -> Optional[AlerterOperationData]:
+        alerter_operation_data = self._operations_data.get(operation)
+        if alerter_operation_data is None and create_default:
+            alerter_operation_data = AlerterOperationData(alert_id=self.alert_id, alerter=self.alerter,
+                                                          operation=operation)
+            self._operations_data[operation] = alerter_operation_data
+        return alerter_operation_data
+
+    def store_operation_data(self, alerter_operation_data: AlerterOperationData):
+        stored = alerter_operation_data.store()
+        if stored is not None:
+            alerter_operation_data.id = stored.id
+        self._operations_data[alerter_operation_data.operation] = alerter_operation_data
+
+    def transition(self, status: AlerterStatus, alerter_operation_data: Optional[AlerterOperationData] = None,
+                   expected_statuses=None) -> Tuple[bool, AlerterStatus]:
+        """
+        Stores alerter status and alerter operation data and keeps them in the snapshot.
+
+        :param status: new status
+        :param alerter_operation_data: operation data to store with the new status
+        :param expected_statuses: if provided, the transition is a compare and set with these statuses
+        :return: tuple with a boolean indicating if the transition has been applied and the current status
+        """
+        if expected_statuses is None:
+            AlerterStatus.transition(self.alert_id, self.alerter, status, alerter_operation_data)
+            applied, current_status = True, status
+        else:
+            applied, current_status = AlerterStatus.compare_and_set(self.alert_id, self.alerter, expected_statuses,
+                                                                    status, alerter_operation_data)
+        self.status = current_status
+        if applied and alerter_operation_data is not None:
+            self._operations_data[alerter_operation_data.operation] = alerter_operation_data
+        return applied, current_status
+
+
+class TaskTiming:
+    """
+    Time spent (in seconds) in each phase of the execution of an alerter background task:
+
+      * queue_wait: since the time the task was scheduled to run (eta) until it started.
+      * before_start_db: database operations before running the alerter.
+      * alert_read: reading the alert.
+      * config_render: resolving alerter configuration and rendering templates.
+      * external_call: time of the alerter operation not spent in config_render.
+      * finish_db: database operations after running the alerter.
+
+    The timing of the task being executed in the current thread is available using `TaskTiming.current()`.
+    """
+    QUEUE_WAIT = 'queue_wait'
+    BEFORE_START_DB = 'before_start_db'
+    ALERT_READ = 'alert_read'
+    CONFIG_RENDER = 'config_render'
+    EXTERNAL_CALL = 'external_call'
+    FINISH_DB = 'finish_db'
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self._running = set()
+
+    @staticmethod
+    def current() -> Optional['TaskTiming']:
+        return getattr(thread_local, 'task_timing', None)
+
+    @staticmethod
+    def set_current(timing: Optional['TaskTiming']):
+        thread_local.task_timing = timing
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + max(0.0, seconds)
+
+    def get(self, phase: str) -> float:
+        return self.phases.get(phase, 0.0)
+
+    @contextmanager
+    def measure(self, phase: str):
+        """
+        Adds the time spent inside the context to the phase. Nested measures of the same phase are counted once.
+        """
+        if phase in self._running:
+            yield self
+            return
+        self._running.add(phase)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add(phase, time.perf_counter() - start)
+            self._running.discard(phase)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {phase: round(seconds, 4) for phase, seconds in self.phases.items()}
+
+    @staticmethod
+    def timed(phase: str):
+        """
+        Decorator to add the time of the decorated function to a phase of the timing of the current task, if any.
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapped(*args, **kwargs):
+                timing = TaskTiming.current()
+                if timing is None:
+                    return f(*args, **kwargs)
+                with timing.measure(phase):
+                    return f(*args, **kwargs)
+            return wrapped
+        return decorator
+
+
 class Alerter(ABC):
 
     _alerter_config = None
 
+    reusable = True
+    """
+    Instances are shared by all the tasks executed in a worker process (see AlerterRegistry).
+    Alerters that keep state of the operation in the instance must set it to False.
+    """
+
     def __init__(self, name, bgtask=None):
         self.name = name
-        self.bgtask = bgtask
+        self._bgtask = bgtask
         self.config = NormalizedDictView(self.get_alerter_config(self.name))
+        self._rate_limiter = None
+        self._rate_limiter_created = False
+        self._circuit_breaker = None
+        self._circuit_breaker_created = False
+        self._digest_buffer = None
+        self._digest_buffer_created = False
+
+    @property
+    def bgtask(self):
+        """
+        Background task executing the current operation of the alerter in this thread, if any.
+        """
+        return _alerters_task_context.get({}).get(id(self), (None, None))[0] or self._bgtask
+
+    @property
+    def task_request(self):
+        """
+        Request of the background task executing the current operation, if any. Unlike `bgtask.request`,
+        it is also available in the threads delivering to several destinations (see `deliver`).
+        """
+        request = _alerters_task_context.get({}).get(id(self), (None, None))[1]
+        if request is None and self.bgtask is not None:
+            request = self.bgtask.request
+        return request
+
+    @bgtask.setter
+    def bgtask(self, bgtask):
+        self._bgtask = bgtask
+
+    @contextmanager
+    def running_in_task(self, bgtask):
+        """
+        Binds the background task to the alerter for the operations executed inside the context
+        in the current thread.
+        """
+        # Copy on write, so values are never shared by different contexts
+        bound = dict(_alerters_task_context.get({}))
+        bound[id(self)] = (bgtask, bgtask.request if bgtask is not None else None)
+        token = _alerters_task_context.set(bound)
+        try:
+            yield self
+        finally:
+            _alerters_task_context.reset(token)
 
     @classmethod
     @abstractmethod
@@ -231,6 +477,7 @@ class Alerter(ABC):
             data['info']['extra_info'] = str(extra_info)
         return data
 
+    @TaskTiming.timed(TaskTiming.CONFIG_RENDER)
     def get_contextual_configuration(self, var_definition: VarDefinition,
                                      alert: Alert, operation: str) -> Tuple[Any, ConfigurationContext]:
         """
@@ -299,6 +546,7 @@ class Alerter(ABC):
         if data:
             return data.response
 
+    @TaskTiming.timed(TaskTiming.CONFIG_RENDER)
     def render_template(self, template_path, alert, operation=None, **kwargs):
         """
         Helper method for alerters to render a file formatted as Jinja2 template.
@@ -334,6 +582,7 @@ class Alerter(ABC):
                                pretty_alert=kwargs.pop('pretty_alert', alert_pretty_json_string(alert)),
                                **kwargs)
 
+    @TaskTiming.timed(TaskTiming.CONFIG_RENDER)
     def render_value(self, value, alert, operation=None, **kwargs):
         """
         Helper method for alerters to render a value (dict, list or str) formatted as Jinja2 template.
@@ -372,6 +621,7 @@ class Alerter(ABC):
         data_dict.pop('value', None)
         return render_value(value, **data_dict, **kwargs)
 
+    @TaskTiming.timed(TaskTiming.CONFIG_RENDER)
     def get_message(self, alert: Alert, operation: str, reason, **kwargs) -> str:
         """
         Returns message info for the alerta and operation.
@@ -423,6 +673,202 @@ class Alerter(ABC):
                 message = original_reason
         return message
 
+    @property
+    def rate_limiter(self) -> Optional[RateLimiter]:
+        """
+        Rate limiter configured in the 'rate_limit' entry of the alerter configuration, if any.
+        """
+        if not self._rate_limiter_created:
+            self._rate_limiter = RateLimiter.from_config(self.config.get('rate_limit'))
+            self._rate_limiter_created = True
+        return self._rate_limiter
+
+    def acquire_rate_limit(self, destination: str):
+        """
+        Must be called by alerters before each request to a destination (chat, webhook, server...) to respect
+        the rate limit configured for the alerter. Waits until the request is allowed.
+
+        :param destination: identification of the destination. Alerters sending to the same destination
+            must use the same value, so they share the limit.
+        :raise RateLimitedException: if the request is not allowed before the max wait configured. Background
+            tasks are rescheduled to be executed when the request will be allowed.
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire(destination)
+
+    @property
+    def circuit_breaker(self) -> Optional[CircuitBreaker]:
+        """
+        Circuit breaker configured in the 'circuit_breaker' entry of the alerter configuration, if any.
+        """
+        if not self._circuit_breaker_created:
+            self._circuit_breaker = CircuitBreaker.from_config(self.config.get('circuit_breaker'))
+            self._circuit_breaker_created = True
+        return self._circuit_breaker
+
+    @contextmanager
+    def destination_circuit(self, destination: str):
+        """
+        Context manager that must wrap each request of alerters to a destination (chat, webhook, server...) to
+        apply the circuit breaker configured for the alerter. Exceptions raised inside the context that are
+        considered a failure of the destination (see `CircuitBreaker.is_failure`) are recorded as failures.
+        Other failures may be recorded using `fail` method of the call returned by the context manager.
+
+        :param destination: identification of the destination. Same value used to acquire the rate limit.
+        :raise CircuitOpenException: if the circuit of the destination is open. Background tasks are rescheduled
+            to be executed when the circuit allows a new request.
+        """
+        breaker = self.circuit_breaker
+        if breaker is None:
+            yield CircuitCall(self.name, destination)
+            return
+        call = breaker.check(self.name, destination)
+        try:
+            yield call
+        except Exception as e:
+            if call.failed or breaker.is_failure(e):
+                breaker.record_failure(call)
+            raise
+        if call.failed:
+            breaker.record_failure(call)
+        else:
+            breaker.record_success(call)
+
+    @property
+    def digest_buffer(self) -> Optional[DigestBuffer]:
+        """
+        Digest buffer configured in the 'digest' entry of the alerter configuration, if any.
+        """
+        if not self._digest_buffer_created:
+            self._digest_buffer = DigestBuffer.from_config(self.config.get('digest'))
+            self._digest_buffer_created = True
+        return self._digest_buffer
+
+    def add_to_digest(self, alert: Alert, operation: str, destination: str, destination_data: dict) -> Optional[str]:
+        """
+        Buffers the notification of a new alert for a destination if digest mode is configured for the alerter
+        and the alerter implements `send_digest`. The first alert buffered for the destination schedules the task
+        that sends the digest at the end of the digest window, using method `send_digest`.
+
+        If that task cannot be scheduled, the alerts buffered for the destination are sent now.
+
+        Destination and destination data are arguments of the task that sends the digest, so they must not include
+        credentials (bot tokens, webhook keys...). `send_digest` must resolve them from the configuration of the
+        alerter or from the contextual configuration of the alerts (see `find_digest_alerts`).
+
+        :param alert:
+        :param operation: only event operations are buffered
+        :param destination: identification of the destination. Alerts are buffered by destination.
+        :param destination_data: data needed by `send_digest` to send the message to the destination
+        :return: id of the digest that will include the alert or None if the notification must be sent now
+        """
+        if operation != Alerter.process_event.__name__ or self.digest_buffer is None:
+            return None
+        if type(self).send_digest is Alerter.send_digest:
+            logger.debug("Digest configured for alerter '%s' but not supported. Ignored", self.name)
+            return None
+        try:
+            digest_id, created = self.digest_buffer.add(self.name, destination, DigestBuffer.entry_for_alert(alert))
+        except RedisError as e:
+            logger.warning("Error buffering alert for digest. Sending it now: %s", e)
+            return None
+        if created:
+            from datadope_alerta.bgtasks.digest import flush_digest
+            request = self.task_request
+            queue = request.delivery_info.get('routing_key') if request and request.delivery_info else None
+            try:
+                flush_digest.apply_async(args=[self.get_fullname(self.__class__), self.name, destination,
+                                               destination_data],
+                                         countdown=self.digest_buffer.window, queue=queue)
+            except Exception as e:
+                logger.warning("Error scheduling digest '%s'. Sending buffered alerts now: %s", digest_id, e)
+                return self._send_digest_now(destination, destination_data)
+            logger.info("Created digest '%s'. Sending in %.0f secs", digest_id, self.digest_buffer.window)
+        else:
+            logger.info("Alert added to digest '%s'", digest_id)
+        return digest_id
+
+    def _send_digest_now(self, destination: str, destination_data: dict) -> Optional[str]:
+        """
+        Takes the alerts buffered for the destination and sends them. Other alerts may have been added to the
+        digest since it was created, so they are sent as a digest. If only one alert is buffered, it is left to the
+        caller to send it as a normal notification.
+
+        :return: id of the digest sent or None if the caller must send the alert
+        """
+        digest_id, alerts = self.digest_buffer.take(self.name, destination)
+        if len(alerts) <= 1:
+            return None
+        self.send_digest(digest_id, alerts, destination_data)
+        return digest_id
+
+    def render_digest(self, digest_id: str, alerts: List[dict]) -> str:
+        """
+        Renders the message of a digest using the template configured in the 'digest' entry of the alerter
+        configuration ('{{ alerter_name }}/digest.j2' by default). If the template is not available, the
+        'message' of the 'digest' entry is rendered.
+
+        Template may use the variables:
+          * alerts: list of dicts with the main fields of the alerts (see `DigestBuffer.entry_for_alert`)
+          * digest_id: id of the digest
+          * alerter_config: alerter configuration dict (keys normalized)
+          * alerter_name: alerter name
+        """
+        data = dict(alerts=alerts, digest_id=digest_id, alerter_config=self.config, alerter_name=self.name)
+        template = render_value(self.digest_buffer.template, **data)
+        try:
+            return render_template(template, **data)
+        except TemplateNotFound:
+            logger.debug("Digest template '%s' not found for '%s' Alerter", template, self.name)
+        except Exception as e:
+            logger.warning("Error rendering digest template: '%s'. Using default message", e, exc_info=e)
+        return render_value(self.config.get('digest', {}).get('message') or DEFAULT_DIGEST_MESSAGE, **data)
+
+    def send_digest(self, digest_id: str, alerts: List[dict], destination_data: dict):
+        """
+        Sends a digest to a destination. Alerters supporting digests must implement it. Alerters that don't
+        implement it never buffer alerts in `add_to_digest`.
+
+        :param digest_id:
+        :param alerts: alerts included in the digest
+        :param destination_data: data provided to `add_to_digest`
+        """
+        raise NotImplementedError(f"Alerter '{self.name}' doesn't support digests")
+
+    @staticmethod
+    def find_digest_alerts(alerts: List[dict]) -> Iterator[Alert]:
+        """
+        Reads the alerts of a digest that are still stored, so `send_digest` may resolve the credentials
+        of the destination from their contextual configuration.
+
+        :param alerts: alerts included in the digest
+        """
+        for entry in alerts:
+            alert = Alert.find_by_id(entry['id'])
+            if alert is not None:
+                yield alert
+
+    def deliver(self, deliveries: Dict[str, List[Callable[[], Any]]]) -> Dict[str, DeliveryResult]:
+        """
+        Delivers a notification to several destinations concurrently using the delivery pool of the process.
+        Functions of the same destination (parts of a message) are executed in order.
+
+        The number of destinations delivered concurrently by the alerter in the process is limited by the
+        'delivery_concurrency' entry of the alerter configuration (4 by default).
+
+        If executed by a background task, the parts delivered to each destination are stored, so retries of the
+        task only deliver the pending destinations and parts.
+
+        :param deliveries: dict with the list of functions to execute in order for each destination
+        :return: dict with the result of each destination. Use `DeliveryPool.to_response` to build the response.
+        """
+        semaphore = DeliveryPool.get_semaphore(self.name, int(self.config.get('delivery_concurrency', 4)))
+        request = self.task_request
+        progress = None
+        if request is not None and request.id:
+            progress = DeliveryProgress(get_redis_client(), self.name, request.id)
+        return DeliveryPool.deliver(deliveries, semaphore, progress)
+
     def is_dry_run(self, alert: Alert, operation: str) -> bool:
         dry_run, _ = self.get_contextual_configuration(ContextualConfiguration.DRY_RUN, alert, operation)
         return dry_run
@@ -468,3 +914,48 @@ class Alerter(ABC):
             result['info']['traceback'] = ''.join(traceback.format_exception(
                 type(exc), exc, exc.__traceback__)) if exc else einfo.traceback
         return result
+
+
+class AlerterRegistry:
+    """
+    Alerter types and instances of the process, keyed by alerter class and alerter name.
+
+    Instances are created without background task and reused by all the tasks executed in the process.
+    The task running an operation is bound to the instance only during the operation
+    (see Alerter.running_in_task). Alerters not reusable get a new instance for each request.
+    """
+    _types: Dict[str, type] = {}
+    _instances: Dict[Tuple[str, str], Alerter] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_alerter_type(cls, alerter_class: str) -> type:
+        alerter_type = cls._types.get(alerter_class)
+        if alerter_type is None:
+            alerter_type = Alerter.get_alerter_type(alerter_class)
+            cls._types[alerter_class] = alerter_type
+        return alerter_type
+
+    @classmethod
+    def get_alerter(cls, alerter_class: str, alerter_name: str, bgtask=None) -> Alerter:
+        """
+        Returns the instance of the alerter for this process.
+
+        :param alerter_class: full name of the alerter class
+        :param alerter_name:
+        :param bgtask: only used if the alerter is not reusable. Use Alerter.running_in_task to bind the task
+            to a reusable instance.
+        :return:
+        """
+        alerter_type = cls.get_alerter_type(alerter_class)
+        if not alerter_type.reusable:
+            return alerter_type(alerter_name, bgtask)
+        key = (alerter_class, alerter_name)
+        alerter = cls._instances.get(key)
+        if alerter is None:
+            with cls._lock:
+                alerter = cls._instances.get(key)
+                if alerter is None:
+                    alerter = alerter_type(alerter_name)
+                    cls._instances[key] = alerter
+        return alerter
@@ -0,0 +1,217 @@
+import hashlib
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Optional, List
+
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+from datadope_alerta.plugins.rate_limiter import RateLimitedException
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenException(RateLimitedException):
+    """
+    Raised when a destination is not called because its circuit is open.
+
+    As a rate limited operation, background tasks catching this exception reschedule the task to be executed
+    when the circuit allows calling the destination again. Reschedules are counted as deferrals of the task
+    (`deferrals` message property), not as retries, so they don't consume the retries of the alerter until
+    ALERTERS_MAX_DEFERRALS is reached.
+    """
+
+    def __init__(self, destination: str, retry_after: float):
+        super().__init__(destination, retry_after)
+        self.args = (f"Circuit open for destination. Retry after {retry_after:.1f} secs",)
+
+
+class CircuitCall:
+    """
+    Call to a destination protected by a circuit breaker.
+    """
+
+    def __init__(self, alerter_name: str, destination: str, tracked: bool = False):
+        self.alerter_name = alerter_name
+        self.destination = destination
+        # Circuit had failures or was open when the call was allowed, so a success must reset it
+        self.tracked = tracked
+        self.failed = False
+
+    def fail(self):
+        """
+        Marks the call as failed without raising an exception (i.e. the destination answered with a server error).
+        """
+        self.failed = True
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by all the processes using redis.
+
+    Each destination of an alerter has its own circuit, stored in a redis hash with the consecutive failures, the
+    time the circuit will remain open and the time of the next probe. After `failures` consecutive failures,
+    the circuit opens during `open_time` seconds and calls are rejected with CircuitOpenException, so background
+    tasks are rescheduled to the end of that period instead of following their retry policy.
+    After that period the circuit is half-open: one call (probe) is allowed every `probe_interval` seconds.
+    A successful call closes the circuit and a failed one opens it again.
+
+    Any error accessing redis is logged and the call is allowed.
+    """
+    KEY_PREFIX = 'alerta:circuit:'
+
+    # Returns the seconds to wait until the call is allowed and the current failures, as strings.
+    # If the circuit is half-open and the call is allowed, the call is the probe of the current probe interval.
+    CHECK_SCRIPT = """
+local circuit = redis.call('HMGET', KEYS[1], 'failures', 'open_until', 'next_probe')
+local failures = circuit[1] or '0'
+local open_until = tonumber(circuit[2])
+if open_until == nil then
+    return {'0', failures}
+end
+local now = tonumber(ARGV[1])
+if now < open_until then
+    return {tostring(open_until - now), failures}
+end
+local next_probe = tonumber(circuit[3]) or 0
+if now >= next_probe then
+    redis.call('HSET', KEYS[1], 'next_probe', tostring(now + tonumber(ARGV[2])))
+    return {'0', failures}
+end
+return {tostring(next_probe - now), failures}
+"""
+
+    # Returns 1 if the circuit has been opened with this failure
+    FAILURE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local failures = redis.call('HINCRBY', KEYS[1], 'failures', 1)
+local open_until = tonumber(redis.call('HGET', KEYS[1], 'open_until'))
+local opened = 0
+if failures >= tonumber(ARGV[2]) and (open_until == nil or now >= open_until) then
+    open_until = tostring(now + tonumber(ARGV[3]))
+    redis.call('HSET', KEYS[1], 'open_until', open_until, 'next_probe', open_until, 'opened_at', tostring(now))
+    opened = 1
+end
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return opened
+"""
+
+    def __init__(self, client, failures: int = 5, open_time: float = 60.0, probe_interval: float = 10.0):
+        """
+        :param client: redis client
+        :param failures: consecutive failures to open the circuit
+        :param open_time: seconds the circuit remains open before allowing probes
+        :param probe_interval: seconds between probes while the circuit is half-open
+        """
+        self.client = client
+        self.failures = max(int(failures), 1)
+        self.open_time = max(open_time, 0.0)
+        self.probe_interval = max(probe_interval, 0.0)
+        # Circuits not failing during this time are reset
+        self.ttl = int(self.open_time) * 2 + 3600
+        self._check_script = client.register_script(self.CHECK_SCRIPT)
+        self._failure_script = client.register_script(self.FAILURE_SCRIPT)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> Optional['CircuitBreaker']:
+        """
+        Creates a circuit breaker from the `circuit_breaker` entry of an alerter configuration:
+        {"failures": <consecutive failures to open>, "open_time": <seconds open>,
+        "probe_interval": <seconds between probes>}
+
+        :return: the circuit breaker or None if circuit breaker is not configured
+        """
+        if not config or not config.get('failures'):
+            return None
+        from datadope_alerta import get_redis_client
+        return cls(get_redis_client(), int(config['failures']), float(config.get('open_time', 60.0)),
+                   float(config.get('probe_interval', 10.0)))
+
+    @classmethod
+    def _key(cls, alerter_name: str, destination: str):
+        # Destinations may include credentials (bot tokens, webhook urls with keys), so they are not used as key
+        return f"{cls.KEY_PREFIX}{alerter_name}:{hashlib.sha1(destination.encode('utf-8')).hexdigest()}"
+
+    @staticmethod
+    def is_failure(exc: Exception) -> bool:
+        """
+        Exceptions considered a failure of the destination: retryable exceptions and network errors
+        (including requests exceptions), but not responses of the destination with a client error.
+        """
+        from datadope_alerta.plugins import RetryableException
+        if isinstance(exc, RateLimitedException) or not isinstance(exc, (RetryableException, OSError)):
+            return False
+        status_code = getattr(getattr(exc, 'response', None), 'status_code', None)
+        return status_code is None or status_code >= 500
+
+    def check(self, alerter_name: str, destination: str) -> CircuitCall:
+        """
+        Checks if the destination may be called.
+
+        :return: the call to use to record its result
+        :raise CircuitOpenException: if the circuit of the destination is open
+        """
+        try:
+            wait, failures = self._check_script(keys=[self._key(alerter_name, destination)],
+                                                args=[time.time(), self.probe_interval])
+        except RedisError as e:
+            logger.warning("Error accessing circuit breaker. Call allowed: %s", e)
+            return CircuitCall(alerter_name, destination)
+        wait = float(wait)
+        if wait > 0:
+            # Calls rejected are spread to not release all of them at the same time
+            raise CircuitOpenException(destination, wait + random.uniform(0.0, self.probe_interval))
+        return CircuitCall(alerter_name, destination, tracked=int(failures) > 0)
+
+    def record_success(self, call: CircuitCall):
+        if not call.tracked:
+            return
+        try:
+            if self.client.delete(self._key(call.alerter_name, call.destination)):
+                logger.info("Circuit closed for destination")
+        except RedisError as e:
+            logger.warning("Error accessing circuit breaker: %s", e)
+
+    def record_failure(self, call: CircuitCall):
+        try:
+            if int(self._failure_script(keys=[self._key(call.alerter_name, call.destination)],
+                                        args=[time.time(), self.failures, self.open_time, self.ttl])):
+                logger.warning("Circuit opened for destination during %.0f secs after %d consecutive failures",
+                               self.open_time, self.failures)
+        except RedisError as e:
+            logger.warning("Error accessing circuit breaker: %s", e)
+
+    @classmethod
+    def get_circuits(cls, client, alerter_name: Optional[str] = None) -> List[dict]:
+        """
+        Returns the state of the circuits with failures, optionally only the ones of an alerter.
+
+        Each circuit is a dict with the alerter, the id of the destination (hash of the destination), the state
+        ('closed', 'open' or 'half_open'), the consecutive failures and the open times, if open.
+        """
+        now = time.time()
+        circuits = []
+        for key in client.scan_iter(match=f"{cls.KEY_PREFIX}{alerter_name or '*'}:*", count=500):
+            circuit = client.hgetall(key)
+            if not circuit:
+                continue
+            alerter, _, destination_id = key[len(cls.KEY_PREFIX):].rpartition(':')
+            open_until = float(circuit['open_until']) if 'open_until' in circuit else None
+            opened_at = float(circuit['opened_at']) if 'opened_at' in circuit else None
+            if open_until is None:
+                state = 'closed'
+            elif now < open_until:
+                state = 'open'
+            else:
+                state = 'half_open'
+            circuits.append({
+                'alerter': alerter,
+                'destinationId': destination_id,
+                'state': state,
+                'failures': int(circuit.get('failures', 0)),
+                'openedAt': datetime.utcfromtimestamp(opened_at) if opened_at is not None else None,
+                'openUntil': datetime.utcfromtimestamp(open_until) if open_until is not None else None
+            })
+        return circuits
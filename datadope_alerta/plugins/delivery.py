@@ -0,0 +1,238 @@
+import contextvars
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DeliveryResult:
+    responses: List[Any] = field(default_factory=list)
+    exception: Optional[Exception] = None
+    # Parts delivered by previous executions of the task
+    previously_delivered: int = 0
+    # Parts delivered are stored in the progress of the task
+    tracked: bool = False
+
+    @property
+    def success(self) -> bool:
+        return self.exception is None
+
+    @property
+    def delivered(self) -> int:
+        return self.previously_delivered + len(self.responses)
+
+
+class DeliveryProgress:
+    """
+    Number of parts of a notification delivered to each destination by a background task.
+
+    Progress is stored in a redis hash identified by the alerter and the task id. Retries of a task keep its id,
+    so they deliver only the parts not delivered by previous executions.
+
+    Any error accessing redis is logged and progress is not tracked.
+    """
+    KEY_PREFIX = 'alerta:delivery:'
+    TTL = 86400
+
+    def __init__(self, client, alerter_name: str, task_id: str):
+        self.client = client
+        self.key = f"{self.KEY_PREFIX}{alerter_name}:{task_id}"
+
+    @staticmethod
+    def _field(destination: str) -> str:
+        # Destinations may include credentials (bot tokens, webhook urls with keys), so they are not stored
+        return hashlib.sha1(destination.encode('utf-8')).hexdigest()
+
+    def get(self, destinations) -> Optional[Dict[str, int]]:
+        """
+        :return: dict with the parts delivered to each destination or None if progress cannot be read
+        """
+        destinations = list(destinations)
+        if not destinations:
+            return {}
+        try:
+            values = self.client.hmget(self.key, [self._field(x) for x in destinations])
+        except RedisError as e:
+            logger.warning("Error reading delivery progress. Progress not tracked: %s", e)
+            return None
+        return {destination: int(value) for destination, value in zip(destinations, values) if value}
+
+    def record(self, destination: str) -> bool:
+        """
+        Records a part delivered to the destination.
+
+        :return: True if the part has been recorded
+        """
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.hincrby(self.key, self._field(destination), 1)
+            pipeline.expire(self.key, self.TTL)
+            pipeline.execute()
+            return True
+        except RedisError as e:
+            logger.warning("Error storing delivery progress: %s", e)
+            return False
+
+    def clear(self):
+        try:
+            self.client.delete(self.key)
+        except RedisError as e:
+            logger.warning("Error removing delivery progress: %s", e)
+
+
+class DeliveryPool:
+    """
+    Thread pool shared by the alerters of the process to deliver a notification to several destinations
+    concurrently.
+
+    Each destination receives a list of deliveries (the parts of a multipart message) that are executed in order
+    in the same thread, so parts are received in order. Different destinations are executed concurrently, limited
+    by the size of the pool (DELIVERY_POOL_THREADS) and by the concurrency configured for the alerter.
+    """
+    _executor = None
+    _pid = None
+    _semaphores: Dict[str, threading.BoundedSemaphore] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls) -> ThreadPoolExecutor:
+        # Pool threads are not inherited by forked processes. Each process creates its own pool.
+        if cls._executor is None or cls._pid != os.getpid():
+            with cls._lock:
+                if cls._executor is None or cls._pid != os.getpid():
+                    from datadope_alerta import get_config, CONFIG_DELIVERY_POOL_THREADS, \
+                        DEFAULT_DELIVERY_POOL_THREADS
+                    cls._executor = ThreadPoolExecutor(
+                        max_workers=get_config(CONFIG_DELIVERY_POOL_THREADS, DEFAULT_DELIVERY_POOL_THREADS, type=int),
+                        thread_name_prefix='delivery')
+                    cls._semaphores = {}
+                    cls._pid = os.getpid()
+        return cls._executor
+
+    @classmethod
+    def get_semaphore(cls, alerter_name: str, concurrency: int) -> threading.BoundedSemaphore:
+        """
+        Returns the semaphore limiting the concurrent deliveries of an alerter in this process.
+        """
+        cls.get_executor()
+        semaphore = cls._semaphores.get(alerter_name)
+        if semaphore is None:
+            with cls._lock:
+                semaphore = cls._semaphores.setdefault(alerter_name, threading.BoundedSemaphore(max(concurrency, 1)))
+        return semaphore
+
+    @staticmethod
+    def _deliver_parts(parts: List[Callable[[], Any]], destination: str = None,
+                       progress: Optional[DeliveryProgress] = None, delivered: int = 0) -> DeliveryResult:
+        result = DeliveryResult(previously_delivered=delivered, tracked=progress is not None)
+        try:
+            for part in parts[delivered:]:
+                result.responses.append(part())
+                if progress is not None and not progress.record(destination):
+                    result.tracked = False
+        except Exception as e:
+            result.exception = e
+        return result
+
+    @classmethod
+    def deliver(cls, deliveries: Dict[str, List[Callable[[], Any]]],
+                semaphore: Optional[threading.BoundedSemaphore] = None,
+                progress: Optional[DeliveryProgress] = None) -> Dict[str, DeliveryResult]:
+        """
+        Executes the deliveries of each destination and waits for all of them. If a part of a destination fails,
+        the remaining parts for that destination are not delivered.
+
+        Deliveries are executed with a copy of the context of the caller (flask application context and
+        `thread_local` values).
+
+        If the progress of the task is provided, the parts delivered by previous executions of the task are
+        skipped and the parts delivered now are recorded. Progress is removed when all the destinations succeed.
+
+        :param deliveries: dict with the list of functions to execute in order for each destination
+        :param semaphore: semaphore limiting the concurrent destinations (see `get_semaphore`)
+        :param progress: progress of the background task delivering the notification
+        :return: dict with the result of each destination
+        """
+        delivered = progress.get(deliveries.keys()) if progress is not None else {}
+        if delivered is None:
+            progress, delivered = None, {}
+        if len(deliveries) <= 1:
+            results = {destination: cls._deliver_parts(parts, destination, progress, delivered.get(destination, 0))
+                       for destination, parts in deliveries.items()}
+        else:
+            results = cls._deliver_concurrently(deliveries, semaphore, progress, delivered)
+        if progress is not None and all(x.success for x in results.values()):
+            progress.clear()
+        return results
+
+    @classmethod
+    def _deliver_concurrently(cls, deliveries: Dict[str, List[Callable[[], Any]]],
+                              semaphore: Optional[threading.BoundedSemaphore],
+                              progress: Optional[DeliveryProgress],
+                              delivered: Dict[str, int]) -> Dict[str, DeliveryResult]:
+        executor = cls.get_executor()
+        futures = {}
+        for destination, parts in deliveries.items():
+            if semaphore is not None:
+                semaphore.acquire()
+            try:
+                future = executor.submit(contextvars.copy_context().run, cls._deliver_parts, parts, destination,
+                                         progress, delivered.get(destination, 0))
+            except Exception:
+                if semaphore is not None:
+                    semaphore.release()
+                raise
+            if semaphore is not None:
+                future.add_done_callback(lambda _: semaphore.release())
+            futures[destination] = future
+        return {destination: future.result() for destination, future in futures.items()}
+
+    @staticmethod
+    def is_retryable(exc: Exception) -> bool:
+        """
+        Exceptions that make alerter tasks to be retried or rescheduled (see `RetryableException`).
+        """
+        # noinspection PyPackageRequirements
+        from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+        from datadope_alerta.plugins import RetryableException
+        from datadope_alerta.plugins.rate_limiter import RateLimitedException
+        return isinstance(exc, (RateLimitedException, RetryableException, ConnectionError,
+                                RequestsConnectionError, RequestsTimeout))
+
+    @classmethod
+    def to_response(cls, results: Dict[str, DeliveryResult]) -> Tuple[bool, Dict[str, Dict[str, Any]]]:
+        """
+        Aggregates the results of the destinations in an alerter response.
+
+        If all the destinations failed, the exception of the first one is raised, so the task applies its
+        retry policy. If only some of them failed, the exception of a failed destination is raised only if it is
+        retryable (or the destination is rate limited) and the progress of all the destinations has been stored,
+        so the task is retried or rescheduled delivering only the pending destinations and parts. Exceptions
+        consuming retries are preferred over rate limit ones, so the retries of the task are always limited.
+        Otherwise, the operation fails without retrying, so successful destinations don't receive the
+        notification again.
+
+        :return: success flag and a dict with the number of parts delivered or the error of each destination
+        """
+        from datadope_alerta.plugins.rate_limiter import RateLimitedException
+        failed = [x for x in results.values() if not x.success]
+        if failed:
+            pending = sorted((x for x in failed if cls.is_retryable(x.exception)),
+                             key=lambda x: isinstance(x.exception, RateLimitedException))
+            if len(failed) == len(results):
+                raise (pending or failed)[0].exception
+            if pending and all(x.tracked for x in results.values()):
+                raise pending[0].exception
+        response = {destination: {'delivered': result.delivered} if result.success
+                    else {'delivered': result.delivered, 'error': str(result.exception)}
+                    for destination, result in results.items()}
+        return not failed, response
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import logging
+import uuid
+from typing import Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIGEST_TEMPLATE = "{{ alerter_name }}/digest.j2"
+
+DEFAULT_DIGEST_MESSAGE = "{{ alerts|length }} NEW PROBLEMS RECEIVED" \
+                         "{% for alert in alerts %}" \
+                         "\n- [{{ alert.severity }}] {{ alert.event }} in resource {{ alert.resource }}" \
+                         "{% endfor %}"
+
+
+class DigestBuffer:
+    """
+    Buffers in redis the notifications of new alerts for the same destination during a time window,
+    so they are sent together as only one digest message.
+
+    Each destination has a list with the buffered alerts and the id of the digest being built. The first alert
+    buffered for a destination creates the digest and the caller must schedule the flush of the digest
+    at the end of the window. Flushing the digest takes the buffered alerts atomically, so alerts buffered after
+    that belong to a new digest.
+    """
+    KEY_PREFIX = 'alerta:digest:'
+
+    def __init__(self, client, window: float, template: str = DEFAULT_DIGEST_TEMPLATE):
+        """
+        :param client: redis client
+        :param window: seconds to buffer alerts before sending the digest
+        :param template: path of the template to render the digest message
+        """
+        self.client = client
+        self.window = window
+        self.template = template
+        # Keys expire if the digest is not flushed (flush task lost)
+        self.ttl = int(window) * 10 + 3600
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> Optional['DigestBuffer']:
+        """
+        Creates a digest buffer from the `digest` entry of an alerter configuration:
+        {"window": <seconds>, "template": <template path>}
+
+        :return: the digest buffer or None if digest mode is not configured
+        """
+        if not config or not config.get('window'):
+            return None
+        from datadope_alerta import get_redis_client
+        return cls(get_redis_client(), float(config['window']), config.get('template') or DEFAULT_DIGEST_TEMPLATE)
+
+    def _keys(self, alerter_name: str, destination: str) -> Tuple[str, str]:
+        # Destinations may be long (email recipients), so they are not used as key
+        key = f"{self.KEY_PREFIX}{alerter_name}:{hashlib.sha1(destination.encode('utf-8')).hexdigest()}"
+        return f"{key}:id", f"{key}:alerts"
+
+    def add(self, alerter_name: str, destination: str, entry: dict) -> Tuple[str, bool]:
+        """
+        Adds an alert to the digest of the destination.
+
+        :return: tuple with the id of the digest and a boolean indicating if the digest has been created
+            with this alert (so its flush must be scheduled)
+        :raise RedisError: if the alert cannot be buffered
+        """
+        id_key, alerts_key = self._keys(alerter_name, destination)
+        pipeline = self.client.pipeline()
+        pipeline.set(id_key, str(uuid.uuid4()), nx=True, ex=self.ttl)
+        pipeline.get(id_key)
+        pipeline.rpush(alerts_key, json.dumps(entry))
+        pipeline.expire(alerts_key, self.ttl)
+        created, digest_id, _, _ = pipeline.execute()
+        return digest_id, bool(created)
+
+    def take(self, alerter_name: str, destination: str) -> Tuple[Optional[str], List[dict]]:
+        """
+        Removes the digest of the destination returning its buffered alerts.
+
+        :return: tuple with the id of the digest and the list of alerts
+        """
+        id_key, alerts_key = self._keys(alerter_name, destination)
+        pipeline = self.client.pipeline()
+        pipeline.get(id_key)
+        pipeline.lrange(alerts_key, 0, -1)
+        pipeline.delete(id_key, alerts_key)
+        digest_id, entries, _ = pipeline.execute()
+        return digest_id, [json.loads(x) for x in entries]
+
+    @staticmethod
+    def entry_for_alert(alert) -> dict:
+        return {
+            'id': alert.id,
+            'resource': alert.resource,
+            'event': alert.event,
+            'environment': alert.environment,
+            'severity': alert.severity,
+            'service': alert.service,
+            'group': alert.group,
+            'value': alert.value,
+            'text': alert.text,
+            'createTime': alert.create_time.isoformat() if alert.create_time else None
+        }
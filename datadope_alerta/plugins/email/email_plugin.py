@@ -138,11 +138,20 @@ class EMailAlerter(Alerter):
         if dry_run:
             logger.debug("BODY: %s", body)
             return True, {RETURN_KEY_EMAILS: "0/0", "DRY-RUN": True}
-        response = send_email(smtp_server=host, smtp_port=port,
-                              smtp_login_user=user, smtp_login_password=password,
-                              from_=sender, to=to, subject=subject, body=body, body_content_type=content_type,
-                              files=files, tls_mode=tls_mode, cert_file=cert_file, key_file=key_file,
-                              local_hostname=local_hostname)
+        if not files:
+            digest_id = self.add_to_digest(alert, operation,
+                                           f"smtp:{host}:{port}:{sender}:{','.join(sorted(to))}",
+                                           {'sender': sender, 'to': to})
+            if digest_id:
+                return True, {RETURN_KEY_EMAILS: f"0/{len(to)}", 'digest': digest_id}
+        destination = f"smtp:{host}:{port}"
+        with self.destination_circuit(destination):
+            self.acquire_rate_limit(destination)
+            response = send_email(smtp_server=host, smtp_port=port,
+                                  smtp_login_user=user, smtp_login_password=password,
+                                  from_=sender, to=to, subject=subject, body=body, body_content_type=content_type,
+                                  files=files, tls_mode=tls_mode, cert_file=cert_file, key_file=key_file,
+                                  local_hostname=local_hostname)
         if response:
             logger.warning("EMAILS SENT PARTIALLY: %d OF %d EMAIL ADDRESSES WERE WRONG", len(response), len(to))
             sent = len(to) - len(response)
@@ -151,6 +160,30 @@ class EMailAlerter(Alerter):
             sent = len(to)
         return True, {RETURN_KEY_EMAILS: f"{sent}/{len(to)}"}
 
+    def send_digest(self, digest_id, alerts, destination_data):
+        server_config = self.config[CONFIG_KEY_SERVER]
+        host = server_config[CONFIG_KEY_SERVER_HOST]
+        port = server_config.get(CONFIG_KEY_SERVER_PORT, CONFIG_DEFAULT_SERVER_PORT)
+        to = destination_data['to']
+        body = self.render_digest(digest_id, alerts)
+        subject = body.strip().split('\n')[0]
+        logger.info("SENDING DIGEST USING SERVER `%s:%d' WITH %d ALERTS TO %d EMAIL ADDRESSES",
+                    host, port, len(alerts), len(to))
+        destination = f"smtp:{host}:{port}"
+        with self.destination_circuit(destination):
+            self.acquire_rate_limit(destination)
+            response = send_email(smtp_server=host, smtp_port=port,
+                                  smtp_login_user=server_config.get(CONFIG_KEY_SERVER_USER),
+                                  smtp_login_password=server_config.get(CONFIG_KEY_SERVER_PASSWORD),
+                                  from_=destination_data['sender'], to=to, subject=subject, body=body,
+                                  body_content_type='text/plain',
+                                  tls_mode=server_config.get(CONFIG_KEY_SERVER_USE_TLS),
+                                  cert_file=server_config.get(CONFIG_KEY_SERVER_CERT_FILE),
+                                  key_file=server_config.get(CONFIG_KEY_SERVER_KEY_FILE),
+                                  local_hostname=server_config.get(CONFIG_KEY_SERVER_LOCAL_HOSTNAME))
+        if response:
+            logger.warning("DIGEST SENT PARTIALLY: %d OF %d EMAIL ADDRESSES WERE WRONG", len(response), len(to))
+
     @classmethod
     def get_default_configuration(cls) -> dict:
         return {
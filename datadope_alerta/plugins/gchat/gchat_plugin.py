@@ -1,5 +1,6 @@
 import os
 import re
+from functools import partial
 from typing import Optional, Tuple, Dict, Any
 import requests
 # noinspection PyPackageRequirements
@@ -7,8 +8,9 @@ import yaml
 
 from alerta.models.alert import Alert
 from datadope_alerta import get_config, VarDefinition, ConfigurationContext
-from datadope_alerta.plugins import getLogger
+from datadope_alerta.plugins import getLogger, RetryableException, DeliveryPool
 from datadope_alerta.plugins.iom_plugin import Alerter, IOMAlerterPlugin
+from datadope_alerta.plugins.rate_limiter import raise_for_rate_limit
 
 CONFIG_FILE_KEY = 'GCHAT_CONFIG_FILE'  # noqa
 DEFAULT_CONFIG_FILE = 'config.yaml'
@@ -69,9 +71,18 @@ class GChatAlerter(Alerter):
         event_time = alert.create_time.strftime('%d/%m/%Y, %H:%M:%S')
 
         chats_list, _ = self.get_contextual_configuration(VarDefinition('GCHAT'), alert, operation)
-        response = None
         try:
             chats_list = self._get_gchat_chats(chats_list)
+            digests = {}
+            for chat_url in list(chats_list):
+                # Chat url is not included in digests. It is resolved again when the digest is sent
+                space = self._get_chat_space(chat_url)
+                digest_id = self.add_to_digest(alert, operation, f"gchat:{space}", {'space': space})
+                if digest_id:
+                    digests[space] = digest_id
+                    chats_list.discard(chat_url)
+            if digests and not chats_list:
+                return True, {'digests': digests}
             message_icons = self._config['message_icons']
             template = self._config['cards_template']
             message_text = self.get_message(alert, operation, reason)
@@ -80,18 +91,53 @@ class GChatAlerter(Alerter):
                                               event_time=event_time, event_title=event_title,
                                               event_subtitle=event_subtitle, message_text=message_text)
             if chats_list and event_message:
-                for idy, chat_url in enumerate(chats_list):
-                    response = self._send_message_to_gchat(chat_url, event_message)
-                    if response and response.status_code in (200, 201):
-                        logger.info("GChat %s notified successfully", str(chat_url))
-                    else:
-                        logger.warning("Could not notify GChat: %s", str(chat_url))
+                deliveries = {self._get_chat_space(chat_url): [partial(self._deliver, chat_url, event_message)]
+                              for chat_url in chats_list}
+                results = self.deliver(deliveries)
+                success, _ = DeliveryPool.to_response(results)
+                # Chats answering with a client error are not notified, but they are not retried
+                success = success and all(x in (200, 201) for result in results.values() for x in result.responses)
+                return success, {'digests': digests} if digests else {}
             else:
                 logger.warning("Could not notify any chat, no chats provided")
         except Exception as e:
             logger.exception("UNHANDLED EXCEPTION: %s", str(e))
             raise
-        return (True, {}) if (response and response.status_code in (200, 201)) else (False, {})
+        return False, {}
+
+    def send_digest(self, digest_id, alerts, destination_data):
+        chat_url = None
+        for alert in self.find_digest_alerts(alerts):
+            chats_list, _ = self.get_contextual_configuration(VarDefinition('GCHAT'), alert,
+                                                              Alerter.process_event.__name__)
+            chat_url = next((x for x in self._get_gchat_chats(chats_list)
+                             if self._get_chat_space(x) == destination_data['space']), None)
+            if chat_url:
+                break
+        if not chat_url:
+            raise ValueError(f"Chat url of digest '{digest_id}' not available")
+        status_code = self._deliver(chat_url, {'text': self.render_digest(digest_id, alerts)})
+        if status_code not in (200, 201):
+            raise ValueError(f"Error notifying GChat. Response status: {status_code}")
+
+    def _deliver(self, chat_url, message):
+        destination = f"gchat:{chat_url}"
+        with self.destination_circuit(destination):
+            self.acquire_rate_limit(destination)
+            response = self._send_message_to_gchat(chat_url, message)
+            raise_for_rate_limit(response, destination)
+            if response.status_code not in (200, 201):
+                logger.warning("Could not notify GChat: %s", self._get_chat_space(chat_url))
+                if response.status_code >= 500:
+                    raise RetryableException(f"Error notifying GChat. Response status: {response.status_code}")
+                return response.status_code
+        logger.info("GChat %s notified successfully", self._get_chat_space(chat_url))
+        return response.status_code
+
+    @staticmethod
+    def _get_chat_space(chat_url):
+        # Chat url includes the webhook key and token
+        return chat_url.split('?', 1)[0]
 
     @staticmethod
     def _get_gchat_chats(gchat_tag):
@@ -1,3 +1,4 @@
+import json
 import logging
 import random
 from abc import ABC, abstractmethod
@@ -5,16 +6,25 @@ from collections import defaultdict
 from datetime import datetime
 from typing import Any, Dict, Optional, Type, List, Tuple, Callable
 
+# noinspection PyPackageRequirements
+from celery.utils import uuid
+from flask import g, has_app_context, appcontext_tearing_down
+
 from alerta.models.alert import Alert
 from alerta.models.enums import Status, Action
 from alerta.plugins import PluginBase
 
-from datadope_alerta import DateTime, get_config, thread_local, AlertIdFilter, ALERTERS_KEY_BY_OPERATION
+from datadope_alerta import DateTime, get_config, thread_local, AlertIdFilter, ALERTERS_KEY_BY_OPERATION, \
+    CONFIG_ALERTERS_TASK_FAN_OUT, DEFAULT_ALERTERS_TASK_FAN_OUT
 from datadope_alerta import BGTaskAlerterDataConstants as BGTadC
 # noinspection PyPep8Naming
 from datadope_alerta import ContextualConfiguration as CC, GlobalAttributes as GAttr
-from . import Alerter, AlerterStatus, AlerterOperationData
+from datadope_alerta.backend.flexiblededup.models.alert_snapshot import AlertSnapshot
+from . import Alerter, AlerterStatus, AlerterOperationData, AlerterRegistry, getLogger
+from .priority_lanes import PriorityLanes
+
 
+logger = getLogger(__name__)
 
 _alert_task_by_operation = {}
 
@@ -32,12 +42,192 @@ def get_alert_task_by_operation(operation):
     return _alert_task_by_operation[operation]
 
 
+def get_fan_out_task():
+    from datadope_alerta.bgtasks import fan_out_task
+    return fan_out_task
+
+
+def apply_delayed(task_instance, **options):
+    from datadope_alerta.bgtasks.delayed import DelayedScheduler
+    return DelayedScheduler.apply_async(task_instance, **options)
+
+
 def revoke_task(task_id):
     from datadope_alerta.bgtasks import revoke_task
     revoke_task(task_id)
 
 
+class _PendingAlerterTask:
+
+    def __init__(self, plugin: 'IOMAlerterPlugin', alert: Alert, alerter_operation_data: AlerterOperationData,
+                 operation, begin, task_instance, task_id, task_kwargs, countdown, task_specification,
+                 include_traceback):
+        self.plugin = plugin
+        self.alert = alert
+        self.alerter_operation_data = alerter_operation_data
+        self.operation = operation
+        self.begin = begin
+        self.task_instance = task_instance
+        self.task_id = task_id
+        self.task_kwargs = task_kwargs
+        self.countdown = countdown
+        self.task_specification = task_specification
+        self.include_traceback = include_traceback
+
+    @property
+    def delivery_info(self):
+        queue = self.task_specification.get('queue')
+        if not queue:
+            return {}
+        return {'exchange': '', 'routing_key': queue, 'priority': self.task_specification.get('priority')}
+
+    def as_fan_out_member(self):
+        return {
+            'task_id': self.task_id,
+            # Snapshot of the alert is sent only once in fan-out task kwargs
+            'kwargs': {x: y for x, y in self.task_kwargs.items() if x != 'alert_snapshot'},
+            'properties': {
+                'include_traceback': self.include_traceback,
+                'retry_spec': self.task_specification.get('retry_spec'),
+                'lane': self.task_specification.get('lane')
+            },
+            'delivery_info': self.delivery_info
+        }
+
+
+class AlerterTasksDispatch:
+    """
+    Collects the background tasks that alerter plugins schedule while an alert is processed, so the tasks
+    of the alerters that share operation, task specification and delay are sent as one fan-out task.
+
+    Alerter plugins only use the dispatch if it has been opened in the current application context.
+    If not, each alerter schedules its own task.
+
+    Alerters status is stored as scheduled with the id of the pending task, so the dispatch is also flushed when
+    the application context ends, in case the dispatch plugin was not executed because alert processing was
+    aborted.
+    """
+    _G_KEY = 'iom_alerter_tasks_dispatch'
+
+    def __init__(self):
+        self._groups: Dict[tuple, List[_PendingAlerterTask]] = {}
+
+    @staticmethod
+    def is_enabled(config=None) -> bool:
+        return get_config(CONFIG_ALERTERS_TASK_FAN_OUT, DEFAULT_ALERTERS_TASK_FAN_OUT, type=bool, config=config)
+
+    @classmethod
+    def current(cls) -> Optional['AlerterTasksDispatch']:
+        if not has_app_context():
+            return None
+        return g.get(cls._G_KEY)
+
+    @classmethod
+    def open(cls) -> 'AlerterTasksDispatch':
+        """
+        Opens a dispatch in the current application context or returns the one already opened.
+        """
+        dispatch = cls.current()
+        if dispatch is None:
+            dispatch = cls()
+            setattr(g, cls._G_KEY, dispatch)
+        return dispatch
+
+    @classmethod
+    def flush(cls):
+        """
+        Closes the dispatch opened in the current application context, sending its pending tasks.
+        """
+        if has_app_context():
+            dispatch = g.pop(cls._G_KEY, None)
+            if dispatch is not None:
+                dispatch.dispatch()
+
+    @classmethod
+    def on_app_context_teardown(cls, _sender, **_):
+        dispatch = g.get(cls._G_KEY)
+        if dispatch is not None and dispatch._groups:
+            logger.warning("Alert processing finished without dispatching alerters tasks. Dispatching them now")
+        cls.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+    def add(self, pending_task: _PendingAlerterTask, delay):
+        key = (pending_task.task_instance.name,
+               json.dumps(pending_task.task_specification, sort_keys=True, default=str),
+               round(delay))
+        self._groups.setdefault(key, []).append(pending_task)
+
+    def dispatch(self):
+        groups, self._groups = self._groups, {}
+        for pending_tasks in groups.values():
+            first = pending_tasks[0]
+            try:
+                if len(pending_tasks) == 1:
+                    apply_delayed(
+                        first.task_instance, kwargs=first.task_kwargs, countdown=round(first.countdown),
+                        task_id=first.task_id, **first.task_specification, include_traceback=first.include_traceback)
+                else:
+                    task_specification = {x: y for x, y in first.task_specification.items() if x != 'retry_spec'}
+                    task = apply_delayed(
+                        get_fan_out_task(),
+                        kwargs=dict(task_name=first.task_instance.name, alert_id=first.alert.id,
+                                    members=[x.as_fan_out_member() for x in pending_tasks],
+                                    alert_snapshot=first.task_kwargs.get('alert_snapshot')),
+                        countdown=round(first.countdown), **task_specification)
+                    logger.info("Scheduled fan-out task '%s' for alerters %s to run in %.0f seconds in queue '%s'",
+                                task.id, ', '.join(x.plugin.alerter_name for x in pending_tasks),
+                                first.countdown, task_specification.get('queue', '<default>'))
+            except Exception as e:
+                for pending_task in pending_tasks:
+                    pending_task.plugin.register_scheduling_error(
+                        pending_task.alert, pending_task.alerter_operation_data, pending_task.operation,
+                        pending_task.begin, e, pending_task.include_traceback)
+
+
+appcontext_tearing_down.connect(AlerterTasksDispatch.on_app_context_teardown, weak=False)
+
+
+class AlerterTasksDispatchPlugin(PluginBase):
+    """
+    Plugin added by routing after the alerter plugins when alerters task fan-out is enabled.
+    Sends the background tasks collected while executing the alerter plugins.
+    """
+
+    def __init__(self, name='alerters_dispatch'):
+        super().__init__(name)
+
+    def pre_receive(self, alert: Alert, **kwargs) -> Alert:
+        AlerterTasksDispatch.flush()
+        return alert
+
+    def post_receive(self, alert: Alert, **kwargs) -> Optional[Alert]:
+        AlerterTasksDispatch.flush()
+        return None
+
+    def status_change(self, alert: Alert, status, text: str, **kwargs) -> Any:
+        AlerterTasksDispatch.flush()
+        return None
+
+    def take_action(self, alert: Alert, action: str, text: str, **kwargs) -> Any:
+        AlerterTasksDispatch.flush()
+        return None
+
+    def take_note(self, alert: Alert, text: Optional[str], **kwargs) -> Any:
+        AlerterTasksDispatch.flush()
+        return None
+
+    def delete(self, alert: Alert, **kwargs) -> bool:
+        AlerterTasksDispatch.flush()
+        return True
+
+
 class IOMAlerterPlugin(PluginBase, ABC):
+    STATUS_TRANSITION_ATTEMPTS = 5
 
     def __init__(self, name=None):
         name = name or self.__module__.rsplit('.', 1)[-1]
@@ -97,12 +287,32 @@ class IOMAlerterPlugin(PluginBase, ABC):
     def get_alerter_status_for_alert(self, alert):
         return AlerterStatus.from_db(alert_id=alert.id, alerter_name=self.alerter_name)
 
+    def _compare_and_set_status(self, alert, expected_status: AlerterStatus, new_status: AlerterStatus,
+                                alerter_operation_data: AlerterOperationData,
+                                chain_operation_data: Optional[AlerterOperationData] = None) \
+            -> Tuple[bool, AlerterStatus]:
+        applied, current_status = AlerterStatus.compare_and_set(alert.id, self.alerter_name, expected_status,
+                                                                new_status, alerter_operation_data,
+                                                                chain_operation_data)
+        if not applied:
+            self.logger.info("Alerter status changed concurrently from '%s' to '%s'. Reevaluating",
+                             expected_status.value, current_status.value)
+        return applied, current_status
+
     def has_alerting_succeeded(self, alert):
         return AlerterOperationData.has_alerting_succeeded(alert.id, self.alerter_name)
 
     def get_task_specification(self, alert, operation):
-        return defaultdict(dict, CC.get_contextual_global_config(CC.TASKS_DEFINITION, alert, self,
-                                                                 operation=operation)[0])
+        task_specification = defaultdict(dict, CC.get_contextual_global_config(CC.TASKS_DEFINITION, alert, self,
+                                                                               operation=operation)[0])
+        # Queue and priority of the operation are replaced by the ones of the priority lane of the alert, if any
+        priority_lanes = PriorityLanes.from_config(self.global_app_config)
+        if priority_lanes:
+            lane = priority_lanes.select(alert, ALERTERS_KEY_BY_OPERATION[operation])
+            if lane:
+                PriorityLanes.apply(task_specification, lane,
+                                    self.global_app_config.get('CELERY_DEFAULT_QUEUE') or 'alert')
+        return task_specification
 
     def get_processing_delay(self, alert, operation):
         now = datetime.utcnow()
@@ -130,7 +340,7 @@ class IOMAlerterPlugin(PluginBase, ABC):
             new_status = new_event_status
             operation = Alerter.process_event.__name__
             delay = self.get_processing_delay(alert, operation)
-        delay = max(5.0, delay) + random.uniform(-2.0, 5.0)
+        delay = max(5.0, delay)
         alerter_operation_data.received_time = begin
         reason = reason or CC.get_contextual_global_config(CC.REASON, alert, self, operation)[0]
         alerter_operation_data.reason = reason
@@ -249,7 +459,10 @@ class IOMAlerterPlugin(PluginBase, ABC):
             post_receive_data = self._prepare_post_receive(alert, AlerterStatus.Scheduled, kwargs)
             if post_receive_data:
                 alerter_operation_data, status, begin, delay, operation, reason = post_receive_data
-                delay = 2 if kwargs.get('ignore_delay', False) else delay
+                if kwargs.get('ignore_delay', False):
+                    delay = countdown = 2
+                else:
+                    countdown = delay + random.uniform(-2.0, 5.0)
             else:
                 return None
 
@@ -258,28 +471,59 @@ class IOMAlerterPlugin(PluginBase, ABC):
             try:
                 task_specification = self.get_task_specification(alert, operation)
                 task_instance = get_alert_task_by_operation(operation)
-                task = task_instance.apply_async(
-                    kwargs=dict(alerter_data=self.alerter_data, alert_id=alert.id, reason=reason,
-                                action=kwargs.get('force_action')),
-                    countdown=round(delay), **task_specification, include_traceback=store_traceback)
-                self.logger.info("Scheduled task '%s' to run in %.0f seconds in queue '%s'",
-                                 task.id, delay, task_specification.get('queue', '<default>'))
-                alerter_operation_data.bg_task_id = task.id
+                task_kwargs = dict(alerter_data=self.alerter_data, alert_id=alert.id, reason=reason,
+                                   action=kwargs.get('force_action'),
+                                   alert_snapshot=AlertSnapshot.for_task(alert, config=self.global_app_config))
+                dispatch = AlerterTasksDispatch.current()
+                if dispatch is None:
+                    task = apply_delayed(task_instance, kwargs=task_kwargs, countdown=round(countdown),
+                                         **task_specification, include_traceback=store_traceback)
+                    task_id = task.id
+                    self.logger.info("Scheduled task '%s' to run in %.0f seconds in queue '%s'",
+                                     task_id, countdown, task_specification.get('queue', '<default>'))
+                else:
+                    task_id = uuid()
+                    dispatch.add(_PendingAlerterTask(self, alert, alerter_operation_data, operation, begin,
+                                                     task_instance, task_id, task_kwargs, countdown,
+                                                     dict(task_specification), store_traceback),
+                                 delay)
+                    self.logger.info("Task '%s' pending to be dispatched to run in %.0f seconds in queue '%s'",
+                                     task_id, countdown, task_specification.get('queue', '<default>'))
+                alerter_operation_data.bg_task_id = task_id
             except Exception as e:
-                self.logger.error("Error executing post_receive: %s", e, exc_info=e)
-                now = datetime.utcnow()
-                retval = False, Alerter.result_for_exception(e, include_traceback=store_traceback)
-                status = AlerterStatus.Recovered if operation == Alerter.process_recovery.__name__ \
-                    else AlerterStatus.Processed
-                alerter_operation_data = Alerter.prepare_result(alerter_operation_data, retval, begin, now)
+                status, alerter_operation_data = self._prepare_scheduling_error(
+                    alerter_operation_data, operation, begin, e, store_traceback)
 
-            AlerterStatus.store(alert.id, self.alerter_name, status)
-            alerter_operation_data.store()
+            AlerterStatus.transition(alert.id, self.alerter_name, status, alerter_operation_data)
             return alert
         finally:
             thread_local.alerter_name = None
             thread_local.operation = None
 
+    def _prepare_scheduling_error(self, alerter_operation_data: AlerterOperationData, operation, begin, exc,
+                                  include_traceback) -> Tuple[AlerterStatus, AlerterOperationData]:
+        self.logger.error("Error executing post_receive: %s", exc, exc_info=exc)
+        now = datetime.utcnow()
+        retval = False, Alerter.result_for_exception(exc, include_traceback=include_traceback)
+        status = AlerterStatus.Recovered if operation == Alerter.process_recovery.__name__ \
+            else AlerterStatus.Processed
+        return status, Alerter.prepare_result(alerter_operation_data, retval, begin, now)
+
+    def register_scheduling_error(self, alert: Alert, alerter_operation_data: AlerterOperationData, operation,
+                                  begin, exc, include_traceback):
+        """
+        Stores the result of an operation whose background task could not be scheduled
+        after the alerter status was already updated.
+        """
+        thread_local.alert_id = alert.id
+        thread_local.alerter_name = self.alerter_name
+        try:
+            status, alerter_operation_data = self._prepare_scheduling_error(
+                alerter_operation_data, operation, begin, exc, include_traceback)
+            AlerterStatus.transition(alert.id, self.alerter_name, status, alerter_operation_data)
+        finally:
+            thread_local.alerter_name = None
+
     def status_change(self, alert: Alert, status, text: str, **kwargs) -> Any:
         thread_local.alert_id = alert.id
         thread_local.alerter_name = self.alerter_name
@@ -297,78 +541,92 @@ class IOMAlerterPlugin(PluginBase, ABC):
                 operation_key = ALERTERS_KEY_BY_OPERATION[operation]
                 thread_local.operation = operation_key
                 start_time = datetime.utcnow()
-                alerter_operation_data = AlerterOperationData.from_db(alert.id, self.alerter_name, operation_key)
                 ignore_recovery, level = CC.get_contextual_global_config(CC.IGNORE_RECOVERY, alert, self)
-                if alerter_status == AlerterStatus.Scheduled:
-                    alerter_operation_data_new = AlerterOperationData.from_db(
-                        alert.id, self.alerter_name, ALERTERS_KEY_BY_OPERATION[Alerter.process_event.__name__])
-                    bgtask_id = alerter_operation_data_new.bg_task_id
-                    if bgtask_id:
-                        revoke_task(bgtask_id)
-                        self.logger.info("Status changed to closed while waiting to alert. Revoking alert task %s.",
-                                         bgtask_id)
-                    else:
-                        self.logger.warning("BGTASK ID NOT FOUND")
-                    result_data = {"info": {"message": "RECOVERED BEFORE ALERTING"}}
-                    new_alerter_status = AlerterStatus.Recovered
-                    self._prepare_recovery_special_result(alerter_operation_data, result_data, start_time)
-                    alerter_operation_data_new.success = True
-                    alerter_operation_data_new.response = result_data
-                    alerter_operation_data_new.skipped = True
-                    AlerterStatus.store(alert.id, self.alerter_name, new_alerter_status)
-                    alerter_operation_data_new.store()
-                    alerter_operation_data.store()
-                    return alert, status, text
-                elif ignore_recovery:
-                    self.logger.info("Ignoring recovery configured with context '%s'", level.value)
-                    result_data = {"info": {"message": "IGNORED RECOVERY"}}
-                    new_alerter_status = AlerterStatus.Recovered
-                    self._prepare_recovery_special_result(alerter_operation_data, result_data, start_time)
-                    AlerterStatus.store(alert.id, self.alerter_name, new_alerter_status)
-                    alerter_operation_data.store()
-                    return alert, status, text
-                elif alerter_status == AlerterStatus.Processed:
-                    alerter_operation_data_new = AlerterOperationData.from_db(
-                        alert.id, self.alerter_name, ALERTERS_KEY_BY_OPERATION[Alerter.process_event.__name__])
-                    success = alerter_operation_data_new.success is True
-                    if success:
-                        self.logger.info("Status changed to closed for an alerted event. Recovering")
-                        return self.post_receive(alert, reason=text, force_recovery=True, **kwargs), status, text
-                    else:
-                        self.logger.info("Status changed to closed for an event that fails alerting. Ignoring")
-                        result_data = {"info": {"message": "RECOVERED AN ALERT WITH ERROR IN THE ALERTING"}}
+                for _ in range(self.STATUS_TRANSITION_ATTEMPTS):
+                    alerter_operation_data = AlerterOperationData.from_db(alert.id, self.alerter_name, operation_key)
+                    if alerter_status == AlerterStatus.Scheduled:
+                        alerter_operation_data_new = AlerterOperationData.from_db(
+                            alert.id, self.alerter_name, ALERTERS_KEY_BY_OPERATION[Alerter.process_event.__name__])
+                        result_data = {"info": {"message": "RECOVERED BEFORE ALERTING"}}
                         new_alerter_status = AlerterStatus.Recovered
                         self._prepare_recovery_special_result(alerter_operation_data, result_data, start_time)
-                        AlerterStatus.store(alert.id, self.alerter_name, new_alerter_status)
-                        alerter_operation_data.store()
+                        applied, alerter_status = self._compare_and_set_status(
+                            alert, alerter_status, new_alerter_status, alerter_operation_data)
+                        if not applied:
+                            continue
+                        # Task is only revoked once it is known that it has not started processing
+                        bgtask_id = alerter_operation_data_new.bg_task_id
+                        if bgtask_id:
+                            revoke_task(bgtask_id)
+                            self.logger.info("Status changed to closed while waiting to alert. "
+                                             "Revoking alert task %s.", bgtask_id)
+                        else:
+                            self.logger.warning("BGTASK ID NOT FOUND")
+                        alerter_operation_data_new.success = True
+                        alerter_operation_data_new.response = result_data
+                        alerter_operation_data_new.skipped = True
+                        alerter_operation_data_new.store()
                         return alert, status, text
-                elif alerter_status in (AlerterStatus.Processing, AlerterStatus.Repeating, AlerterStatus.Actioning):
-                    # Alert will be recovered in the processing task after finish of processing.
-                    # If processing finishes ok, or it is a repeating task
-                    # the recovery will be launched at the end of the task.
-                    # If processing finishes nok or is going to retry,
-                    # the recovery will be ignored as alert is supposed to not being notified
-                    self.logger.info("Status changed to closed while processing alerting, repeating or action."
-                                     " Recovering after finish processing.")
-                    alerter_operation_data_pre = AlerterOperationData.last_executing_operation(
-                        alert_id=alert.id, alerter=self.alerter_name)
-                    new_alerter_status, _, _ = self._prepare_begin_processing(
-                        alert, alerter_operation_data, is_recovering=True, is_actioning=False, is_repeating=False,
-                        new_event_status=AlerterStatus.Scheduled, reason=text)
-                    task_definition = self.get_task_specification(alert, Alerter.process_recovery.__name__)
-                    alerter_operation_data_pre.task_chain_info = {
-                        AlerterOperationData.FIELD_TASK_CHAIN_INFO_TASK_DEF: task_definition,
-                        AlerterOperationData.FIELD_TASK_CHAIN_INFO_TEXT: text
-                    }
-                    AlerterStatus.store(alert.id, self.alerter_name, new_alerter_status)
-                    alerter_operation_data_pre.store()
-                    alerter_operation_data.store()
-                    return alert, status, text
-                elif alerter_status in (AlerterStatus.Recovered, AlerterStatus.Recovering):
-                    self.logger.debug("Status changed to closed for an already recovered event. Ignoring.")
-                    return None
-                else:
-                    return None
+                    elif ignore_recovery:
+                        self.logger.info("Ignoring recovery configured with context '%s'", level.value)
+                        result_data = {"info": {"message": "IGNORED RECOVERY"}}
+                        new_alerter_status = AlerterStatus.Recovered
+                        self._prepare_recovery_special_result(alerter_operation_data, result_data, start_time)
+                        applied, alerter_status = self._compare_and_set_status(
+                            alert, alerter_status, new_alerter_status, alerter_operation_data)
+                        if not applied:
+                            continue
+                        return alert, status, text
+                    elif alerter_status == AlerterStatus.Processed:
+                        alerter_operation_data_new = AlerterOperationData.from_db(
+                            alert.id, self.alerter_name, ALERTERS_KEY_BY_OPERATION[Alerter.process_event.__name__])
+                        success = alerter_operation_data_new.success is True
+                        if success:
+                            self.logger.info("Status changed to closed for an alerted event. Recovering")
+                            return self.post_receive(alert, reason=text, force_recovery=True, **kwargs), status, text
+                        else:
+                            self.logger.info("Status changed to closed for an event that fails alerting. Ignoring")
+                            result_data = {"info": {"message": "RECOVERED AN ALERT WITH ERROR IN THE ALERTING"}}
+                            new_alerter_status = AlerterStatus.Recovered
+                            self._prepare_recovery_special_result(alerter_operation_data, result_data, start_time)
+                            applied, alerter_status = self._compare_and_set_status(
+                                alert, alerter_status, new_alerter_status, alerter_operation_data)
+                            if not applied:
+                                continue
+                            return alert, status, text
+                    elif alerter_status in (AlerterStatus.Processing, AlerterStatus.Repeating,
+                                            AlerterStatus.Actioning):
+                        # Alert will be recovered in the processing task after finish of processing.
+                        # If processing finishes ok, or it is a repeating task
+                        # the recovery will be launched at the end of the task.
+                        # If processing finishes nok or is going to retry,
+                        # the recovery will be ignored as alert is supposed to not being notified
+                        self.logger.info("Status changed to closed while processing alerting, repeating or action."
+                                         " Recovering after finish processing.")
+                        alerter_operation_data_pre = AlerterOperationData.last_executing_operation(
+                            alert_id=alert.id, alerter=self.alerter_name)
+                        new_alerter_status, _, _ = self._prepare_begin_processing(
+                            alert, alerter_operation_data, is_recovering=True, is_actioning=False,
+                            is_repeating=False, new_event_status=AlerterStatus.Scheduled, reason=text)
+                        task_definition = self.get_task_specification(alert, Alerter.process_recovery.__name__)
+                        # Stored with the status, so the running task finds it when it sees the new status
+                        alerter_operation_data_pre.task_chain_info = {
+                            AlerterOperationData.FIELD_TASK_CHAIN_INFO_TASK_DEF: task_definition,
+                            AlerterOperationData.FIELD_TASK_CHAIN_INFO_TEXT: text
+                        }
+                        applied, alerter_status = self._compare_and_set_status(
+                            alert, alerter_status, new_alerter_status, alerter_operation_data,
+                            alerter_operation_data_pre)
+                        if not applied:
+                            continue
+                        return alert, status, text
+                    elif alerter_status in (AlerterStatus.Recovered, AlerterStatus.Recovering):
+                        self.logger.debug("Status changed to closed for an already recovered event. Ignoring.")
+                        return None
+                    else:
+                        return None
+                self.logger.warning("Alerter status is changing concurrently. Ignoring status change")
+                return None
             else:
                 return None
         finally:
@@ -389,56 +647,61 @@ class IOMAlerterPlugin(PluginBase, ABC):
                 operation_key = action
                 thread_local.operation = operation_key
                 start_time = datetime.utcnow()
-                alerter_operation_data = AlerterOperationData.from_db(alert.id, self.alerter_name, operation_key)
-                if alerter_status == AlerterStatus.Scheduled and action == resolve_action:
-                    self.logger.info("Action '%s' while waiting to alert. Closing alert", action)
-                    return alert, Action.CLOSE, text, timeout
-                elif alerter_status in (AlerterStatus.Processed, AlerterStatus.Repeating):
-                    # Repeat and action tasks may be launched in parallel
-                    alerter_operation_data_new = AlerterOperationData.from_db(
-                        alert.id, self.alerter_name, ALERTERS_KEY_BY_OPERATION[Alerter.process_event.__name__])
-                    success = alerter_operation_data_new.success is True
-                    if success:
-                        self.logger.info("Action '%s' for an alerted event. Executing", action)
-                        return self.post_receive(alert, reason=text, force_action=action, **kwargs), \
-                            action, text, timeout
-                    else:
-                        self.logger.info("Action '%s' for an event that fails alerting. Ignoring", action)
-                        result_data = {
-                            "info": {
-                                "message": f"ACTION '{action}' FOR AN ALERT WITH ERROR IN THE ALERTING"
+                for _ in range(self.STATUS_TRANSITION_ATTEMPTS):
+                    alerter_operation_data = AlerterOperationData.from_db(alert.id, self.alerter_name, operation_key)
+                    if alerter_status == AlerterStatus.Scheduled and action == resolve_action:
+                        self.logger.info("Action '%s' while waiting to alert. Closing alert", action)
+                        return alert, Action.CLOSE, text, timeout
+                    elif alerter_status in (AlerterStatus.Processed, AlerterStatus.Repeating):
+                        # Repeat and action tasks may be launched in parallel
+                        alerter_operation_data_new = AlerterOperationData.from_db(
+                            alert.id, self.alerter_name, ALERTERS_KEY_BY_OPERATION[Alerter.process_event.__name__])
+                        success = alerter_operation_data_new.success is True
+                        if success:
+                            self.logger.info("Action '%s' for an alerted event. Executing", action)
+                            return self.post_receive(alert, reason=text, force_action=action, **kwargs), \
+                                action, text, timeout
+                        else:
+                            self.logger.info("Action '%s' for an event that fails alerting. Ignoring", action)
+                            result_data = {
+                                "info": {
+                                    "message": f"ACTION '{action}' FOR AN ALERT WITH ERROR IN THE ALERTING"
+                                }
                             }
+                            self._prepare_recovery_special_result(alerter_operation_data, result_data, start_time)
+                            alerter_operation_data.store()
+                            return alert, action, text, timeout
+                    elif alerter_status in (AlerterStatus.Scheduled, AlerterStatus.Processing):
+                        # ACTION will be executed in the processing task after finish of processing.
+                        # If processing finishes ok, or it is a repeating task
+                        # the recovery will be launched at the end of the task.
+                        # If processing finishes nok or is going to retry,
+                        # the recovery will be ignored as alert is supposed to not being notified
+                        self.logger.info("Action '%s' while processing alerting."
+                                         " Executing after finish processing.", action)
+                        alerter_operation_data.received_time = datetime.utcnow()
+                        alerter_operation_data_pre = AlerterOperationData.from_db(
+                            alert.id, self.alerter_name, ALERTERS_KEY_BY_OPERATION[Alerter.process_event.__name__])
+                        new_alerter_status = AlerterStatus.Actioning
+                        task_definition = self.get_task_specification(alert, Alerter.process_action.__name__)
+                        alerter_operation_data_pre.task_chain_info = {
+                            AlerterOperationData.FIELD_TASK_CHAIN_INFO_TASK_DEF: task_definition,
+                            AlerterOperationData.FIELD_TASK_CHAIN_INFO_TEXT: text,
+                            AlerterOperationData.FIELD_TASK_CHAIN_INFO_ACTION: action
                         }
-                        self._prepare_recovery_special_result(alerter_operation_data, result_data, start_time)
-                        alerter_operation_data.store()
+                        applied, alerter_status = self._compare_and_set_status(
+                            alert, alerter_status, new_alerter_status, alerter_operation_data,
+                            alerter_operation_data_pre)
+                        if not applied:
+                            continue
                         return alert, action, text, timeout
-                elif alerter_status in (AlerterStatus.Scheduled, AlerterStatus.Processing):
-                    # ACTION will be executed in the processing task after finish of processing.
-                    # If processing finishes ok, or it is a repeating task
-                    # the recovery will be launched at the end of the task.
-                    # If processing finishes nok or is going to retry,
-                    # the recovery will be ignored as alert is supposed to not being notified
-                    self.logger.info("Action '%s' while processing alerting."
-                                     " Executing after finish processing.", action)
-                    alerter_operation_data.received_time = datetime.utcnow()
-                    alerter_operation_data_pre = AlerterOperationData.from_db(
-                        alert.id, self.alerter_name, ALERTERS_KEY_BY_OPERATION[Alerter.process_event.__name__])
-                    new_alerter_status = AlerterStatus.Actioning
-                    task_definition = self.get_task_specification(alert, Alerter.process_action.__name__)
-                    alerter_operation_data_pre.task_chain_info = {
-                        AlerterOperationData.FIELD_TASK_CHAIN_INFO_TASK_DEF: task_definition,
-                        AlerterOperationData.FIELD_TASK_CHAIN_INFO_TEXT: text,
-                        AlerterOperationData.FIELD_TASK_CHAIN_INFO_ACTION: action
-                    }
-                    AlerterStatus.store(alert.id, self.alerter_name, new_alerter_status)
-                    alerter_operation_data_pre.store()
-                    alerter_operation_data.store()
-                    return alert, action, text, timeout
-                elif alerter_status in (AlerterStatus.Recovered, AlerterStatus.Recovering):
-                    self.logger.debug("Action '%s' for an already recovered event. Ignoring.", action)
-                    return None
-                else:
-                    return None
+                    elif alerter_status in (AlerterStatus.Recovered, AlerterStatus.Recovering):
+                        self.logger.debug("Action '%s' for an already recovered event. Ignoring.", action)
+                        return None
+                    else:
+                        return None
+                self.logger.warning("Alerter status is changing concurrently. Ignoring action '%s'", action)
+                return None
         finally:
             thread_local.alerter_name = None
             thread_local.operation = None
@@ -477,7 +740,7 @@ class IOMSyncAlerterPlugin(IOMAlerterPlugin, ABC):
             alerter_class = self.alerter_data[BGTadC.CLASS]
             response = {}
             try:
-                alerter = Alerter.get_alerter_type(alerter_class)(self.alerter_name)
+                alerter = AlerterRegistry.get_alerter(alerter_class, self.alerter_name)
                 response = getattr(alerter, operation)(alert, reason)
             except Exception as exc:
                 store_traceback = CC.get_contextual_global_config(CC.STORE_TRACEBACK_ON_EXCEPTION,
@@ -492,8 +755,7 @@ class IOMSyncAlerterPlugin(IOMAlerterPlugin, ABC):
                 self.logger.info("FINISHED IN %.3f sec. RESULT %s -> %s",
                                  (now-begin).total_seconds(),
                                  'SUCCESS' if alerter_operation_data.success else 'FAILURE', response)
-            AlerterStatus.store(alert.id, self.alerter_name, status)
-            alerter_operation_data.store()
+            AlerterStatus.transition(alert.id, self.alerter_name, status, alerter_operation_data)
             return alert
         finally:
             thread_local.alerter_name = None
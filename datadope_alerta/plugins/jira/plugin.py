@@ -13,6 +13,7 @@ from datadope_alerta import NormalizedDictView, get_config, VarDefinition, Conte
     merge, DateTime
 from datadope_alerta.backend.flexiblededup.models.key_value_store import KeyValueParameter
 from datadope_alerta.plugins import Alerter, getLogger, RetryableException
+from datadope_alerta.plugins.rate_limiter import raise_for_rate_limit
 from datadope_alerta.plugins.iom_plugin import IOMAlerterPlugin
 from datadope_alerta.plugins.jira.client import JiraClient, RequestFields
 
@@ -55,6 +56,8 @@ class JiraAlerter(Alerter):
 
     _default_config = None
 
+    reusable = False  # Configuration and client may be read from remote for each alert
+
     def __init__(self, name, bgtask=None):
         super().__init__(name, bgtask)
         config_fields = [NormalizedDictView.key_transform(y) for x, y in vars(ConfigurationFields.DictFields).items()
@@ -234,7 +237,14 @@ class JiraAlerter(Alerter):
             })
             return True, {ResultFields.JIRA_ID: JIRA_ID_NOT_APPLY, ResultFields.REASON: "dry_run"}
         logger.info("Connecting to Jira at: '%s'", self.jira_client.base_url)
-        return self.jira_client.request(**operation_data)
+        destination = f"jira:{self.jira_client.base_url}"
+        with self.destination_circuit(destination) as call:
+            self.acquire_rate_limit(destination)
+            response = self.jira_client.request(**operation_data)
+            raise_for_rate_limit(response, destination)
+            if response.status_code >= 500:
+                call.fail()
+        return response
 
     def _process_update(self, alert, operation, reason, operation_field):
         self.update_config_from_remote(alert)
@@ -0,0 +1,143 @@
+import logging
+from typing import Optional, List, Dict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LANE = 'default'
+
+
+class PriorityLanes:
+    """
+    Selects the priority lane of the background tasks of alerters from the alert being processed.
+
+    Lanes are configured in PRIORITY_LANES as a list of dicts. The first lane matching the alert is selected:
+      * name: name of the lane. Required.
+      * severity: severity or list of severities of the alerts of the lane. Optional.
+      * attributes: dict with the values of alert attributes (a value or a list of values) of the alerts of the
+        lane. All of them must match. Optional.
+      * operations: list of operations (new, recovery, repeat, action) of the lane. Default: all.
+      * queue: queue of the lane. Default: '<queue of the operation>.<name>'.
+      * weight: share of consumption of the queue of the lane when several lanes have tasks (see WeightedLaneCycle).
+        Default: 1.
+
+    Tasks of a lane keep the broker priority of their operation. Lanes cannot define their own priority: broker
+    priorities take precedence over the weights of the queues (see WeightedLaneCycle), so it would defeat them.
+    """
+    # Lanes already warned for defining a priority. Lanes are created for each task, so they are warned only once
+    _ignored_priorities = set()
+
+    def __init__(self, lanes: List[dict]):
+        self.lanes = [x for x in lanes if isinstance(x, dict) and x.get('name')]
+        for lane in self.lanes:
+            if 'priority' in lane and lane['name'] not in self._ignored_priorities:
+                self._ignored_priorities.add(lane['name'])
+                logger.warning("Priority of lane '%s' ignored. Lanes use the priority of the operation",
+                               lane['name'])
+
+    @classmethod
+    def from_config(cls, config=None) -> Optional['PriorityLanes']:
+        from datadope_alerta import get_config, CONFIG_PRIORITY_LANES, DEFAULT_PRIORITY_LANES
+        lanes = get_config(CONFIG_PRIORITY_LANES, DEFAULT_PRIORITY_LANES, type=list, config=config)
+        return cls(lanes) if lanes else None
+
+    @staticmethod
+    def _matches(value, expected) -> bool:
+        if isinstance(expected, (list, tuple, set)):
+            return value in expected
+        return value == expected
+
+    def select(self, alert, operation_key: str) -> Optional[dict]:
+        """
+        Returns the first lane matching the alert and operation or None if no lane matches.
+        """
+        for lane in self.lanes:
+            operations = lane.get('operations')
+            if operations and operation_key not in operations:
+                continue
+            if 'severity' in lane and not self._matches(alert.severity, lane['severity']):
+                continue
+            attributes = lane.get('attributes') or {}
+            if all(self._matches(alert.attributes.get(attr), value) for attr, value in attributes.items()):
+                return lane
+        return None
+
+    @staticmethod
+    def apply(task_specification: dict, lane: dict, default_queue: str):
+        """
+        Updates the queue of the task specification to send the task using the lane.
+        The name of the lane is sent as the message property 'lane'.
+        """
+        queue = task_specification.get('queue') or default_queue
+        task_specification['queue'] = lane.get('queue') or f"{queue}.{lane['name']}"
+        task_specification['lane'] = lane['name']
+
+
+class WeightedLaneCycle:
+    """
+    Queue order strategy for kombu redis transport giving to each lane a share of consumption proportional to
+    its weight, so lower lanes don't starve while higher ones have tasks.
+
+    Each time the worker fetches a message, the queue to try first is chosen using a smooth weighted round-robin
+    between the consumed queues. Remaining queues are tried by descending weight, so no fetch is wasted when the
+    chosen queue is empty. Queues not belonging to a lane have PRIORITY_LANES_DEFAULT_WEIGHT.
+
+    Kombu redis transport fetches from all the queues with the highest priority step before trying the next step
+    (see `priority_steps` of BROKER_TRANSPORT_OPTIONS), using the order returned by this strategy inside each step.
+    So weights only share the consumption between tasks of the same priority step. Tasks with a higher priority
+    (i.e. operations with a higher priority in TASKS_DEFINITION) are always fetched first.
+
+    Configured with:
+    BROKER_TRANSPORT_OPTIONS = {"queue_order_strategy": "datadope_alerta.plugins.priority_lanes:WeightedLaneCycle"}
+    """
+
+    def __init__(self, it=None):
+        self.items = it if it is not None else []
+        self._weights: Optional[Dict[str, float]] = None
+        self._default_weight = 1.0
+        self._current: Dict[str, float] = {}
+
+    def _load_weights(self):
+        # noinspection PyPackageRequirements
+        from celery import current_app
+        from datadope_alerta import get_config, CONFIG_PRIORITY_LANES, DEFAULT_PRIORITY_LANES, \
+            CONFIG_PRIORITY_LANES_DEFAULT_WEIGHT, DEFAULT_PRIORITY_LANES_DEFAULT_WEIGHT
+        self._weights = {}
+        try:
+            config = current_app.conf
+            self._default_weight = get_config(CONFIG_PRIORITY_LANES_DEFAULT_WEIGHT,
+                                              DEFAULT_PRIORITY_LANES_DEFAULT_WEIGHT, type=float, config=config)
+            for lane in get_config(CONFIG_PRIORITY_LANES, DEFAULT_PRIORITY_LANES, type=list, config=config):
+                if isinstance(lane, dict) and lane.get('name'):
+                    self._weights[lane.get('queue') or lane['name']] = float(lane.get('weight', 1.0))
+        except Exception as e:
+            logger.warning("Error reading priority lanes weights. Using same weight for all the queues: %s", e)
+
+    def get_weight(self, queue: str) -> float:
+        if self._weights is None:
+            self._load_weights()
+        weight = self._weights.get(queue)
+        if weight is None:
+            weight = self._weights.get(queue.rpartition('.')[2], self._default_weight)
+        return max(weight, 0.0)
+
+    def update(self, it):
+        self.items[:] = it
+        self._current = {x: y for x, y in self._current.items() if x in self.items}
+
+    def consume(self, n):
+        items = self.items[:n]
+        if len(items) <= 1:
+            return items
+        total = 0.0
+        chosen = None
+        for queue in items:
+            weight = self.get_weight(queue)
+            self._current[queue] = self._current.get(queue, 0.0) + weight
+            total += weight
+            if chosen is None or self._current[queue] > self._current[chosen]:
+                chosen = queue
+        self._current[chosen] -= total
+        return [chosen] + sorted((x for x in items if x != chosen), key=self.get_weight, reverse=True)
+
+    def rotate(self, last_used):
+        """Unused in this implementation."""
@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import time
+from typing import Optional
+
+# noinspection PyPackageRequirements
+from redis import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitedException(Exception):
+    """
+    Raised when an operation cannot be executed now without exceeding the rate limit of its destination.
+
+    Alerters background tasks catching this exception reschedule the task to be executed after retry_after
+    seconds, instead of applying the retry policy of the alerter, up to the max deferrals configured
+    (see must_defer).
+    """
+
+    def __init__(self, destination: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded. Retry after {retry_after:.1f} secs")
+        self.destination = destination
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter shared by all the processes using redis.
+
+    Each destination has its own bucket, stored in a redis hash with the available tokens and the time of the
+    last update. Buckets are refilled with `rate` tokens per second up to `burst` tokens. A token is reserved
+    in the bucket only if it will be available before `max_wait` seconds, so the caller must wait until
+    that moment to use it. If it cannot be reserved, the caller must retry the operation later.
+
+    Any error accessing redis is logged and the operation is not limited.
+    """
+    KEY_PREFIX = 'alerta:rate_limit:'
+
+    # Returns the seconds to wait for the token as a string (redis truncates lua numbers to integers).
+    # If the wait is greater than max_wait, the token is not reserved.
+    SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local max_wait = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil or ts == nil then
+    tokens = burst
+    ts = now
+end
+if now > ts then
+    tokens = math.min(burst, tokens + (now - ts) * rate)
+    ts = now
+end
+local wait = 0
+if tokens < 1 then
+    wait = (1 - tokens) / rate
+end
+if wait <= max_wait then
+    tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(ts))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate + max_wait) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, client, rate: float, burst: int = 1, max_wait: float = 0.0):
+        """
+        :param client: redis client
+        :param rate: tokens added to the buckets per second
+        :param burst: max number of tokens of the buckets
+        :param max_wait: max seconds to wait for a token
+        """
+        if rate <= 0:
+            raise ValueError('Rate limit must be greater than 0')
+        self.client = client
+        self.rate = rate
+        self.burst = max(int(burst), 1)
+        self.max_wait = max(max_wait, 0.0)
+        self._script = client.register_script(self.SCRIPT)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> Optional['RateLimiter']:
+        """
+        Creates a rate limiter from the `rate_limit` entry of an alerter configuration:
+        {"rate": <tokens per second>, "burst": <max tokens>, "max_wait": <max seconds to wait for a token>}
+
+        :return: the rate limiter or None if rate limit is not configured
+        """
+        if not config or not config.get('rate'):
+            return None
+        from datadope_alerta import get_redis_client
+        return cls(get_redis_client(), float(config['rate']), int(config.get('burst', 1)),
+                   float(config.get('max_wait', 0.0)))
+
+    def _key(self, destination: str):
+        # Destinations may include credentials (bot tokens, webhook urls with keys), so they are not used as key
+        return f"{self.KEY_PREFIX}{hashlib.sha1(destination.encode('utf-8')).hexdigest()}"
+
+    def reserve(self, destination: str) -> float:
+        """
+        Tries to reserve a token for the destination.
+
+        :return: seconds to wait until the token can be used. If greater than max_wait, the token
+            has not been reserved.
+        """
+        try:
+            return float(self._script(keys=[self._key(destination)],
+                                      args=[self.rate, self.burst, time.time(), self.max_wait]))
+        except RedisError as e:
+            logger.warning("Error accessing rate limiter. Operation not limited: %s", e)
+            return 0.0
+
+    def acquire(self, destination: str):
+        """
+        Waits until the rate limit of the destination allows a new operation.
+
+        :raise RateLimitedException: if the operation is not allowed before max_wait seconds
+        """
+        wait = self.reserve(destination)
+        if wait > self.max_wait:
+            raise RateLimitedException(destination, wait)
+        if wait > 0:
+            logger.debug("Waiting %.3f secs for rate limit", wait)
+            time.sleep(wait)
+
+
+DEFAULT_RETRY_AFTER = 30.0
+
+
+def must_defer(exc: Exception, deferrals: int) -> bool:
+    """
+    Returns if a task that raised the exception must be rescheduled as a deferral: the exception is a
+    RateLimitedException and the task has been deferred less times than ALERTERS_MAX_DEFERRALS. Otherwise,
+    the exception must be handled as any other error.
+
+    :param exc: exception raised by the task
+    :param deferrals: number of times the task has been deferred
+    """
+    from datadope_alerta import get_config, CONFIG_ALERTERS_MAX_DEFERRALS, DEFAULT_ALERTERS_MAX_DEFERRALS
+    return isinstance(exc, RateLimitedException) \
+        and deferrals < get_config(CONFIG_ALERTERS_MAX_DEFERRALS, DEFAULT_ALERTERS_MAX_DEFERRALS, type=int)
+
+
+def raise_for_rate_limit(response, destination: str, retry_after: Optional[float] = None):
+    """
+    Raises RateLimitedException if the http response is a 429 (Too Many Requests) response.
+
+    :param response: requests response
+    :param destination: destination of the request
+    :param retry_after: seconds to wait provided by the response body, if any. If not provided,
+        the 'Retry-After' header of the response is used.
+    """
+    if response is None or response.status_code != 429:
+        return
+    if retry_after is None:
+        try:
+            retry_after = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = DEFAULT_RETRY_AFTER
+    logger.warning("Rate limit exceeded in destination. Retry after %.1f secs", retry_after)
+    raise RateLimitedException(destination, retry_after)
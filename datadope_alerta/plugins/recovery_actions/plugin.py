@@ -12,6 +12,7 @@ from datadope_alerta import DateTime, NormalizedDictView, ContextualConfiguratio
 from datadope_alerta import GlobalAttributes
 from datadope_alerta import RecoveryActionsFields as RAConfigFields
 from datadope_alerta import get_hierarchical_configuration
+from datadope_alerta.backend.flexiblededup.models.alert_snapshot import AlertSnapshot
 from datadope_alerta.backend.flexiblededup.models.recovery_actions import RecoveryActionsStatus, RecoveryActionData
 from datadope_alerta.plugins import getLogger
 
@@ -141,7 +142,8 @@ class RecoveryActionsPlugin(PluginBase):
                             provider_name=provider,
                             provider_class=provider_class,
                             alerter_plugins={x: f"{y.__module__}:{y.__class__.__name__}"
-                                             for x, y in self.alerter_plugins.items()}),
+                                             for x, y in self.alerter_plugins.items()},
+                            alert_snapshot=AlertSnapshot.for_task(alert, config=app_config)),
                         countdown=countdown, queue=queue, retry_spec={'max_retries': max_retries})
                     recovery_actions_data.bg_task_id = task.id
                     recovery_actions_data.store(create=True)
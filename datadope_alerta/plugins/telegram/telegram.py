@@ -1,11 +1,15 @@
+import hashlib
 import os
+from functools import partial
 from typing import Optional, Tuple, Dict, Any
 
 import requests  # noqa
 import yaml  # noqa
 from alerta.models.alert import Alert
 from datadope_alerta import get_config, logger, VarDefinition
+from datadope_alerta.plugins import DeliveryPool
 from datadope_alerta.plugins.iom_plugin import Alerter, IOMAlerterPlugin
+from datadope_alerta.plugins.rate_limiter import raise_for_rate_limit
 
 TAG_TELEGRAM_BOT = 'TELEGRAM_BOT'
 TAG_TELEGRAM_SOUND = 'TELEGRAM_SOUND'
@@ -60,6 +64,52 @@ class TelegramAlerter(Alerter):
         if not notification_sound:
             notification_sound = 1
 
+        bot_token = self._get_bot_token(alert, operation)
+        if not bot_token:
+            return False, {}
+
+        # Bot token is not included in digests. It is resolved again when the digest is sent
+        bot_id = self._get_bot_id(bot_token)
+        message_sections = None
+        digests = {}
+        deliveries = {}
+        for chat_id in chats_list:
+            digest_id = self.add_to_digest(alert, operation, f"telegram:{bot_id}:{chat_id}",
+                                           {'bot_id': bot_id, 'chat_id': chat_id,
+                                            'notification_sound': notification_sound})
+            if digest_id:
+                digests[chat_id] = digest_id
+                continue
+            if message_sections is None:
+                message_sections = self.split_message(self.get_message(alert, operation, reason),
+                                                      self._config.get('max_message_characters', 4096))
+            deliveries[chat_id] = [partial(self._send_telegram_message, message, bot_token, chat_id,
+                                           notification_sound, trigger_type=operation)
+                                   for message in message_sections]
+
+        response = {'digests': digests} if digests else {}
+        if not deliveries:
+            return True, response
+        success, response['chats'] = DeliveryPool.to_response(self.deliver(deliveries))
+        return success, response
+
+    def send_digest(self, digest_id, alerts, destination_data):
+        bot_token = None
+        for alert in self.find_digest_alerts(alerts):
+            token = self._get_bot_token(alert, Alerter.process_event.__name__)
+            if token and self._get_bot_id(token) == destination_data['bot_id']:
+                bot_token = token
+                break
+        if not bot_token:
+            raise ValueError(f"Bot token of digest '{digest_id}' not available")
+        message_sections = self.split_message(self.render_digest(digest_id, alerts),
+                                              self._config.get('max_message_characters', 4096))
+        for message in message_sections:
+            self._send_telegram_message(message, bot_token, destination_data['chat_id'],
+                                        destination_data['notification_sound'],
+                                        trigger_type=Alerter.process_event.__name__)
+
+    def _get_bot_token(self, alert: Alert, operation) -> Optional[str]:
         bot_token, _ = self.get_contextual_configuration(VarDefinition(TAG_TELEGRAM_TOKEN, var_type=str),
                                                          alert,
                                                          operation=operation)
@@ -71,22 +121,20 @@ class TelegramAlerter(Alerter):
             if not telegram_bot:
                 logger.error(f"TAGS '{TAG_TELEGRAM_TOKEN}' and '{TAG_TELEGRAM_BOT}' NOT EXIST OR ARE EMPTY! "
                              f"One of them has to be filled")
-                return False, {}
+                return None
 
             bot_token = self._config.get('bots').get(telegram_bot, {}).get('token', None)
 
             if not bot_token:
                 logger.error("CONFIG BOT \"%s\" AND OR TOKEN NOT EXISTS!")
-                return False, {}
+                return None
 
-        message_sections = self.split_message(self.get_message(alert, operation, reason),
-                                              self._config.get('max_message_characters', 4096))
-        for chat_id in chats_list:
-            for message in message_sections:
-                self._send_telegram_message(message, bot_token, chat_id, notification_sound,
-                                            trigger_type=operation)
+        return bot_token
 
-        return True, {}
+    @staticmethod
+    def _get_bot_id(bot_token):
+        # Identifies the bot without exposing its token
+        return hashlib.sha1(bot_token.encode('utf-8')).hexdigest()[:16]
 
     def _send_telegram_message(self, message, bot_token, chat_id, notification_sound, trigger_type):
         response = None
@@ -106,10 +154,15 @@ class TelegramAlerter(Alerter):
         if not really_sent:
             logger.info(f"REQUEST {trigger_type}")
 
+            destination = f"telegram:{bot_token}:{chat_id}"
             try:
-                response = requests.get(url, params=request_params,
-                                        timeout=int(self._config.get('message_send_timeout_s', 10)))
-                response.raise_for_status()
+                with self.destination_circuit(destination):
+                    self.acquire_rate_limit(destination)
+                    response = requests.get(url, params=request_params,
+                                            timeout=int(self._config.get('message_send_timeout_s', 10)))
+                    if response.status_code == 429:
+                        raise_for_rate_limit(response, destination, self._get_retry_after(response))
+                    response.raise_for_status()
             except requests.exceptions.RequestException:
                 logger.debug(f"ERROR sending message to Telegram: {response}")
                 raise
@@ -126,6 +179,13 @@ class TelegramAlerter(Alerter):
                     logger.error(f"ERROR sending message to Telegram: {response.json()}")
                     return None
 
+    @staticmethod
+    def _get_retry_after(response):
+        try:
+            return float(response.json()['parameters']['retry_after'])
+        except Exception:  # noqa
+            return None
+
     @staticmethod
     def get_txt(trigger_type, message):
         if trigger_type == Alerter.process_event.__name__:
@@ -9,7 +9,7 @@ from datadope_alerta import GlobalAttributes as GAttr, RecoveryActionsFields
 from datadope_alerta import thread_local, initialize, AlertIdFilter
 from datadope_alerta.backend.flexiblededup.models.recovery_actions import RecoveryActionData
 from datadope_alerta.plugins import AlerterStatus
-from datadope_alerta.plugins.iom_plugin import IOMAlerterPlugin
+from datadope_alerta.plugins.iom_plugin import IOMAlerterPlugin, AlerterTasksDispatch, AlerterTasksDispatchPlugin
 from datadope_alerta.plugins.recovery_actions.plugin import RecoveryActionsPlugin
 
 logger = logging.getLogger(__name__)
@@ -17,6 +17,7 @@ logger = logging.getLogger(__name__)
 _plain_plugins: List[str] | None = None
 _alerters_plugins: List[str] | None = None
 _recovery_actions_plugin: str | None = None
+_dispatch_plugin: AlerterTasksDispatchPlugin | None = None
 
 
 def initialize_plugins(plugins_object, config):
@@ -112,6 +113,7 @@ def rules(alert, plugins, config):  # noqa
             result.append(_recovery_actions_plugin)
 
         if alerters:
+            alerter_statuses = None
             for alerter in alerters:
                 if alerter == ALERTER_IGNORE:
                     continue
@@ -122,7 +124,10 @@ def rules(alert, plugins, config):  # noqa
                         continue
                     alerter_name = getattr(plugins[alerter], 'alerter_name',
                                            plugins[alerter].name.replace('.', '_').replace('$', '_'))
-                    alerter_status = AlerterStatus.from_db(alert_id=alert.id, alerter_name=alerter_name)
+                    if alerter_statuses is None:
+                        # Status of all the alerters is read in one query
+                        alerter_statuses = AlerterStatus.all_from_db(alert_id=alert.id)
+                    alerter_status = alerter_statuses.get(alerter_name, AlerterStatus.New)
                     if alerter_status in (AlerterStatus.Recovered, AlerterStatus.Recovering):
                         # If alerter has already managed the recovery: ignore
                         logger.info("Alerter %s already sent recovery for '%s'", alerter, alert)
@@ -154,6 +159,15 @@ def rules(alert, plugins, config):  # noqa
             logger.warning("Some routed plugin is not configured: %s", ', '.join(missing))
             result = [x for x in result if x in plugins]
         logger.debug("Returning plugins: %s", result)
-        return [plugins[x] for x in result]
+        routed_plugins = [plugins[x] for x in result]
+        if any(isinstance(x, IOMAlerterPlugin) for x in routed_plugins) \
+                and AlerterTasksDispatch.is_enabled(config):
+            # Alerter plugins tasks are collected and sent grouped by the dispatch plugin, executed the last one
+            global _dispatch_plugin
+            if _dispatch_plugin is None:
+                _dispatch_plugin = AlerterTasksDispatchPlugin()
+            AlerterTasksDispatch.open()
+            routed_plugins.append(_dispatch_plugin)
+        return routed_plugins
     finally:
         thread_local.alerter_name = None
@@ -0,0 +1,82 @@
+import pytest
+from flask import g
+
+from alerta.models.alert import Alert
+from datadope_alerta.backend.flexiblededup.models.alerters import AlerterOperationData
+from datadope_alerta.backend.flexiblededup.specific import SpecificBackend
+
+
+@pytest.fixture()
+def alert_id():
+    g.login = 'test'
+    alert = Alert(resource='resource_compaction', event='event_compaction', environment='Production',
+                  service=['test'], severity='major')
+    alert = alert.create()
+    yield alert.id
+    alert.delete()
+
+
+# noinspection PyProtectedMember
+@pytest.fixture()
+def backend():
+    backend = SpecificBackend.instance
+    delete = "DELETE FROM key_value_store WHERE key LIKE %(prefix)s"
+    backend.backend._deleteall(delete, dict(prefix=backend.COMPACTION_WATERMARK_KEY_PREFIX + '%'))
+    yield backend
+    backend.backend._deleteall(delete, dict(prefix=backend.COMPACTION_WATERMARK_KEY_PREFIX + '%'))
+
+
+def _store(alert_id, operation, count, success=True):
+    for _ in range(count):
+        AlerterOperationData(alert_id=alert_id, alerter='test', operation=operation, success=success).store()
+
+
+# noinspection PyProtectedMember
+def _operations(backend, alert_id):
+    query = "SELECT operation, count(*) AS count FROM alerter_data WHERE alert_id=%(alert_id)s GROUP BY operation"
+    return {x.operation: x.count for x in backend.backend._fetchall(query, dict(alert_id=alert_id))}
+
+
+def _compact(backend, retention=None, limit=500):
+    groups = deleted = 0
+    while True:
+        chunk_groups, chunk_deleted = backend.compact_alerters_data(retention or {'repeat': 2}, limit=limit)
+        groups += chunk_groups
+        deleted += chunk_deleted
+        if chunk_groups < limit:
+            return groups, deleted
+
+
+class TestsAlerterDataCompaction:
+
+    def test_compact(self, alert_id, backend):
+        _store(alert_id, 'new', 1)
+        _store(alert_id, 'repeat', 5)
+        _store(alert_id, 'action', 5)
+        assert _compact(backend) == (2, 3)
+        assert _operations(backend, alert_id) == {'new': 1, 'repeat': 2, 'action': 5}
+        summary = backend.backend._fetchone("SELECT * FROM alerter_data_summary WHERE alert_id=%(alert_id)s",
+                                            dict(alert_id=alert_id))
+        assert (summary.operation, summary.count, summary.success_count) == ('repeat', 3, 3)
+
+    def test_only_new_records_checked(self, alert_id, backend):
+        _store(alert_id, 'repeat', 3)
+        _store(alert_id, 'action', 1)
+        assert _compact(backend) == (2, 1)
+        assert _compact(backend) == (0, 0)
+        _store(alert_id, 'repeat', 1)
+        assert _compact(backend) == (1, 1)
+        assert _operations(backend, alert_id) == {'repeat': 2, 'action': 1}
+
+    def test_chunks(self, alert_id, backend):
+        _store(alert_id, 'repeat', 3)
+        _store(alert_id, 'action', 3)
+        _store(alert_id, 'other', 3)
+        assert _compact(backend, retention={'repeat': 1, 'action': 2}, limit=1) == (3, 3)
+        assert _operations(backend, alert_id) == {'repeat': 1, 'action': 2, 'other': 3}
+
+    def test_retention_change_checks_all_records(self, alert_id, backend):
+        _store(alert_id, 'repeat', 3)
+        assert _compact(backend, retention={'repeat': 3}) == (1, 0)
+        assert _compact(backend, retention={'repeat': 1}) == (1, 2)
+        assert _operations(backend, alert_id) == {'repeat': 1}
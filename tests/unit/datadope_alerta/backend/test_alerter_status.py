@@ -0,0 +1,156 @@
+from unittest.mock import patch
+
+import pytest
+
+from flask import g
+
+from alerta.models.alert import Alert
+from datadope_alerta.backend.flexiblededup.models.alerters import AlerterOperationData
+from datadope_alerta.plugins import AlerterStatus, AlerterStateSnapshot
+
+
+# noinspection SpellCheckingInspection
+@pytest.fixture()
+def alert_id():
+    g.login = 'test'
+    alert = Alert(resource='resource_status', event='event_status', environment='Production',
+                  service=['test'], severity='major')
+    alert = alert.create()
+    yield alert.id
+    AlerterStatus.clear(alert.id)
+    alert.delete()
+
+
+# noinspection PyProtectedMember
+class TestsAlerterStatusTransition:
+
+    def test_compare_and_set_applied(self, alert_id):
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Processing)
+        applied, current = AlerterStatus.compare_and_set(alert_id, 'test', AlerterStatus.Processing,
+                                                         AlerterStatus.Recovering)
+        assert applied is True
+        assert current == AlerterStatus.Recovering
+        assert AlerterStatus.from_db(alert_id, 'test') == AlerterStatus.Recovering
+
+    def test_compare_and_set_not_applied(self, alert_id):
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Processed)
+        operation_data = AlerterOperationData(alert_id=alert_id, alerter='test', operation='recovery',
+                                              task_chain_info={'recovery': 'task'})
+        applied, current = AlerterStatus.compare_and_set(alert_id, 'test',
+                                                         [AlerterStatus.Scheduled, AlerterStatus.Processing],
+                                                         AlerterStatus.Recovering, operation_data)
+        assert applied is False
+        assert current == AlerterStatus.Processed
+        assert AlerterStatus.from_db(alert_id, 'test') == AlerterStatus.Processed
+        assert AlerterOperationData.from_db(alert_id, 'test', 'recovery', create_default=False) is None
+
+    def test_compare_and_set_from_new(self, alert_id):
+        applied, current = AlerterStatus.compare_and_set(alert_id, 'test', AlerterStatus.New,
+                                                         AlerterStatus.Scheduled)
+        assert applied is True
+        applied, current = AlerterStatus.compare_and_set(alert_id, 'test', AlerterStatus.New,
+                                                         AlerterStatus.Scheduled)
+        assert applied is False
+        assert current == AlerterStatus.Scheduled
+
+    def test_snapshot_transition_stores_operation_data_only_if_applied(self, alert_id):
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Processing)
+        snapshot = AlerterStateSnapshot.load(alert_id, 'test')
+        operation_data = AlerterOperationData(alert_id=alert_id, alerter='test', operation='new',
+                                              bg_task_id='task_id')
+        applied, current = snapshot.transition(AlerterStatus.Processed, operation_data,
+                                               expected_statuses=[AlerterStatus.Processing])
+        assert applied is True
+        assert operation_data.id is not None
+        assert snapshot.get_operation_data('new', create_default=False) is operation_data
+
+        other = AlerterOperationData(alert_id=alert_id, alerter='test', operation='recovery')
+        applied, current = snapshot.transition(AlerterStatus.Recovered, other,
+                                               expected_statuses=[AlerterStatus.Recovering])
+        assert applied is False
+        assert current == AlerterStatus.Processed
+        assert snapshot.get_operation_data('recovery', create_default=False) is None
+
+    def test_task_chain_info_stored_with_status(self, alert_id):
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Processing)
+        running = AlerterOperationData(alert_id=alert_id, alerter='test', operation='new')
+        running.store()
+        running = AlerterOperationData.from_db(alert_id, 'test', 'new')
+        running.task_chain_info = {'recovery': 'task'}
+        recovery = AlerterOperationData(alert_id=alert_id, alerter='test', operation='recovery')
+        applied, _ = AlerterStatus.compare_and_set(alert_id, 'test', AlerterStatus.Processing,
+                                                   AlerterStatus.Recovering, recovery, running)
+        assert applied is True
+        assert AlerterOperationData.from_db(alert_id, 'test', 'new').task_chain_info == {'recovery': 'task'}
+        assert AlerterOperationData.from_db(alert_id, 'test', 'recovery', create_default=False) is not None
+
+    def test_task_chain_info_stored_without_id(self, alert_id):
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Processing)
+        AlerterOperationData(alert_id=alert_id, alerter='test', operation='new').store()
+        running = AlerterOperationData(alert_id=alert_id, alerter='test', operation='new',
+                                       task_chain_info={'action': 'test'})
+        applied, _ = AlerterStatus.compare_and_set(alert_id, 'test', AlerterStatus.Processing,
+                                                   AlerterStatus.Actioning, None, running)
+        assert applied is True
+        assert AlerterOperationData.from_db(alert_id, 'test', 'new').task_chain_info == {'action': 'test'}
+
+    def test_task_chain_info_not_stored_if_not_applied(self, alert_id):
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Processed)
+        running = AlerterOperationData(alert_id=alert_id, alerter='test', operation='new')
+        running.store()
+        running = AlerterOperationData.from_db(alert_id, 'test', 'new')
+        running.task_chain_info = {'recovery': 'task'}
+        applied, current = AlerterStatus.compare_and_set(alert_id, 'test', AlerterStatus.Processing,
+                                                         AlerterStatus.Recovering, None, running)
+        assert applied is False
+        assert current == AlerterStatus.Processed
+        assert AlerterOperationData.from_db(alert_id, 'test', 'new').task_chain_info is None
+
+
+def _task_kwargs(alert_id):
+    return {'alerter_data': {'name': 'test'}, 'alert_id': alert_id, 'reason': None}
+
+
+class TestsAlertTaskTransitions:
+
+    def test_action_ignored_while_processing_keeps_chain_info(self, alert_id):
+        from datadope_alerta.bgtasks.alert.event import Task
+
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Processing)
+        AlerterOperationData(alert_id=alert_id, alerter='test', operation='new').store()
+        running = AlerterOperationData.from_db(alert_id, 'test', 'new')
+        running.task_chain_info = {AlerterOperationData.FIELD_TASK_CHAIN_INFO_ACTION: 'ack'}
+        AlerterStatus.compare_and_set(alert_id, 'test', AlerterStatus.Processing, AlerterStatus.Actioning,
+                                      None, running)
+
+        task = Task()
+        task.push_request(id='task_id', retries=0, properties={})
+        try:
+            task._load_alerter_state(alert_id, 'test')
+            with patch('time.sleep') as sleep:
+                task.on_failure(ValueError('error'), 'task_id', [], _task_kwargs(alert_id), None)
+            sleep.assert_not_called()
+        finally:
+            task.pop_request()
+        action_data = AlerterOperationData.from_db(alert_id, 'test', 'ack', create_default=False)
+        assert action_data is not None
+        assert action_data.skipped is True
+        assert AlerterStatus.from_db(alert_id, 'test') == AlerterStatus.Processed
+
+    def test_status_not_forced_after_concurrent_changes(self, alert_id):
+        from datadope_alerta.bgtasks.alert.event import Task
+
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Processing)
+        task = Task()
+        task.push_request(id='task_id', retries=0, properties={})
+        try:
+            with patch.object(AlerterStatus, 'compare_and_set',
+                              return_value=(False, AlerterStatus.Recovering)) as compare_and_set, \
+                    patch.object(AlerterStatus, 'transition') as transition, \
+                    patch.object(Task, 'on_success_operation', return_value=AlerterStatus.Processed):
+                task.on_success((True, {}), 'task_id', [], _task_kwargs(alert_id))
+        finally:
+            task.pop_request()
+        assert compare_and_set.call_count == Task._status_transition_attempts
+        transition.assert_not_called()
+        assert AlerterStatus.from_db(alert_id, 'test') == AlerterStatus.Processing
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytest
+from flask import g
+
+from alerta.models.alert import Alert
+from datadope_alerta.backend.flexiblededup.models.alerters import AlerterOperationData
+from datadope_alerta.backend.flexiblededup.specific import SpecificBackend
+from datadope_alerta.plugins import AlerterStatus
+
+
+# noinspection SpellCheckingInspection
+@pytest.fixture()
+def alert_id():
+    g.login = 'test'
+    alert = Alert(resource='resource_info', event='event_info', environment='Production',
+                  service=['test'], severity='major')
+    alert = alert.create()
+    AlerterStatus.store(alert.id, 'test', AlerterStatus.Processed)
+    now = datetime.utcnow()
+    for i in range(5):
+        AlerterOperationData(alert_id=alert.id, alerter='test', operation='repeat',
+                             received_time=now - timedelta(minutes=i)).store()
+    yield alert.id
+    AlerterStatus.clear(alert.id)
+    alert.delete()
+
+
+class TestsAlertersInfo:
+
+    def test_limit(self, alert_id):
+        data = SpecificBackend.instance.get_alerters_info(alert_id, limit=3)
+        assert len(data['test']['data']) == 3
+
+    def test_limit_by_operation(self, alert_id):
+        data = SpecificBackend.instance.get_alerters_info(alert_id, limit_by_operation=2, limit=3)
+        assert len(data['test']['data']) == 2
+
+    def test_no_limit(self, alert_id):
+        data = SpecificBackend.instance.get_alerters_info(alert_id, limit=None)
+        assert len(data['test']['data']) == 5
+
+    def test_etag(self, alert_id):
+        backend = SpecificBackend.instance
+        etag = backend.get_alerters_info_etag(alert_id)
+        assert backend.get_alerters_info_etag(alert_id) == etag
+        assert backend.get_alerters_info_etag(alert_id, limit_by_operation=2) != etag
+        data = AlerterOperationData.from_db(alert_id, 'test', 'repeat')
+        data.end_time = datetime.utcnow() + timedelta(minutes=1)
+        data.store()
+        etag_updated = backend.get_alerters_info_etag(alert_id)
+        assert etag_updated != etag
+        AlerterStatus.store(alert_id, 'test', AlerterStatus.Recovered)
+        assert backend.get_alerters_info_etag(alert_id) != etag_updated
+
+    def test_not_modified(self, alert_id):
+        from datadope_alerta.api.alerters import get_alerter_data
+        etag = SpecificBackend.instance.get_alerters_info_etag(alert_id, limit=100)
+        with patch.object(SpecificBackend.instance, 'get_alerters_info') as get_alerters_info, \
+                pytest.app.test_request_context(f'/alert/{alert_id}/alerters', headers={'If-None-Match': f'"{etag}"'}):
+            response = get_alerter_data(alert_id)
+        assert response.status_code == 304
+        get_alerters_info.assert_not_called()
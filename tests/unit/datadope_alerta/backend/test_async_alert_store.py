@@ -0,0 +1,95 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+from alerta.exceptions import ApiError
+from redis import RedisError
+
+from datadope_alerta.backend.flexiblededup.async_alert import RedisAsyncAlert
+
+ALERT = {'resource': 'resource', 'event': 'event', 'environment': 'Production', 'severity': 'critical'}
+
+
+@pytest.fixture()
+def store(redis_client):
+    store = RedisAsyncAlert(None, ttl=600)
+    store._client = redis_client
+    return store
+
+
+def _receive(store, apply_async=None):
+    from alerta.app import db
+    from datadope_alerta.api.async_alert import receive
+    with patch.object(db, 'backend_async_alert', store), \
+            patch('datadope_alerta.bgtasks.async_alert_task.async_receive.apply_async',
+                  apply_async or MagicMock()) as apply_async, \
+            pytest.app.test_request_context('/async/alert', method='POST', json=ALERT):
+        return receive(), apply_async
+
+
+class TestsRedisAsyncAlert:
+
+    def test_create_and_update(self, store):
+        assert store.create('task1') == 'task1'
+        assert store.get_alert_id('task1') is None
+        assert store.update('task1', 'alert1') == 'task1'
+        assert store.get_alert_id('task1') == 'alert1'
+
+    def test_errors(self, store):
+        store.create('task1')
+        store.update('task1', None, errors={'status': 'error', 'code': 400})
+        assert store.get_alert_id('task1') == {'status': 'error', 'code': 400}
+
+    def test_not_found(self, store):
+        with pytest.raises(KeyError):
+            store.get_alert_id('task1')
+
+    def test_create_after_update_keeps_result(self, store, redis_client):
+        # Worker finishes the task before the status is created
+        store.update('task1', 'alert1')
+        store.create('task1')
+        assert store.get_alert_id('task1') == 'alert1'
+        assert redis_client.hget(store._key('task1'), 'status') == RedisAsyncAlert.STATUS_DONE
+
+    def test_ttl(self, store, redis_client):
+        key = store._key('task1')
+        store.create('task1')
+        assert 590 < redis_client.ttl(key) <= 600
+        redis_client.expire(key, 10)
+        # Finishing the task renews the ttl
+        store.update('task1', 'alert1')
+        assert 590 < redis_client.ttl(key) <= 600
+
+    def test_create_fails(self, store):
+        store._client = MagicMock()
+        store._client.pipeline.return_value.execute.side_effect = RedisError('error')
+        assert store.create('task1') is None
+
+
+class TestsReceiveAsyncAlert:
+
+    def test_status_created_before_publishing(self, store):
+        def apply_async(**kwargs):
+            # Status is already waiting when the task is published
+            assert store.get_alert_id(kwargs['task_id']) is None
+            return MagicMock(id=kwargs['task_id'])
+
+        # iom_api blueprint is not registered in the test application
+        with patch('datadope_alerta.api.async_alert.url_for', return_value='url'):
+            response, apply_async_mock = _receive(store, MagicMock(side_effect=apply_async))
+        assert response.status_code == 202
+        task_id = apply_async_mock.call_args.kwargs['task_id']
+        assert response.json == {'task_id': task_id, 'status': 'waiting'}
+
+    def test_rejected_if_status_not_stored(self, store):
+        store._client = MagicMock()
+        store._client.pipeline.return_value.execute.side_effect = RedisError('error')
+        with pytest.raises(ApiError) as exc:
+            _receive(store)
+        assert exc.value.code == 503
+
+    def test_status_failed_if_not_published(self, store, redis_client):
+        with pytest.raises(ApiError) as exc:
+            _receive(store, MagicMock(side_effect=ConnectionError('error')))
+        assert exc.value.code == 503
+        key = redis_client.keys(f"{RedisAsyncAlert.KEY_PREFIX}*")[0]
+        assert store.get_alert_id(key[len(RedisAsyncAlert.KEY_PREFIX):])['code'] == 503
@@ -0,0 +1,57 @@
+import threading
+from unittest.mock import patch, MagicMock
+
+import pytest
+from redis import RedisError
+
+from alerta.models.metrics import Timer
+from datadope_alerta.backend.flexiblededup.metrics import MetricsBuffer
+
+
+@pytest.fixture()
+def buffer(redis_client):
+    with patch('datadope_alerta.get_redis_client', return_value=redis_client):
+        yield MetricsBuffer(flush_interval=0.05, buckets=[0.1, 1.0])
+
+
+def _wait_histograms(redis_client, timeout=2.0):
+    event = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if redis_client.exists(MetricsBuffer.HISTOGRAMS_KEY):
+            return True
+        event.wait(0.01)
+    return False
+
+
+class TestsMetricsBuffer:
+
+    def test_flushed_without_new_measures(self, buffer, redis_client):
+        buffer.observe('alerter_operation_seconds', 0.5, labels={'alerter': 'test'})
+        assert not redis_client.exists(MetricsBuffer.HISTOGRAMS_KEY)
+        assert _wait_histograms(redis_client)
+        assert 'alerta_alerter_operation_seconds_count{alerter="test"} 1\n' in buffer.render_prometheus(redis_client)
+
+    def test_flusher_started_once(self, buffer):
+        buffer.observe('alerter_operation_seconds', 0.5)
+        flusher = buffer._flusher  # noqa
+        buffer.observe('alerter_operation_seconds', 0.5)
+        assert flusher.is_alive()
+        assert buffer._flusher is flusher  # noqa
+
+    def test_flushed_at_exit(self, redis_client):
+        buffer = MetricsBuffer(flush_interval=3600, buckets=[0.1, 1.0])
+        buffer.add(Timer('alerters', 'test'), 200, histogram='alerter_operation_seconds')
+        with patch('datadope_alerta.get_redis_client', return_value=redis_client), patch('alerta.app.db') as db:
+            buffer._flush_at_exit()  # noqa
+        timers = db.update_timers.call_args.args[0]
+        assert [(x.name, x.count, x.total_time) for x in timers] == [('test', 1, 200)]
+        assert redis_client.exists(MetricsBuffer.HISTOGRAMS_KEY)
+
+    def test_prometheus_endpoint_without_redis(self):
+        from datadope_alerta.api.metrics import prometheus_histograms
+        redis_client = MagicMock()
+        redis_client.hgetall.side_effect = RedisError('error')
+        with patch('datadope_alerta.api.metrics.get_redis_client', return_value=redis_client), \
+                pytest.app.test_request_context('/alerters/metrics'):
+            response = prometheus_histograms()
+        assert response.status_code == 200
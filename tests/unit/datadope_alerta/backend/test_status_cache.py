@@ -0,0 +1,54 @@
+import pytest
+
+from datadope_alerta.backend.flexiblededup.status_cache import AlerterStatusCache
+
+
+@pytest.fixture()
+def cache(redis_client):
+    return AlerterStatusCache(redis_client, ttl=60)
+
+
+class TestsAlerterStatusCache:
+
+    def test_miss(self, cache):
+        assert cache.get('alert', 'email') == (False, None)
+        assert cache.get_all('alert') is None
+
+    def test_populate_complete(self, cache):
+        version = cache.get_version('alert')
+        assert cache.populate('alert', version, {'email': 'processed'}, complete=True) is True
+        assert cache.get('alert', 'email') == (True, 'processed')
+        assert cache.get('alert', 'telegram') == (True, None)
+        assert cache.get_all('alert') == {'email': 'processed'}
+        assert 0 < cache.client.ttl(cache._key('alert')) <= 60
+
+    def test_populate_empty_complete(self, cache):
+        assert cache.populate('alert', cache.get_version('alert'), {}, complete=True) is True
+        assert cache.get_all('alert') == {}
+
+    def test_populate_partial(self, cache):
+        assert cache.populate('alert', cache.get_version('alert'), {'email': 'processing'}) is True
+        assert cache.get('alert', 'email') == (True, 'processing')
+        assert cache.get('alert', 'telegram') == (False, None)
+        assert cache.get_all('alert') is None
+
+    def test_invalidate(self, cache):
+        cache.populate('alert', cache.get_version('alert'), {'email': 'processed'}, complete=True)
+        cache.invalidate('alert')
+        assert cache.get('alert', 'email') == (False, None)
+        assert cache.get_all('alert') is None
+
+    def test_stale_read_not_cached(self, cache):
+        # Statuses read from database before a concurrent change are not stored
+        version = cache.get_version('alert')
+        cache.invalidate('alert')
+        assert cache.populate('alert', version, {'email': 'processing'}, complete=True) is False
+        assert cache.get_all('alert') is None
+
+        version = cache.get_version('alert')
+        assert cache.populate('alert', version, {'email': 'processed'}, complete=True) is True
+        assert cache.get_all('alert') == {'email': 'processed'}
+
+    def test_unknown_version_not_cached(self, cache):
+        assert cache.populate('alert', None, {'email': 'processed'}, complete=True) is False
+        assert cache.get_all('alert') is None
@@ -0,0 +1,85 @@
+import pytest
+from flask import g
+
+from alerta.models.alert import Alert
+from datadope_alerta.backend.flexiblededup.models.alerters import AlerterOperationData
+from datadope_alerta.backend.flexiblededup.response_storage import ResponseCompactor
+from datadope_alerta.backend.flexiblededup.specific import SpecificBackend
+
+
+# noinspection SpellCheckingInspection
+@pytest.fixture()
+def alert_id():
+    g.login = 'test'
+    alert = Alert(resource='resource_traceback', event='event_traceback', environment='Production',
+                  service=['test'], severity='major')
+    alert = alert.create()
+    yield alert.id
+    alert.delete()
+
+
+# noinspection PyProtectedMember
+@pytest.fixture()
+def backend():
+    backend = SpecificBackend.instance
+    compactor = backend._response_compactor
+    backend._response_compactor = ResponseCompactor(compression_threshold=1000, deduplicate_tracebacks=True)
+    backend._stored_tracebacks.clear()
+    yield backend
+    backend._response_compactor = compactor
+    backend._stored_tracebacks.clear()
+
+
+def _store_response(alert_id, operation, response):
+    data = AlerterOperationData(alert_id=alert_id, alerter='test', operation=operation, response=response)
+    data.store()
+
+
+def _stored_hashes(backend):
+    return {x.hash for x in backend.backend._fetchall("SELECT hash FROM alerter_traceback", {})}
+
+
+# noinspection PyProtectedMember
+class TestsTracebackRetention:
+
+    def test_compressed_response_keeps_refs(self):
+        compactor = ResponseCompactor(compression_threshold=10, deduplicate_tracebacks=True)
+        tracebacks = {}
+        response = compactor.compact({'error': {'traceback': 'traceback text'}}, tracebacks)
+        assert response['tracebackRefs'] == list(tracebacks)
+
+    def test_prune_unreferenced(self, alert_id, backend):
+        _store_response(alert_id, 'new', {'error': {'traceback': 'referenced'}})
+        _store_response(alert_id, 'repeat', {'error': {'traceback': 'compressed', 'message': 'x' * 2000}})
+        backend.store_tracebacks({'unreferenced': 'unreferenced'})
+        hashes = _stored_hashes(backend)
+        assert {ResponseCompactor.traceback_hash('referenced'), ResponseCompactor.traceback_hash('compressed'),
+                'unreferenced'} <= hashes
+
+        assert backend.prune_tracebacks() == 0
+        assert backend.prune_tracebacks(min_age=-1) >= 1
+        hashes = _stored_hashes(backend)
+        assert 'unreferenced' not in hashes
+        assert ResponseCompactor.traceback_hash('referenced') in hashes
+        assert ResponseCompactor.traceback_hash('compressed') in hashes
+
+    def test_refs_kept_when_stored_again(self, alert_id, backend):
+        _store_response(alert_id, 'new', {'error': {'traceback': 'stored again'}})
+        data = AlerterOperationData.from_db(alert_id, 'test', 'new')
+        data.response['message'] = 'x' * 2000
+        data.store()
+        record = backend.backend._fetchone("SELECT traceback_refs FROM alerter_data WHERE id=%(id)s",
+                                           dict(id=data.id))
+        assert record.traceback_refs == [ResponseCompactor.traceback_hash('stored again')]
+        backend.prune_tracebacks(min_age=-1)
+        assert ResponseCompactor.traceback_hash('stored again') in _stored_hashes(backend)
+
+    def test_store_again_after_cache_time(self, backend, monkeypatch):
+        backend.store_tracebacks({'hash': 'traceback'})
+        backend.backend._deleteall("DELETE FROM alerter_traceback WHERE hash='hash'", {})
+        backend.store_tracebacks({'hash': 'traceback'})
+        assert 'hash' not in _stored_hashes(backend)
+        monkeypatch.setattr(SpecificBackend, 'TRACEBACK_STORED_CACHE_TIME', 0)
+        backend.store_tracebacks({'hash': 'traceback'})
+        assert 'hash' in _stored_hashes(backend)
+        backend.prune_tracebacks(min_age=-1)
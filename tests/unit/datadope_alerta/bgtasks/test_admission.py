@@ -0,0 +1,113 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+from redis import RedisError
+
+CONFIG = {
+    'ASYNC_ALERT_TASK_QUEUE': 'async',
+    'ASYNC_ALERT_HIGH_WATERMARK': 100,
+    'ASYNC_ALERT_LOW_WATERMARK': 50,
+    'ASYNC_ALERT_MAX_RETRY_AFTER': 300,
+    'ASYNC_ALERT_DEPTH_CACHE_TIME': 1.0
+}
+
+
+@pytest.fixture()
+def admission(redis_client):
+    from datadope_alerta.bgtasks import admission
+    with patch.object(admission, 'get_redis_client', return_value=redis_client), \
+            patch.object(admission.AdmissionControl, '_broker_client', redis_client), \
+            patch.object(admission.AdmissionControl, '_state', None), \
+            patch.dict(admission.app.config, CONFIG):
+        yield admission.AdmissionControl
+
+
+def _fill_queue(redis_client, messages, priority_messages=0):
+    for x in range(messages):
+        redis_client.lpush('async', f"message{x}")
+    for x in range(priority_messages):
+        redis_client.lpush('async\x06\x163', f"priority{x}")
+
+
+def _consume(admission, now, count):
+    with patch('time.time', return_value=now):
+        for _ in range(count):
+            admission.record_consumed()
+
+
+class TestsAdmissionControl:
+
+    def test_admitted_under_watermarks(self, admission, redis_client):
+        _fill_queue(redis_client, 49)
+        assert admission.check('informational') is None
+        assert admission.check('critical') is None
+
+    def test_low_severities_rejected_over_low_watermark(self, admission, redis_client):
+        _fill_queue(redis_client, 50)
+        assert admission.check('informational') is not None
+        assert admission.check('critical') is None
+        assert redis_client.hgetall(admission.REJECTED_KEY) == {'low': '1'}
+
+    def test_rejected_over_high_watermark(self, admission, redis_client):
+        _fill_queue(redis_client, 90, priority_messages=10)
+        assert admission.check('critical') is not None
+        assert redis_client.hgetall(admission.REJECTED_KEY) == {'high': '1'}
+
+    def test_retry_after_uses_consumption_rate(self, admission, redis_client):
+        # 60 alerts consumed in the last minute: 1 alert per second
+        _consume(admission, 1000.0, 60)
+        _fill_queue(redis_client, 110)
+        with patch('time.time', return_value=1015.0):
+            # 11 alerts to consume to get under the high watermark
+            assert admission.check('critical') == 11
+
+    def test_retry_after_without_consumption(self, admission, redis_client):
+        _fill_queue(redis_client, 100)
+        assert admission.check('critical') == 300
+
+    def test_retry_after_limited(self, admission, redis_client):
+        _consume(admission, 1000.0, 6)
+        _fill_queue(redis_client, 1000)
+        with patch('time.time', return_value=1015.0):
+            assert admission.check('critical') == 300
+
+    def test_queue_depth_cached(self, admission, redis_client):
+        with patch('time.time', return_value=1000.0):
+            assert admission.check('critical') is None
+        _fill_queue(redis_client, 100)
+        with patch('time.time', return_value=1000.5):
+            assert admission.check('critical') is None
+        with patch('time.time', return_value=1001.0):
+            assert admission.check('critical') is not None
+
+    def test_disabled(self, admission, redis_client):
+        _fill_queue(redis_client, 1000)
+        with patch.object(admission, 'get_high_watermark', return_value=0):
+            assert admission.check('critical') is None
+            admission.record_consumed()
+        assert not redis_client.keys(f"{admission.CONSUMED_KEY_PREFIX}*")
+
+    def test_admitted_if_redis_fails(self, admission):
+        broker_client = MagicMock()
+        broker_client.pipeline.return_value.execute.side_effect = RedisError('error')
+        with patch.object(admission, '_broker_client', broker_client):
+            assert admission.check('critical') is None
+
+    def test_render_prometheus(self, admission, redis_client):
+        _fill_queue(redis_client, 100)
+        admission.check('critical')
+        output = admission.render_prometheus()
+        assert 'alerta_async_alert_queue_depth{queue="async"} 100\n' in output
+        assert 'alerta_async_alert_rejected_total{queue="async",watermark="high"} 1\n' in output
+        assert 'alerta_async_alert_rejected_total{queue="async",watermark="low"} 0\n' in output
+
+    def test_async_alert_rejected(self, admission, redis_client):
+        _fill_queue(redis_client, 100)
+        from datadope_alerta.api.async_alert import receive
+        with patch('datadope_alerta.bgtasks.async_alert_task.async_receive.apply_async') as apply_async, \
+                pytest.app.test_request_context('/async/alert', method='POST', json={
+                    'resource': 'resource', 'event': 'event', 'environment': 'Production', 'severity': 'critical'}):
+            response = receive()
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '300'
+        apply_async.assert_not_called()
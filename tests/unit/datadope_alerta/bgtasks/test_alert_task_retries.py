@@ -0,0 +1,89 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from datadope_alerta.plugins import RetryableException, RateLimitedException, CircuitOpenException
+
+
+@pytest.fixture()
+def task():
+    from datadope_alerta.bgtasks.alert.event import Task
+    return Task()
+
+
+def _run(task, exc, retries, properties):
+    alerter = MagicMock()
+    alerter.name = 'test'
+    alerter.process_event.side_effect = exc
+    task.push_request(id='task_id', args=[], kwargs={}, retries=retries, called_directly=False,
+                      properties=properties, delivery_info={})
+    try:
+        with patch.object(task, '_get_alerter', return_value=alerter), \
+                patch('datadope_alerta.bgtasks.alert.AlertSnapshot.get_alert', return_value=MagicMock(tags=[])), \
+                patch('datadope_alerta.bgtasks.alert.ContextualConfiguration.get_global_configuration',
+                      return_value='DO_NOT_RETRY'), \
+                patch.object(task, 'retry') as retry:
+            task.run(alerter_data={}, alert_id='alert_id', reason=None)
+        return retry
+    finally:
+        task.pop_request()
+
+
+class TestsAlertTaskRetries:
+
+    @pytest.mark.parametrize('exc', [RateLimitedException('destination', 10.0),
+                                     CircuitOpenException('destination', 10.0)])
+    def test_rate_limited_counted_as_deferral(self, task, exc):
+        retry = _run(task, exc, retries=3, properties={'deferrals': 1, 'retry_spec': {'max_retries': 2}})
+        options = retry.call_args.kwargs
+        assert options['deferrals'] == 2
+        assert options['countdown'] == 10.0
+        assert options['max_retries'] == 4
+        assert options['retry_spec'] == {'max_retries': 2}
+
+    @pytest.mark.parametrize('exc', [RateLimitedException('destination', 10.0),
+                                     CircuitOpenException('destination', 10.0)])
+    def test_rate_limited_after_max_deferrals_follows_retry_policy(self, task, exc):
+        with patch.dict(pytest.app.config, {'ALERTERS_MAX_DEFERRALS': 2}):
+            retry = _run(task, exc, retries=3,
+                         properties={'deferrals': 2, 'retry_spec': {'max_retries': 2, 'interval_first': 5,
+                                                                    'interval_step': 10, 'interval_max': 100}})
+        options = retry.call_args.kwargs
+        assert 'deferrals' not in options
+        assert options['max_retries'] == 4
+        assert options['countdown'] == 15
+
+    @pytest.mark.parametrize('exc', [RateLimitedException('destination', 10.0),
+                                     CircuitOpenException('destination', 10.0)])
+    def test_rate_limited_after_max_deferrals_fails(self, task, exc):
+        with patch.dict(pytest.app.config, {'ALERTERS_MAX_DEFERRALS': 2}), \
+                pytest.raises(type(exc)):
+            _run(task, exc, retries=2, properties={'deferrals': 2})
+
+    def test_deferrals_not_consumed_from_retry_policy(self, task):
+        # 3 previous executions: 2 deferrals and 1 retry
+        retry = _run(task, RetryableException('error'), retries=3,
+                     properties={'deferrals': 2, 'retry_spec': {'max_retries': 2, 'interval_first': 5,
+                                                                'interval_step': 10, 'interval_max': 100}})
+        options = retry.call_args.kwargs
+        # Celery compares max_retries with all the retries
+        assert options['max_retries'] == 4
+        # Countdown of the second retry of the policy
+        assert options['countdown'] == 15
+
+    def test_retry_number(self, task):
+        task.push_request(id='task_id', retries=5, properties={'deferrals': 3})
+        try:
+            assert task.retry_number == 2
+        finally:
+            task.pop_request()
+
+    def test_deferrals_kept_in_retries(self, task):
+        task.push_request(id='task_id', args=[], kwargs={}, retries=1, properties={'deferrals': 1, 'lane': 'high'},
+                          delivery_info={})
+        try:
+            signature = task.signature_from_request()
+            assert signature.options['deferrals'] == 1
+            assert signature.options['lane'] == 'high'
+        finally:
+            task.pop_request()
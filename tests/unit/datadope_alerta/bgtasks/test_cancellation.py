@@ -0,0 +1,92 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+# noinspection PyPackageRequirements
+from celery import states
+# noinspection PyPackageRequirements
+from celery.exceptions import Ignore
+from redis import RedisError
+
+
+@pytest.fixture()
+def registry(redis_client):
+    from datadope_alerta.bgtasks import cancellation
+    with patch.object(cancellation, 'get_redis_client', return_value=redis_client), \
+            patch.dict(cancellation.app.config, {'CANCELLED_TASKS_TTL': 100}):
+        yield cancellation.CancellationRegistry
+
+
+@pytest.fixture()
+def failing_registry():
+    from datadope_alerta.bgtasks import cancellation
+    client = MagicMock()
+    client.set.side_effect = RedisError('error')
+    client.exists.side_effect = RedisError('error')
+    with patch.object(cancellation, 'get_redis_client', return_value=client):
+        yield cancellation.CancellationRegistry
+
+
+@pytest.fixture()
+def task():
+    from datadope_alerta.bgtasks.cancellation import CancellableTask
+    return CancellableTask()
+
+
+class TestsCancellationRegistry:
+
+    def test_cancel(self, registry, redis_client):
+        assert registry.is_cancelled('task1') is False
+        assert registry.cancel('task1') is True
+        assert registry.is_cancelled('task1') is True
+        assert registry.is_cancelled('task2') is False
+        assert 90 < redis_client.ttl(f"{registry.KEY_PREFIX}task1") <= 100
+
+    def test_no_task_id(self, registry):
+        assert registry.is_cancelled(None) is False
+
+    def test_redis_error(self, failing_registry):
+        assert failing_registry.cancel('task1') is False
+        assert failing_registry.is_cancelled('task1') is False
+
+
+class TestsCancellableTask:
+
+    def test_cancelled_task_ignored(self, registry, task):
+        registry.cancel('task1')
+        with patch.object(task, 'update_state') as update_state, pytest.raises(Ignore):
+            task.before_start('task1', (), {})
+        update_state.assert_called_once_with(state=states.IGNORED)
+
+    def test_not_cancelled_task_started(self, registry, task):
+        with patch.object(task, 'update_state') as update_state:
+            task.before_start('task1', (), {})
+        update_state.assert_not_called()
+
+
+class TestsRevokeTask:
+
+    @staticmethod
+    def _revoke(task_id, fallback):
+        from datadope_alerta import bgtasks
+        with patch.dict(bgtasks.app.config, {'REVOKE_BROADCAST_FALLBACK': fallback}), \
+                patch('datadope_alerta.bgtasks.delayed.DelayedScheduler.cancel') as scheduler_cancel, \
+                patch.object(bgtasks.celery.control, 'revoke') as revoke:
+            bgtasks.revoke_task(task_id)
+        return scheduler_cancel, revoke
+
+    @pytest.mark.parametrize('fallback', [True, False])
+    def test_registered(self, registry, fallback):
+        scheduler_cancel, revoke = self._revoke('task1', fallback)
+        scheduler_cancel.assert_called_once_with('task1')
+        revoke.assert_not_called()
+        assert registry.is_cancelled('task1') is True
+
+    def test_broadcast_if_not_registered(self, failing_registry):
+        scheduler_cancel, revoke = self._revoke('task1', True)
+        scheduler_cancel.assert_called_once_with('task1')
+        revoke.assert_called_once_with('task1')
+
+    def test_no_broadcast_if_fallback_disabled(self, failing_registry):
+        scheduler_cancel, revoke = self._revoke('task1', False)
+        scheduler_cancel.assert_called_once_with('task1')
+        revoke.assert_not_called()
@@ -0,0 +1,113 @@
+import json
+from unittest.mock import patch
+
+import pytest
+
+
+@pytest.fixture()
+def scheduler(redis_client):
+    from datadope_alerta.bgtasks import delayed
+    delayed.DelayedScheduler._claim_script = None
+    with patch.object(delayed, 'get_redis_client', return_value=redis_client), \
+            patch.dict(delayed.app.config, {'DELAYED_SCHEDULER': True, 'DELAYED_SCHEDULER_MIN_DELAY': 10}):
+        yield delayed.DelayedScheduler
+    delayed.DelayedScheduler._claim_script = None
+
+
+@pytest.fixture()
+def task():
+    from datadope_alerta.bgtasks.delayed import move_delayed_tasks
+    return move_delayed_tasks
+
+
+def _schedule(scheduler, task, task_id, countdown=60):
+    with patch('time.time', return_value=1000.0):
+        scheduler.apply_async(task, kwargs={'task': task_id}, task_id=task_id, countdown=countdown)
+
+
+def _move(scheduler, now, batch_size=10, side_effect=None):
+    from datadope_alerta.bgtasks import celery
+    with patch('time.time', return_value=now), \
+            patch.object(celery, 'send_task', side_effect=side_effect) as send_task:
+        moved = scheduler.move_due(batch_size)
+    return moved, send_task
+
+
+class TestsDelayedScheduler:
+
+    def test_stored_until_due(self, scheduler, task, redis_client):
+        with patch.object(task, 'apply_async') as apply_async:
+            _schedule(scheduler, task, 'task1')
+        apply_async.assert_not_called()
+        assert redis_client.zscore(scheduler.DUE_KEY, 'task1') == 1060.0
+        moved, send_task = _move(scheduler, 1059.0)
+        assert moved == 0
+        send_task.assert_not_called()
+        moved, send_task = _move(scheduler, 1060.0)
+        assert moved == 1
+        assert send_task.call_args.kwargs['task_id'] == 'task1'
+        assert send_task.call_args.kwargs['kwargs'] == {'task': 'task1'}
+        assert send_task.call_args.kwargs[scheduler.DUE_PROPERTY]
+        assert not redis_client.exists(scheduler.DUE_KEY, scheduler.PROCESSING_KEY,
+                                 scheduler.PAYLOADS_KEY)
+
+    def test_short_delay_sent_to_broker(self, scheduler, task, redis_client):
+        with patch.object(task, 'apply_async') as apply_async:
+            _schedule(scheduler, task, 'task1', countdown=5)
+        apply_async.assert_called_once()
+        assert not redis_client.exists(scheduler.DUE_KEY)
+
+    def test_restored_if_not_sent(self, scheduler, task, redis_client):
+        _schedule(scheduler, task, 'task1')
+        moved, _ = _move(scheduler, 1100.0, side_effect=ConnectionError('error'))
+        assert moved == 0
+        assert redis_client.zscore(scheduler.DUE_KEY, 'task1') == 1060.0
+        assert not redis_client.exists(scheduler.PROCESSING_KEY)
+        moved, _ = _move(scheduler, 1101.0)
+        assert moved == 1
+
+    def test_lease_expired_is_sent_again(self, scheduler, task, redis_client):
+        _schedule(scheduler, task, 'task1')
+        # Mover dies after taking the task
+        assert len(scheduler._claim_due(redis_client, 1100.0, 10)) == 1
+        assert redis_client.hexists(scheduler.PAYLOADS_KEY, 'task1')
+        moved, _ = _move(scheduler, 1100.0 + scheduler.LEASE_TIME - 1)
+        assert moved == 0
+        moved, send_task = _move(scheduler, 1100.0 + scheduler.LEASE_TIME)
+        assert moved == 1
+        assert send_task.call_args.kwargs['task_id'] == 'task1'
+
+    def test_scheduled_again_while_sending(self, scheduler, task, redis_client):
+        _schedule(scheduler, task, 'task1')
+
+        def send_task(*_args, **_kwargs):
+            # The task is executed and schedules a retry before the task is acknowledged
+            _schedule(scheduler, task, 'task1', countdown=120)
+
+        moved, _ = _move(scheduler, 1100.0, side_effect=send_task)
+        assert moved == 1
+        assert redis_client.zscore(scheduler.DUE_KEY, 'task1') == 1120.0
+        assert json.loads(redis_client.hget(scheduler.PAYLOADS_KEY, 'task1'))['due'] == 1120.0
+
+    def test_cancel(self, scheduler, task, redis_client):
+        _schedule(scheduler, task, 'task1')
+        assert scheduler.cancel('task1') is True
+        moved, send_task = _move(scheduler, 1100.0)
+        assert moved == 0
+        send_task.assert_not_called()
+
+    def test_cancel_taken_task(self, scheduler, task, redis_client):
+        _schedule(scheduler, task, 'task1')
+        scheduler._claim_due(redis_client, 1100.0, 10)
+        assert scheduler.cancel('task1') is True
+        moved, send_task = _move(scheduler, 1100.0 + scheduler.LEASE_TIME)
+        assert moved == 0
+        send_task.assert_not_called()
+        assert not redis_client.exists(scheduler.PROCESSING_KEY)
+
+    def test_batches(self, scheduler, task, redis_client):
+        for x in range(5):
+            _schedule(scheduler, task, f"task{x}")
+        moved, send_task = _move(scheduler, 1100.0, batch_size=2)
+        assert moved == 5
+        assert send_task.call_count == 5
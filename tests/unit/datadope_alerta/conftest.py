@@ -1,3 +1,4 @@
+import fakeredis
 import pytest
 
 
@@ -12,3 +13,8 @@ def get_request():
     with pytest.app.app_context():
         with pytest.app.test_request_context():
             yield
+
+
+@pytest.fixture()
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
@@ -0,0 +1,40 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from datadope_alerta.plugins.iom_plugin import AlerterTasksDispatch, _PendingAlerterTask  # noqa
+
+
+def _pending_task(task_id):
+    task_instance = MagicMock()
+    task_instance.name = 'event_task'
+    return _PendingAlerterTask(MagicMock(), MagicMock(), MagicMock(), 'process_event', None, task_instance,
+                               task_id, {'alert_id': 'alert'}, 10.0, {'queue': 'alert'}, False)
+
+
+class TestsAlerterTasksDispatch:
+
+    def test_flushed_on_exit(self):
+        with patch('datadope_alerta.plugins.iom_plugin.apply_delayed') as apply_delayed:
+            with pytest.app.app_context():
+                with AlerterTasksDispatch.open() as dispatch:
+                    dispatch.add(_pending_task('task1'), 10)
+                    apply_delayed.assert_not_called()
+                apply_delayed.assert_called_once()
+                assert apply_delayed.call_args.kwargs['task_id'] == 'task1'
+                assert AlerterTasksDispatch.current() is None
+
+    def test_flushed_on_app_context_teardown(self):
+        with patch('datadope_alerta.plugins.iom_plugin.apply_delayed') as apply_delayed:
+            with pytest.app.app_context():
+                AlerterTasksDispatch.open().add(_pending_task('task1'), 10)
+                # Processing aborted before the dispatch plugin is executed
+            apply_delayed.assert_called_once()
+            assert apply_delayed.call_args.kwargs['task_id'] == 'task1'
+
+    def test_scheduling_error_registered(self):
+        pending_task = _pending_task('task1')
+        with patch('datadope_alerta.plugins.iom_plugin.apply_delayed', side_effect=ConnectionError('error')):
+            with pytest.app.app_context():
+                AlerterTasksDispatch.open().add(pending_task, 10)
+        pending_task.plugin.register_scheduling_error.assert_called_once()
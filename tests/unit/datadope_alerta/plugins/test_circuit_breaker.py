@@ -0,0 +1,128 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+import requests
+from redis import RedisError
+
+from datadope_alerta.plugins import RetryableException
+from datadope_alerta.plugins.circuit_breaker import CircuitBreaker, CircuitCall, CircuitOpenException
+from datadope_alerta.plugins.rate_limiter import RateLimitedException
+
+
+@pytest.fixture()
+def breaker(redis_client):
+    return CircuitBreaker(redis_client, failures=2, open_time=60, probe_interval=10)
+
+
+def _fail(breaker, now, times=1):
+    with patch('time.time', return_value=now):
+        for _ in range(times):
+            breaker.record_failure(breaker.check('test', 'destination'))
+
+
+def _check(breaker, now):
+    with patch('time.time', return_value=now), patch('random.uniform', return_value=0.0):
+        return breaker.check('test', 'destination')
+
+
+class TestsCircuitBreaker:
+
+    def test_opens_after_consecutive_failures(self, breaker):
+        _fail(breaker, 1000.0)
+        assert _check(breaker, 1000.0).tracked is True
+        _fail(breaker, 1000.0)
+        with pytest.raises(CircuitOpenException) as exc:
+            _check(breaker, 1010.0)
+        assert exc.value.retry_after == pytest.approx(50.0)
+        assert exc.value.destination == 'destination'
+        # Circuit open is rescheduled as a rate limited operation
+        assert isinstance(exc.value, RateLimitedException)
+
+    def test_retry_after_spread(self, breaker):
+        _fail(breaker, 1000.0, times=2)
+        with patch('time.time', return_value=1000.0), patch('random.uniform', return_value=5.0) as uniform:
+            with pytest.raises(CircuitOpenException) as exc:
+                breaker.check('test', 'destination')
+        uniform.assert_called_once_with(0.0, 10)
+        assert exc.value.retry_after == pytest.approx(65.0)
+
+    def test_success_resets_failures(self, breaker, redis_client):
+        _fail(breaker, 1000.0)
+        with patch('time.time', return_value=1000.0):
+            breaker.record_success(breaker.check('test', 'destination'))
+        assert not redis_client.keys(f"{CircuitBreaker.KEY_PREFIX}*")
+        _fail(breaker, 1000.0)
+        assert _check(breaker, 1000.0).tracked is True
+
+    def test_half_open_allows_one_probe_per_interval(self, breaker):
+        _fail(breaker, 1000.0, times=2)
+        probe = _check(breaker, 1060.0)
+        assert probe.tracked is True
+        with pytest.raises(CircuitOpenException) as exc:
+            _check(breaker, 1065.0)
+        assert exc.value.retry_after == pytest.approx(5.0)
+        assert _check(breaker, 1070.0).tracked is True
+
+    def test_probe_success_closes_circuit(self, breaker):
+        _fail(breaker, 1000.0, times=2)
+        with patch('time.time', return_value=1060.0):
+            breaker.record_success(breaker.check('test', 'destination'))
+        assert _check(breaker, 1061.0).tracked is False
+
+    def test_probe_failure_opens_circuit_again(self, breaker):
+        _fail(breaker, 1000.0, times=2)
+        _fail(breaker, 1060.0)
+        with pytest.raises(CircuitOpenException) as exc:
+            _check(breaker, 1070.0)
+        assert exc.value.retry_after == pytest.approx(50.0)
+
+    def test_destinations_are_independent(self, breaker):
+        _fail(breaker, 1000.0, times=2)
+        with patch('time.time', return_value=1000.0):
+            assert breaker.check('test', 'other destination').tracked is False
+            assert breaker.check('other alerter', 'destination').tracked is False
+
+    def test_destination_not_stored(self, breaker, redis_client):
+        _fail(breaker, 1000.0)
+        assert all('destination' not in x[len(CircuitBreaker.KEY_PREFIX):] for x in redis_client.keys('*'))
+
+    def test_allowed_if_redis_fails(self):
+        redis_client = MagicMock()
+        redis_client.register_script.return_value = MagicMock(side_effect=RedisError('error'))
+        breaker = CircuitBreaker(redis_client, failures=1)
+        call = breaker.check('test', 'destination')
+        assert isinstance(call, CircuitCall)
+        breaker.record_failure(call)
+
+    def test_get_circuits(self, breaker, redis_client):
+        _fail(breaker, 1000.0, times=2)
+        with patch('time.time', return_value=1000.0):
+            breaker.record_failure(breaker.check('test', 'destination2'))
+        with patch('time.time', return_value=1010.0):
+            circuits = {x['failures']: x for x in CircuitBreaker.get_circuits(redis_client, 'test')}
+        assert circuits[2]['state'] == 'open'
+        assert circuits[1]['state'] == 'closed'
+        with patch('time.time', return_value=1060.0):
+            assert [x['state'] for x in CircuitBreaker.get_circuits(redis_client) if x['failures'] == 2] == ['half_open']
+
+    def test_from_config(self, redis_client):
+        assert CircuitBreaker.from_config(None) is None
+        assert CircuitBreaker.from_config({'open_time': 10}) is None
+        with patch('datadope_alerta.get_redis_client', return_value=redis_client):
+            breaker = CircuitBreaker.from_config({'failures': 3, 'open_time': 30})
+        assert breaker.failures == 3
+        assert breaker.open_time == 30.0
+        assert breaker.probe_interval == 10.0
+
+    @pytest.mark.parametrize('exc, failure', [
+        (RetryableException('error'), True),
+        (ConnectionError('error'), True),
+        (requests.exceptions.ConnectionError('error'), True),
+        (requests.exceptions.Timeout('error'), True),
+        (requests.exceptions.HTTPError('error', response=MagicMock(status_code=503)), True),
+        (requests.exceptions.HTTPError('error', response=MagicMock(status_code=404)), False),
+        (RateLimitedException('destination', 10), False),
+        (CircuitOpenException('destination', 10), False),
+        (ValueError('error'), False)])
+    def test_is_failure(self, exc, failure):
+        assert CircuitBreaker.is_failure(exc) is failure
@@ -0,0 +1,145 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+from redis import RedisError
+
+from datadope_alerta import thread_local
+from datadope_alerta.plugins import Alerter, RetryableException, _alerters_task_context  # noqa
+from datadope_alerta.plugins.circuit_breaker import CircuitOpenException
+from datadope_alerta.plugins.delivery import DeliveryPool, DeliveryProgress
+from datadope_alerta.plugins.rate_limiter import RateLimitedException
+
+
+@pytest.fixture()
+def progress(redis_client):
+    return DeliveryProgress(redis_client, 'test', 'task_id')
+
+
+class Destination:
+    """
+    Destination recording the parts received. Parts in `failures` raise the exception once.
+    """
+
+    def __init__(self, failures=None):
+        self.received = []
+        self.failures = dict(failures or {})
+
+    def send(self, part):
+        exc = self.failures.pop(part, None)
+        if exc is not None:
+            raise exc
+        self.received.append(part)
+        return part
+
+    def parts(self, *parts):
+        return [lambda x=x: self.send(x) for x in parts]
+
+
+class DeliveryTestAlerter(Alerter):
+
+    @classmethod
+    def get_default_configuration(cls) -> dict:
+        return {}
+
+    def process_event(self, alert, reason):
+        return True, {}
+
+    def process_recovery(self, alert, reason):
+        return True, {}
+
+    def process_repeat(self, alert, reason):
+        return True, {}
+
+    def process_action(self, alert, reason, action):
+        return True, {}
+
+
+class TestsDeliveryPool:
+
+    def test_deliver(self, progress):
+        destinations = {name: Destination() for name in ('chat1', 'chat2', 'chat3')}
+        results = DeliveryPool.deliver({name: destination.parts(1, 2) for name, destination in destinations.items()},
+                                       progress=progress)
+        assert DeliveryPool.to_response(results) == (True, {name: {'delivered': 2} for name in destinations})
+        assert all(destination.received == [1, 2] for destination in destinations.values())
+        # Progress is removed when all the destinations succeed
+        assert not progress.client.exists(progress.key)
+
+    @pytest.mark.parametrize('exc', [RateLimitedException('chat2', 10), CircuitOpenException('chat2', 10),
+                                     RetryableException('error')])
+    def test_partial_failure_retries_pending_destinations(self, progress, exc):
+        chat1, chat2 = Destination(), Destination(failures={1: exc})
+        with pytest.raises(type(exc)):
+            DeliveryPool.to_response(DeliveryPool.deliver({'chat1': chat1.parts(1), 'chat2': chat2.parts(1)},
+                                                          progress=progress))
+        assert chat1.received == [1]
+        # Retry of the task
+        results = DeliveryPool.deliver({'chat1': chat1.parts(1), 'chat2': chat2.parts(1)}, progress=progress)
+        assert DeliveryPool.to_response(results) == (True, {'chat1': {'delivered': 1}, 'chat2': {'delivered': 1}})
+        assert chat1.received == [1]
+        assert chat2.received == [1]
+
+    def test_failed_part_retries_pending_parts(self, progress):
+        chat1, chat2 = Destination(), Destination(failures={2: RetryableException('error')})
+        with pytest.raises(RetryableException):
+            DeliveryPool.to_response(DeliveryPool.deliver({'chat1': chat1.parts(1, 2, 3),
+                                                           'chat2': chat2.parts(1, 2, 3)}, progress=progress))
+        assert chat2.received == [1]
+        results = DeliveryPool.deliver({'chat1': chat1.parts(1, 2, 3), 'chat2': chat2.parts(1, 2, 3)},
+                                       progress=progress)
+        assert DeliveryPool.to_response(results) == (True, {'chat1': {'delivered': 3}, 'chat2': {'delivered': 3}})
+        assert chat1.received == [1, 2, 3]
+        assert chat2.received == [1, 2, 3]
+
+    def test_retries_are_preferred_over_deferrals(self, progress):
+        chat1 = Destination(failures={1: RateLimitedException('chat1', 10)})
+        chat2 = Destination(failures={1: RetryableException('error')})
+        chat3 = Destination()
+        with pytest.raises(RetryableException):
+            DeliveryPool.to_response(DeliveryPool.deliver({'chat1': chat1.parts(1), 'chat2': chat2.parts(1),
+                                                           'chat3': chat3.parts(1)}, progress=progress))
+
+    def test_partial_failure_not_retryable(self, progress):
+        chat1, chat2 = Destination(), Destination(failures={1: ValueError('error')})
+        results = DeliveryPool.deliver({'chat1': chat1.parts(1), 'chat2': chat2.parts(1)}, progress=progress)
+        assert DeliveryPool.to_response(results) == (False, {'chat1': {'delivered': 1},
+                                                             'chat2': {'delivered': 0, 'error': 'error'}})
+
+    def test_partial_failure_without_progress(self):
+        chat1, chat2 = Destination(), Destination(failures={1: RetryableException('error')})
+        results = DeliveryPool.deliver({'chat1': chat1.parts(1), 'chat2': chat2.parts(1)})
+        success, response = DeliveryPool.to_response(results)
+        assert success is False
+        assert response['chat1'] == {'delivered': 1}
+
+    def test_partial_failure_progress_not_available(self):
+        client = MagicMock()
+        client.hmget.side_effect = RedisError('error')
+        chat1, chat2 = Destination(), Destination(failures={1: RetryableException('error')})
+        results = DeliveryPool.deliver({'chat1': chat1.parts(1), 'chat2': chat2.parts(1)},
+                                       progress=DeliveryProgress(client, 'test', 'task_id'))
+        assert DeliveryPool.to_response(results)[0] is False
+        assert chat1.received == [1]
+
+    def test_all_failed(self, progress):
+        chat1 = Destination(failures={1: ValueError('error')})
+        chat2 = Destination(failures={1: ValueError('error')})
+        with pytest.raises(ValueError):
+            DeliveryPool.to_response(DeliveryPool.deliver({'chat1': chat1.parts(1), 'chat2': chat2.parts(1)},
+                                                          progress=progress))
+
+    def test_task_context_propagated(self, redis_client):
+        alerter = DeliveryTestAlerter('delivery_test')
+        bgtask = MagicMock()
+        bgtask.request.id = 'task_id'
+        thread_local.alert_id = 'alert_id'
+        try:
+            with patch('datadope_alerta.plugins.get_redis_client', return_value=redis_client), \
+                    alerter.running_in_task(bgtask):
+                results = alerter.deliver({'chat': [lambda: (alerter.task_request, thread_local.alert_id)]})
+        finally:
+            thread_local.alert_id = None
+        assert results['chat'].responses == [(bgtask.request, 'alert_id')]
+        assert alerter.bgtask is None
+        assert alerter.task_request is None
+        assert id(alerter) not in _alerters_task_context.get({})
@@ -0,0 +1,203 @@
+import json
+from unittest.mock import patch, MagicMock
+
+import pytest
+# noinspection PyPackageRequirements
+from celery.exceptions import Retry
+from alerta.models.alert import Alert
+
+from datadope_alerta.plugins import Alerter, RateLimitedException
+from datadope_alerta.plugins.digest import DigestBuffer
+
+
+class DigestAlerter(Alerter):
+
+    @classmethod
+    def get_default_configuration(cls) -> dict:
+        return {}
+
+    def process_event(self, alert, reason):
+        return True, {}
+
+    def process_recovery(self, alert, reason):
+        return True, {}
+
+    def process_repeat(self, alert, reason):
+        return True, {}
+
+    def process_action(self, alert, reason, action):
+        return True, {}
+
+    def send_digest(self, digest_id, alerts, destination_data):
+        pass
+
+
+class NoDigestAlerter(DigestAlerter):
+    send_digest = Alerter.send_digest
+
+
+@pytest.fixture()
+def digest_buffer(redis_client):
+    return DigestBuffer(redis_client, window=60)
+
+
+def _alerter(alerter_type, digest_buffer):
+    alerter = alerter_type('digest_test')
+    alerter._digest_buffer = digest_buffer
+    alerter._digest_buffer_created = True
+    return alerter
+
+
+def _alert(alert_id):
+    return MagicMock(id=alert_id, resource='resource', event='event', environment='Production', severity='major',
+                     service=['service'], group='group', value='value', text='text', create_time=None)
+
+
+class TestsDigestBuffer:
+
+    def test_add_and_take(self, digest_buffer):
+        digest_id, created = digest_buffer.add('alerter', 'destination', {'id': 'alert1'})
+        assert created is True
+        other_id, created = digest_buffer.add('alerter', 'destination', {'id': 'alert2'})
+        assert created is False
+        assert other_id == digest_id
+        new_id, created = digest_buffer.add('alerter', 'other', {'id': 'alert3'})
+        assert created is True
+        assert new_id != digest_id
+
+        assert digest_buffer.take('alerter', 'destination') == (digest_id, [{'id': 'alert1'}, {'id': 'alert2'}])
+        assert digest_buffer.take('alerter', 'destination') == (None, [])
+        # Alerts buffered after taking the digest belong to a new digest
+        new_id, created = digest_buffer.add('alerter', 'destination', {'id': 'alert4'})
+        assert created is True
+        assert new_id != digest_id
+
+
+class TestsAddToDigest:
+
+    def test_flush_scheduled(self, digest_buffer):
+        alerter = _alerter(DigestAlerter, digest_buffer)
+        with patch('datadope_alerta.bgtasks.digest.flush_digest.apply_async') as apply_async:
+            digest_id = alerter.add_to_digest(_alert('alert1'), 'process_event', 'destination', {})
+            assert digest_id is not None
+            apply_async.assert_called_once()
+            assert apply_async.call_args.kwargs['countdown'] == 60
+            assert alerter.add_to_digest(_alert('alert2'), 'process_event', 'destination', {}) == digest_id
+            apply_async.assert_called_once()
+
+    def test_only_events(self, digest_buffer):
+        alerter = _alerter(DigestAlerter, digest_buffer)
+        assert alerter.add_to_digest(_alert('alert1'), 'process_recovery', 'destination', {}) is None
+
+    def test_not_buffered_if_send_digest_not_implemented(self, digest_buffer):
+        alerter = _alerter(NoDigestAlerter, digest_buffer)
+        assert alerter.add_to_digest(_alert('alert1'), 'process_event', 'destination', {}) is None
+        assert digest_buffer.take('digest_test', 'destination') == (None, [])
+
+    def test_sent_now_if_flush_cannot_be_scheduled(self, digest_buffer):
+        alerter = _alerter(DigestAlerter, digest_buffer)
+        with patch('datadope_alerta.bgtasks.digest.flush_digest.apply_async', side_effect=ConnectionError()), \
+                patch.object(alerter, 'send_digest') as send_digest:
+            # Only this alert is buffered: caller sends it as a normal notification
+            assert alerter.add_to_digest(_alert('alert1'), 'process_event', 'destination', {}) is None
+            send_digest.assert_not_called()
+            assert digest_buffer.take('digest_test', 'destination') == (None, [])
+
+            # Another alert added concurrently to the digest is sent with this one
+            digest_id, _ = digest_buffer.add('digest_test', 'destination', {'id': 'alert2'})
+            with patch.object(digest_buffer, 'add', return_value=(digest_id, True)):
+                digest_buffer.client.rpush(digest_buffer._keys('digest_test', 'destination')[1], '{"id": "alert3"}')
+                assert alerter.add_to_digest(_alert('alert3'), 'process_event', 'destination',
+                                             {'chat': 'chat'}) == digest_id
+            send_digest.assert_called_once_with(digest_id, [{'id': 'alert2'}, {'id': 'alert3'}], {'chat': 'chat'})
+
+
+class TestsDigestCredentials:
+
+    @staticmethod
+    def _buffer(alerter_type, alerter_name, digest_buffer, alert):
+        alerter = alerter_type(alerter_name)
+        alerter._digest_buffer = digest_buffer
+        alerter._digest_buffer_created = True
+        with patch('datadope_alerta.bgtasks.digest.flush_digest.apply_async') as apply_async:
+            success, response = alerter.process_event(alert, None)
+        assert success is True
+        assert response['digests']
+        return alerter, apply_async.call_args.kwargs['args']
+
+    def test_telegram_token_not_in_task(self, digest_buffer):
+        from datadope_alerta.plugins.telegram.telegram import TelegramAlerter
+        alert = Alert(resource='resource', event='event', environment='Production', severity='major',
+                      attributes={'eventTags': {'TELEGRAM_CHATS': '@chat', 'TELEGRAM_BOT': 'Datadope_bot'}})
+        alerter, args = self._buffer(TelegramAlerter, 'telegram', digest_buffer, alert)
+        assert 'the_token' not in json.dumps(args)
+        assert args[3]['chat_id'] == '@chat'
+        with patch.object(alerter, 'find_digest_alerts', return_value=iter([alert])), \
+                patch.object(alerter, '_send_telegram_message') as send:
+            alerter.send_digest('digest', [DigestBuffer.entry_for_alert(alert)], args[3])
+        assert send.call_args.args[1:3] == ('the_token', '@chat')
+
+    def test_gchat_url_not_in_task(self, digest_buffer):
+        from datadope_alerta.plugins.gchat.gchat_plugin import GChatAlerter
+        chat_url = 'https://chat.googleapis.com/v1/spaces/space1/messages?key=the_key&token=the_token'
+        alert = Alert(resource='resource', event='event', environment='Production', severity='major',
+                      attributes={'eventTags': {'GCHAT': chat_url}})
+        alerter, args = self._buffer(GChatAlerter, 'gchat', digest_buffer, alert)
+        assert 'the_key' not in json.dumps(args)
+        assert 'the_token' not in json.dumps(args)
+        with patch.object(alerter, 'find_digest_alerts', return_value=iter([alert])), \
+                patch.object(alerter, '_deliver', return_value=200) as deliver:
+            alerter.send_digest('digest', [DigestBuffer.entry_for_alert(alert)], args[3])
+        assert deliver.call_args.args[0] == chat_url
+
+    def test_credentials_not_available(self, digest_buffer):
+        from datadope_alerta.plugins.gchat.gchat_plugin import GChatAlerter
+        alerter = GChatAlerter('gchat')
+        with patch.object(alerter, 'find_digest_alerts', return_value=iter([])), \
+                patch.object(alerter, '_deliver') as deliver, \
+                pytest.raises(ValueError):
+            alerter.send_digest('digest', [{'id': 'alert1'}], {'space': 'https://chat.googleapis.com/v1/spaces/x'})
+        deliver.assert_not_called()
+
+
+class TestsFlushDigest:
+
+    def test_recovered_alerts_discarded(self):
+        from datadope_alerta.bgtasks import digest
+
+        summary = {
+            'alert1': {'test': {'status': 'processed'}},
+            'alert2': {'test': {'status': 'recovered'}},
+            'alert3': {'test': {'status': 'recovering'}}
+        }
+        with patch.object(digest.db, 'backend_alerters') as backend:
+            backend.get_alerters_summary.return_value = summary
+            alerts = digest._discard_recovered('test', [{'id': 'alert1'}, {'id': 'alert2'}, {'id': 'alert3'},
+                                                        {'id': 'deleted'}])
+        assert alerts == [{'id': 'alert1'}]
+
+    def test_all_sent_if_status_not_available(self):
+        from datadope_alerta.bgtasks import digest
+
+        with patch.object(digest.db, 'backend_alerters') as backend:
+            backend.get_alerters_summary.side_effect = Exception('error')
+            assert digest._discard_recovered('test', [{'id': 'alert1'}]) == [{'id': 'alert1'}]
+
+    @pytest.mark.parametrize('deferrals, deferred', [(1, True), (2, False)])
+    def test_deferrals_limited(self, deferrals, deferred):
+        from datadope_alerta.bgtasks.digest import flush_digest
+        alerter = MagicMock()
+        alerter.send_digest.side_effect = RateLimitedException('destination', 10.0)
+        flush_digest.push_request(id='task_id', retries=deferrals)
+        try:
+            with patch.dict(pytest.app.config, {'ALERTERS_MAX_DEFERRALS': 2}), \
+                    patch('datadope_alerta.bgtasks.digest.AlerterRegistry.get_alerter', return_value=alerter), \
+                    patch.object(flush_digest, 'retry', side_effect=Retry()) as retry, \
+                    pytest.raises(Retry):
+                flush_digest.run('class', 'digest_test', 'destination', {}, digest_id='digest',
+                                 alerts=[{'id': 'alert1'}], deferrals=deferrals)
+        finally:
+            flush_digest.pop_request()
+        options = retry.call_args.kwargs
+        assert options['kwargs']['deferrals'] == (deferrals + 1 if deferred else deferrals)
+        assert options['countdown'] == (10.0 if deferred else 30.0)
@@ -0,0 +1,122 @@
+from collections import Counter
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from datadope_alerta.plugins.priority_lanes import PriorityLanes, WeightedLaneCycle
+
+LANES = [
+    {"name": "critical", "severity": ["critical"], "weight": 8},
+    {"name": "payments", "severity": ["major", "high"], "attributes": {"service": ["payments", "billing"]},
+     "weight": 4},
+    {"name": "low", "severity": "minor", "operations": ["new"], "queue": "low_queue"}
+]
+
+
+def _alert(severity, **attributes):
+    return MagicMock(severity=severity, attributes=attributes)
+
+
+def _cycle(queues, weights, default_weight=1.0):
+    cycle = WeightedLaneCycle(list(queues))
+    cycle._weights = weights
+    cycle._default_weight = default_weight
+    return cycle
+
+
+class TestsPriorityLanes:
+
+    @pytest.mark.parametrize('alert, operation, lane', [
+        (_alert('critical'), 'new', 'critical'),
+        (_alert('critical', service='payments'), 'recovery', 'critical'),
+        (_alert('major', service='payments'), 'new', 'payments'),
+        (_alert('high', service='billing'), 'repeat', 'payments'),
+        (_alert('major', service='other'), 'new', None),
+        (_alert('major'), 'new', None),
+        (_alert('minor'), 'new', 'low'),
+        (_alert('minor'), 'recovery', None),
+        (_alert('warning'), 'new', None)])
+    def test_select(self, alert, operation, lane):
+        selected = PriorityLanes(LANES).select(alert, operation)
+        assert (selected['name'] if selected else None) == lane
+
+    def test_lanes_without_name_ignored(self):
+        lanes = PriorityLanes([{"severity": "critical"}, "critical", {"name": "all"}])
+        assert lanes.select(_alert('critical'), 'new') == {"name": "all"}
+
+    def test_from_config(self):
+        assert PriorityLanes.from_config({'PRIORITY_LANES': []}) is None
+        assert PriorityLanes.from_config({'PRIORITY_LANES': LANES}).lanes == LANES
+
+    @pytest.mark.parametrize('lane, queue', [(LANES[0], 'alert.critical'), (LANES[2], 'low_queue')])
+    def test_apply(self, lane, queue):
+        task_specification = {'queue': 'alert', 'priority': 3}
+        PriorityLanes.apply(task_specification, lane, 'default')
+        assert task_specification == {'queue': queue, 'priority': 3, 'lane': lane['name']}
+
+    def test_apply_default_queue(self):
+        task_specification = {}
+        PriorityLanes.apply(task_specification, LANES[0], 'default')
+        assert task_specification['queue'] == 'default.critical'
+
+    def test_priority_ignored(self):
+        lane = {"name": "urgent", "severity": "critical", "priority": 0}
+        with patch.object(PriorityLanes, '_ignored_priorities', set()), \
+                patch('datadope_alerta.plugins.priority_lanes.logger') as logger:
+            PriorityLanes([lane])
+            PriorityLanes([lane])
+        logger.warning.assert_called_once()
+        task_specification = {'queue': 'alert', 'priority': 3}
+        PriorityLanes.apply(task_specification, lane, 'alert')
+        assert task_specification['priority'] == 3
+
+
+class TestsWeightedLaneCycle:
+
+    def test_share_proportional_to_weight(self):
+        cycle = _cycle(['alert.critical', 'alert.payments', 'alert.low'],
+                       {'critical': 8.0, 'payments': 4.0, 'low': 1.0})
+        first = Counter(cycle.consume(3)[0] for _ in range(130))
+        assert first == {'alert.critical': 80, 'alert.payments': 40, 'alert.low': 10}
+
+    def test_smooth_order(self):
+        cycle = _cycle(['a', 'b', 'c'], {'a': 5.0, 'b': 1.0, 'c': 1.0})
+        # Smooth weighted round-robin interleaves the lighter queues instead of sending them in a burst
+        assert [cycle.consume(3)[0] for _ in range(7)] == ['a', 'a', 'b', 'a', 'c', 'a', 'a']
+
+    def test_remaining_queues_by_weight(self):
+        cycle = _cycle(['low', 'payments', 'critical'], {'critical': 8.0, 'payments': 4.0, 'low': 1.0})
+        assert cycle.consume(3) == ['critical', 'payments', 'low']
+        assert cycle.consume(3) == ['payments', 'critical', 'low']
+
+    def test_default_weight(self):
+        cycle = _cycle(['alert', 'alert.critical'], {'critical': 3.0}, default_weight=1.0)
+        first = Counter(cycle.consume(2)[0] for _ in range(4))
+        assert first == {'alert.critical': 3, 'alert': 1}
+
+    def test_weight_lookup(self):
+        cycle = _cycle([], {'critical': 8.0, 'low_queue': 2.0, 'negative': -1.0}, default_weight=1.5)
+        assert cycle.get_weight('alert.critical') == 8.0
+        assert cycle.get_weight('low_queue') == 2.0
+        assert cycle.get_weight('alert') == 1.5
+        assert cycle.get_weight('negative') == 0.0
+
+    def test_consume_only_first_queues(self):
+        cycle = _cycle(['a', 'b', 'c'], {'a': 1.0, 'b': 1.0, 'c': 10.0})
+        assert cycle.consume(1) == ['a']
+        assert 'c' not in cycle.consume(2)
+
+    def test_update_forgets_removed_queues(self):
+        cycle = _cycle(['a', 'b'], {'a': 2.0, 'b': 1.0})
+        cycle.consume(2)
+        cycle.update(['a', 'c'])
+        assert cycle.items == ['a', 'c']
+        assert set(cycle._current) == {'a'}
+
+    def test_load_weights(self):
+        conf = {'PRIORITY_LANES': LANES, 'PRIORITY_LANES_DEFAULT_WEIGHT': 2.0}
+        with patch('celery.current_app', MagicMock(conf=conf)):
+            cycle = WeightedLaneCycle()
+            assert cycle.get_weight('alert.critical') == 8.0
+        assert cycle.get_weight('low_queue') == 1.0
+        assert cycle.get_weight('alert') == 2.0
@@ -0,0 +1,64 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+from redis import RedisError
+
+from datadope_alerta.plugins.rate_limiter import RateLimiter, RateLimitedException, raise_for_rate_limit
+
+
+class TestsRateLimiter:
+
+    def test_burst(self, redis_client):
+        limiter = RateLimiter(redis_client, rate=1, burst=3)
+        with patch('time.time', return_value=1000.0):
+            for _ in range(3):
+                limiter.acquire('destination')
+            with pytest.raises(RateLimitedException) as exc:
+                limiter.acquire('destination')
+        assert exc.value.destination == 'destination'
+        assert exc.value.retry_after == pytest.approx(1.0)
+
+    def test_refill(self, redis_client):
+        limiter = RateLimiter(redis_client, rate=2, burst=1)
+        with patch('time.time', return_value=1000.0):
+            limiter.acquire('destination')
+        with patch('time.time', return_value=1000.5):
+            limiter.acquire('destination')
+
+    def test_destinations_are_independent(self, redis_client):
+        limiter = RateLimiter(redis_client, rate=1, burst=1)
+        with patch('time.time', return_value=1000.0):
+            limiter.acquire('destination1')
+            limiter.acquire('destination2')
+
+    def test_wait(self, redis_client):
+        limiter = RateLimiter(redis_client, rate=1, burst=1, max_wait=2)
+        with patch('time.time', return_value=1000.0), patch('time.sleep') as sleep:
+            limiter.acquire('destination')
+            sleep.assert_not_called()
+            limiter.acquire('destination')
+            sleep.assert_called_once_with(pytest.approx(1.0))
+            limiter.acquire('destination')
+            assert sleep.call_args.args[0] == pytest.approx(2.0)
+            # Not reserved if the wait is longer than max_wait
+            with pytest.raises(RateLimitedException):
+                limiter.acquire('destination')
+
+    def test_not_limited_if_redis_fails(self):
+        redis_client = MagicMock()
+        redis_client.register_script.return_value = MagicMock(side_effect=RedisError('error'))
+        limiter = RateLimiter(redis_client, rate=1)
+        assert limiter.reserve('destination') == 0.0
+
+    def test_invalid_rate(self, redis_client):
+        with pytest.raises(ValueError):
+            RateLimiter(redis_client, rate=0)
+
+    def test_raise_for_rate_limit(self):
+        raise_for_rate_limit(MagicMock(status_code=200), 'destination')
+        with pytest.raises(RateLimitedException) as exc:
+            raise_for_rate_limit(MagicMock(status_code=429, headers={'Retry-After': '12'}), 'destination')
+        assert exc.value.retry_after == 12.0
+        with pytest.raises(RateLimitedException) as exc:
+            raise_for_rate_limit(MagicMock(status_code=429, headers={}), 'destination', retry_after=3)
+        assert exc.value.retry_after == 3